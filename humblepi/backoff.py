@@ -0,0 +1,120 @@
+"""When to try reconnecting to the MQTT broker.
+
+If the broker restarts, every display loses its connection at the
+same moment. Retrying on a fixed schedule would have them all come
+back at once, again and again. Instead, each failure doubles the
+longest wait (up to a cap), and the actual wait is picked at random
+between zero and that limit ("full jitter"), which spreads the
+reconnects out. After too many failures in a row a circuit breaker
+opens and attempts stop for a longer cool-down, then a single trial
+attempt decides whether to close it again.
+
+"""
+
+import enum
+import random
+import logging
+
+from .clock import SYSTEM_CLOCK
+
+
+log = logging.getLogger(__name__)
+
+
+class ReconnectPolicy():
+    """Exponential backoff with full jitter and a circuit breaker.
+
+    Call :py:meth:`allow` before each attempt, then
+    :py:meth:`record_attempt`. Report the outcome with
+    :py:meth:`record_success` or :py:meth:`record_failure`. An attempt
+    that is not resolved within *timeout* seconds counts as a failure.
+
+    Parameters
+    ==========
+    base
+      Longest wait after the first failure, in seconds.
+    cap
+      Longest wait between attempts while the breaker is closed.
+    failure_threshold
+      Failures in a row that open the breaker.
+    cooldown
+      Seconds to wait while the breaker is open.
+    timeout
+      Seconds to wait for an attempt to succeed or fail.
+    clock
+      Clock whose ``monotonic()`` time is used.
+    rng
+      Source of randomness, eg. a seeded :py:class:`random.Random`.
+
+    """
+    class states(enum.IntEnum):
+        CLOSED = 0 # Attempts allowed, with backoff
+        OPEN = 1 # No attempts until the cool-down ends
+        HALF_OPEN = 2 # One trial attempt allowed
+
+    def __init__(self, base=1., cap=300., failure_threshold=10, cooldown=900.,
+                 timeout=30., clock=SYSTEM_CLOCK, rng=random):
+        self.base = base
+        self.cap = cap
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.clock = clock
+        self.rng = rng
+        self.state = self.states.CLOSED
+        self.failures = 0
+        self.next_attempt = 0.
+        self._pending = None # Deadline of an unresolved attempt
+
+    def max_delay(self) -> float:
+        """The longest wait after the current number of failures."""
+        return min(self.cap, self.base * 2 ** max(self.failures - 1, 0))
+
+    def delay(self) -> float:
+        """Seconds until the next attempt is allowed."""
+        if self._pending is not None:
+            return max(self._pending - self.clock.monotonic(), 0.)
+        return max(self.next_attempt - self.clock.monotonic(), 0.)
+
+    def allow(self) -> bool:
+        """Whether an attempt may be made now."""
+        now = self.clock.monotonic()
+        if self._pending is not None:
+            if now < self._pending:
+                return False
+            log.debug("Reconnect attempt timed out.")
+            self.record_failure()
+        if now < self.next_attempt:
+            return False
+        if self.state == self.states.OPEN:
+            log.info("Trying one reconnect after the cool-down.")
+            self.state = self.states.HALF_OPEN
+        return True
+
+    def record_attempt(self):
+        """Note that an attempt has started."""
+        self._pending = self.clock.monotonic() + self.timeout
+
+    def record_success(self):
+        """The connection is up: close the breaker and reset the backoff."""
+        if self.state != self.states.CLOSED:
+            log.info("Reconnected, closing the circuit breaker.")
+        self.state = self.states.CLOSED
+        self.failures = 0
+        self.next_attempt = 0.
+        self._pending = None
+
+    def record_failure(self):
+        """An attempt failed, or the connection was lost: schedule the
+        next attempt."""
+        now = self.clock.monotonic()
+        self._pending = None
+        self.failures += 1
+        if self.state == self.states.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.states.OPEN:
+                log.warning("%d reconnects failed, waiting %d s before trying again.",
+                            self.failures, self.cooldown)
+            self.state = self.states.OPEN
+            self.next_attempt = now + self.cooldown
+        else:
+            self.next_attempt = now + self.rng.uniform(0, self.max_delay())
@@ -0,0 +1,72 @@
+"""Clocks that can be plugged into the status engine.
+
+Everything that needs the current time or has to wait goes through a
+clock object, so tests and simulations can swap the real clock for a
+:py:class:`VirtualClock` and run days of events in milliseconds.
+
+"""
+
+import asyncio
+import datetime as dt
+import time
+
+import pytz
+
+
+class SystemClock():
+    """The real wall clock."""
+    def now(self, timezone=None) -> dt.datetime:
+        """The current time in *timezone*, or naive local time if
+        ``None``."""
+        return dt.datetime.now(timezone)
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def sleep_async(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock():
+    """A clock that only moves forward when told to.
+
+    Sleeping advances the clock immediately instead of waiting.
+
+    Parameters
+    ==========
+    start
+      An aware datetime to start from. Defaults to the current time.
+
+    """
+    def __init__(self, start: dt.datetime=None):
+        if start is None:
+            start = dt.datetime.now(pytz.utc)
+        self._now = start
+        self._monotonic = 0.
+
+    def now(self, timezone=None) -> dt.datetime:
+        if timezone is None:
+            return self._now.astimezone().replace(tzinfo=None)
+        return self._now.astimezone(timezone)
+
+    def monotonic(self) -> float:
+        return self._monotonic
+
+    def advance(self, seconds):
+        """Move the clock forward by *seconds*."""
+        self._now += dt.timedelta(seconds=seconds)
+        self._monotonic += seconds
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    async def sleep_async(self, seconds):
+        self.advance(seconds)
+        # Still let other tasks run
+        await asyncio.sleep(0)
+
+
+SYSTEM_CLOCK = SystemClock()
@@ -3,23 +3,23 @@ depending on how long it's been since he's been outisde and pooped.
 
 """
 
-import time
-import csv
-import datetime as dt
-import pytz
 import os
-from typing import Optional
-import enum
-import configparser
 import logging
-from traceback import format_exception
 import subprocess
 
+import pytz
 from PyQt5 import QtCore
 from PyQt5.QtCore import pyqtSignal
-from paho.mqtt import client as mqtt_client
 
 from basestatus import BaseStatus, WHITE, RED, GREEN, BLUE, CYAN, MAGENTA, YELLOW
+from .backoff import ReconnectPolicy
+from .clock import SYSTEM_CLOCK
+from .engine import (ActionTracker, StatusEngine, load_config,
+                     CONFIG_FILE, PEE_WARNING, PEE_OVERDUE, POOP_WARNING, POOP_OVERDUE)
+from .engine_process import (SharedState, connect_engine, engine_names,
+                             start_engine_process)
+from .eventlog import Action, DogEvent, EventIndex
+from .storage import open_log
 
 log = logging.getLogger(__name__)
 
@@ -62,288 +62,271 @@ def color(outside, pooping):
     return out
 
 
-class DogAction(QtCore.QObject):
-    name = ''
-    _last_status = 0
-    _last_time = '--:--'
-    seconds_warning = 3600
-    seconds_overdue = 3600
-    time_speedup = 1
-    
+class DogAction(ActionTracker, QtCore.QObject):
+    """Qt adapter for :py:class:`~humblepi.engine.ActionTracker`."""
     # Signals
     status_changed = pyqtSignal(int)
     time_changed = pyqtSignal(str)
+
+
+class DogStatus(StatusEngine, QtCore.QThread):
+    """Qt adapter that runs the :py:class:`~humblepi.engine.StatusEngine`
+    in its own thread."""
+    peeing = DogAction(seconds_warning=PEE_WARNING, seconds_overdue=PEE_OVERDUE)
+    pooping = DogAction(seconds_warning=POOP_WARNING, seconds_overdue=POOP_OVERDUE)
     
-    # Possible states
-    class states(enum.IntEnum):
-        UNKNOWN = 0
-        NORMAL = 1
-        WARNING = 2
-        OVERDUE = 3
-    
-    def __init__(self, seconds_warning: int=3600, seconds_overdue: int=3600, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.last_time = dt.datetime.now(self.timezone)
-        self.seconds_warning = seconds_warning
-        self.seconds_overdue = seconds_overdue
-    
-    def __set_name__(self, owner, name):
-        self.owner = owner
-        self.name = name
-    
-    @property
-    def timezone(self):
-        if hasattr(self, 'owner'):
-            timezone = self.owner.timezone
-        else:
-            timezone = pytz.utc
-        return timezone
-    
-    def reset_time(self,
-                   new_time: Optional[dt.datetime]=None, force=False):
-        """Set the current time as the last action time.
-        
-        Parameters
-        ==========
-        new_time
-          The new datetime to set. If ommitted, the current time will
-          be used.
-        force
-          If true, the time will be set no matter what, otherwise, the
-          time will only be set if it's newer that the current time.
-        
-        """
-        if new_time in [None, True, False]:
-            new_time = dt.datetime.now(self.timezone)
-        update_needed = (new_time > self.last_time) or force
-        if update_needed:
-            log.debug('Resetting {} to {}'.format(self.name, new_time))
-            self.last_time = new_time
-    
-    def seconds(self) -> int:
-        """Return the time (in seconds) since puppy has taken this action."""
-        # Determine correct timezone
-        now = dt.datetime.now(self.timezone)
-        elapsed_time = now - self.last_time
-        seconds = int(elapsed_time.total_seconds() * self.time_speedup)
-        return seconds
-    
-    def time_string(self) -> str:
-        """Prepare a string of how long it's been since puppy went outside."""
-        seconds = self.seconds()
-        hours = int((seconds / 3600))
-        minutes = int((seconds % 3600) / 60)
-        # Prepare the formatted string
-        fmt = '{hours}:{minutes:02d}'
-        time_str = fmt.format(hours=hours, minutes=minutes)
-        return time_str
-    
-    def status(self) -> int:
-        """Determine whether this action is overdue or not.
-        
-        Returns
-        =======
-        status
-          A member of self.states enum showing the current status
-          (eg. self.states.NORMAL).
-        
-        """
-        seconds = self.seconds()
-        if 0 <= seconds < self.seconds_warning:
-            status = self.states.NORMAL
-        elif self.seconds_warning <= seconds < self.seconds_overdue:
-            status = self.states.WARNING
-        elif self.seconds_overdue <= seconds:
-            status = self.states.OVERDUE
-        else:
-            status = self.states.UNKNOWN
-        return status
-    
-    def check_status_change(self):
-        """Compare current and last seen status, and emit a signal if it
-        changed."""
-        # Check overdue status
-        new_status = self.status()
-        if new_status != self._last_status:
-            self.status_changed.emit(new_status)
-            self._last_status = new_status
-        # check time string
-        new_time = self.time_string()
-        if new_time != self._last_time:
-            self.time_changed.emit(new_time)
-            self._last_time = new_time
+    # Signals
+    mqtt_connection_changed = pyqtSignal(bool)
+    wifi_connection_changed = pyqtSignal(bool)
+    snapshot_changed = pyqtSignal(object)
+    config_changed = pyqtSignal()
 
 
-def load_config():
-    config = configparser.ConfigParser()
-    config['MQTT'] = {
-        'username': '',
-        'password': '',
-        'hostname': 'localhost',
-        'port': 8883,
-        'use_tls': True,
-    }
-    config.read(os.path.expanduser('~/.humblepirc'))
-    return config
+class DogStatusProcess(QtCore.QObject):
+    """Qt stand-in for :py:class:`DogStatus` that runs the engine in
+    a separate process (see :py:mod:`humblepi.engine_process`).
 
+    The shared state is polled every ``poll_interval`` seconds, which
+    costs one integer comparison when nothing has changed. Button
+    presses are sent to the engine as commands. An engine that is
+    already running for the same log (eg. from before the GUI crashed)
+    is reattached to rather than started again. If the engine process
+    dies it is started again, backing off if it keeps dying, and
+    commands sent in the meantime are kept until it's back.
 
-class DogStatus(QtCore.QThread):
-    dog_name = 'sheffield'
-    peeing = DogAction(seconds_warning=6*3600, seconds_overdue=8*3600)
-    pooping = DogAction(seconds_warning=18*3600, seconds_overdue=24*3600)
-    # peeing = DogAction(seconds_warning=6*3, seconds_overdue=8)
-    # pooping = DogAction(seconds_warning=18*3, seconds_overdue=24)
-    logfile = os.path.expanduser("~/sheffield-bathroom-log.tsv")
-    mqtt_client = None
+    """
+    poll_interval = 0.05 # seconds
+    clock = SYSTEM_CLOCK
     timezone = pytz.timezone('America/Chicago')
-    mqtt_hostname = None
-    mqtt_port = None
+    logfile = os.path.expanduser("~/sheffield-bathroom-log.tsv")
+    log_backend = 'auto'
+    dog_name = 'sheffield'
     
     # Signals
     mqtt_connection_changed = pyqtSignal(bool)
     wifi_connection_changed = pyqtSignal(bool)
+    snapshot_changed = pyqtSignal(object)
+    
+    def __init__(self, config_file=CONFIG_FILE, connect_mqtt=True, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config_file = config_file
+        self.connect_mqtt = connect_mqtt
+        self.state = None
+        self.process = None # Only set if the engine was started from here
+        self.conn = None
+        self.pending = [] # Commands waiting for the engine to come back
+        self.restarts = 0
+        self.restart_policy = ReconnectPolicy(base=1, cap=60,
+                                              failure_threshold=float('inf'))
+        self._sequence = 0
+        self._engine_state = None
+        self._events = None
+        self.timer = QtCore.QTimer(self, singleShot=False)
+        self.timer.timeout.connect(self.poll)
+    
+    def reload_config(self):
+        """Read the settings the GUI needs from the config file."""
+        dog = load_config(self.config_file)['dog']
+        self.dog_name = dog['name']
+        self.logfile = os.path.expanduser(dog['logfile'])
+        self.log_backend = dog['log_backend']
+        self.timezone = pytz.timezone(dog['timezone'])
     
-    def prepare_mqtt(self):
-        config = load_config()['MQTT']
-        # Log into the MQTT client
-        self.mqtt_client = mqtt_client.Client()
-        if config.getboolean('use_tls'):
-            self.mqtt_client.tls_set()
-            log.debug("TLS enabled for MQTT")
-        self.mqtt_client.username_pw_set(
-            username=config['username'],
-            password=config['password'])
-        log.debug("Connecting to MQTT server '%s:%d'",
-                  config['hostname'], config.getint('port'))
-        self.mqtt_hostname = config['hostname']
-        self.mqtt_port = config['port']
+    def load_datetimes(self):
+        """Read the log, for the history view."""
+        event_log = open_log(self.logfile, backend=self.log_backend,
+                             dog=self.dog_name, timezone=self.timezone)
         try:
-            self.mqtt_client.connect(host=config['hostname'],
-                                     port=config.getint('port'))
-        except Exception as e:
-            self.update_mqtt_status(was_successful=False, exception=e)
-        else:
-            self.update_mqtt_status(was_successful=True)
-        # Connect signals for MQTT client
-        self.peeing.status_changed.connect(self.update_mqtt)
-        self.pooping.status_changed.connect(self.update_mqtt)
+            self._events = event_log.load()
+        finally:
+            event_log.close()
     
-    def run(self):
-        # Start loop waiting for status changes
-        while True:
-            self.pooping.check_status_change()
-            self.peeing.check_status_change()
-            time.sleep(1)
+    @property
+    def events(self) -> EventIndex:
+        """The logged events.
+        
+        Events committed from here are added as they are sent, so the
+        log is only read again if the engine has logged events this
+        side hasn't seen.
+        
+        """
+        state = self._engine_state
+        if self._events is None or (state is not None
+                                    and state.event_count > len(self._events)):
+            self.load_datetimes()
+        return self._events
     
-    def log_poop(self, when=None):
-        self.log_action(pooped=True, when=when)
+    def connect_puppy_view(self, view):
+        view.pee_button_clicked.connect(self.log_pee)
+        view.poop_button_clicked.connect(self.log_poop)
+        view.events_added.connect(self.commit_events)
     
     def log_pee(self, when=None):
         self.log_action(pooped=False, when=when)
     
-    def log_action(self, pooped=True, fpath=None, when=None):
-        # Determine default file path and action time if necessary
-        if fpath is None:
-            fpath = self.logfile
+    def log_poop(self, when=None):
+        self.log_action(pooped=True, when=when)
+    
+    def log_action(self, pooped=True, when=None):
         if when in [None, True, False]:
-            when = dt.datetime.now(self.timezone)
-        # Logging
-        with open(fpath, 'a') as f:
-            line = '{timestamp}\t{pooped}\n'
-            line = line.format(timestamp=when.isoformat(), pooped=pooped)
-            f.write(line)
+            when = self.clock.now(self.timezone)
+        action = Action.POOP if pooped else Action.PEE
+        self.commit_events([DogEvent.from_datetime(when, action)])
+    
+    def commit_events(self, events):
+        """Have the engine commit several events together."""
+        events = list(events)
+        if not events:
+            return
+        if self._events is not None:
+            for event in events:
+                self._events.insert(event)
+        self.send(('commit', [(event.epoch, int(event.action)) for event in events]))
     
-    def load_datetimes(self, fpath=None):
-        """Read the latest datetime stamps from the log file.
+    def send(self, command):
+        """Send a command to the engine, or keep it for later if the
+        engine isn't running.
         
-        Parameters
-        ==========
-        fpath
-          Path to the log file to be used. If omitted, the value of
-          ``self.logfile`` will be used.
+        Events waiting for the engine are merged into one commit, so
+        it catches up in a single write.
+        
+        """
+        if command[0] == 'commit' and self.pending and self.pending[-1][0] == 'commit':
+            self.pending[-1] = ('commit', self.pending[-1][1] + command[1])
+        else:
+            self.pending.append(command)
+        self.flush()
+    
+    def flush(self):
+        """Send any commands waiting for the engine."""
+        if self.conn is None:
+            return
+        try:
+            while self.pending:
+                self.conn.send(self.pending[0])
+                self.pending.pop(0)
+        except (BrokenPipeError, OSError):
+            log.warning("Engine process not answering, %d commands waiting.",
+                        len(self.pending))
+    
+    def connect_engine(self):
+        """Attach to the engine for this log, if it's running.
         
         Returns
         =======
-        last_out
-          The datetime when the dog last peed.
-        last_poop
-          The datetime when the dog last pooped.
+        connected
+          True if the engine was found.
         
         """
-        last_poop = None
-        last_out = None       
-        # Get default filepath if necessary
-        if fpath is None:
-            fpath = self.logfile
-        if os.path.exists(fpath):
-            # Convert and apply datetimes
-            def format_datetime(when):
-                when = dt.datetime.fromisoformat(when)
-                # Convert naive timezone to aware timezone
-                if when.tzinfo is None:
-                    when = self.timezone.localize(when)
-                return when
-            # Read the file
-            with open(fpath) as tsvin:
-                tsvin = csv.reader(tsvin, delimiter='\t')
-                for line in tsvin:
-                    new_dt = format_datetime(line[0])
-                    is_new_poop = line[1] == "True" and (last_poop is None or new_dt > last_poop)
-                    is_new_pee = (last_out is None or new_dt > last_out)
-                    if line[0][0] == '#':
-                        pass
-                    elif is_new_poop:
-                        last_poop = new_dt
-                    elif is_new_pee:
-                        last_out = new_dt
-            if last_out is not None:
-                self.peeing.reset_time(last_out, force=True)
-            if last_poop is not None:
-                self.pooping.reset_time(last_poop, force=True)
-        return last_out, last_poop
+        state_name, address = engine_names(self.logfile)
+        conn = connect_engine(address)
+        if conn is None:
+            return False
+        try:
+            state = SharedState(state_name)
+        except FileNotFoundError:
+            conn.close()
+            return False
+        self.conn, self.state = conn, state
+        self._sequence = 0
+        log.info("Connected to the engine for %s", self.logfile)
+        self.flush()
+        return True
     
-    def connect_puppy_view(self, view):
-        view.pee_button_clicked.connect(self.peeing.reset_time)
-        view.pee_button_clicked.connect(self.peeing.check_status_change)
-        view.pee_button_clicked.connect(self.log_pee)
-        view.poop_button_clicked.connect(self.pooping.reset_time)
-        view.poop_button_clicked.connect(self.pooping.check_status_change)
-        view.poop_button_clicked.connect(self.log_poop)
+    def disconnect_engine(self):
+        if self.conn is not None:
+            self.conn.close()
+        if self.state is not None:
+            self.state.close()
+        self.conn, self.state = None, None
     
-    def update_mqtt(self, new_state=None, client=None):
-        # Determine the most severe state
-        max_state = max(self.pooping.status(), self.peeing.status())
-        # Send the message to the MQTT server
-        topic = 'dogstatus/{}/outside'.format(self.dog_name)
-        payload = max_state.name
-        if client is None:
-            client = self.mqtt_client
+    def engine_lost(self):
+        """Whether the engine has closed its end of the connection.
+        
+        The engine never sends anything, so a readable connection means
+        it's gone.
+        
+        """
         try:
-            client.reconnect()
-            msg = client.publish(topic=topic, payload=payload)
-        except Exception as e:
-            self.update_mqtt_status(False, exception=e)
-        else:
-            if msg.is_published():
-                self.update_mqtt_status(True)
-                log.debug("Message successfully published to %s.", topic)
-            else:
-                self.update_mqtt_status(False)
-                log.warning("MQTT message not published.")
+            return self.conn.poll(0)
+        except (EOFError, OSError):
+            return True
     
-    def update_mqtt_status(self, was_successful, exception=None):
-        if was_successful:
-            log.debug("MQTT engaged successfully.")
-            self.mqtt_connection_changed.emit(True)
-            self.wifi_connection_changed.emit(True)
-        else:
-            # Check if an internet connection is available
-            has_internet = not subprocess.call(["ping", "-c1", "-W0.1", "8.8.8.8"])
-            self.wifi_connection_changed.emit(has_internet)
-            self.mqtt_connection_changed.emit(False)
-            log.error("MQTT failure.")
-        if exception is not None:
-            for chunk in format_exception(None, exception, exception.__traceback__):
-                for line in chunk.split("\n"):
-                    if line.strip():
-                        log.error(line)
+    def start_engine(self):
+        """Attach to the running engine, or start one if there isn't
+        one. The new engine is attached to by :py:meth:`poll` once it's
+        listening."""
+        if self.connect_engine():
+            return
+        self.process = start_engine_process(config_file=self.config_file,
+                                            connect=self.connect_mqtt)
+        log.info("Started engine process %d", self.process.pid)
+    
+    def start(self):
+        """Start or attach to the engine and begin watching its state."""
+        self.start_engine()
+        self.timer.start(int(self.poll_interval * 1000))
+    
+    def poll(self):
+        """Emit signals for anything the engine changed, and restart
+        the engine if it died."""
+        if self.conn is not None and self.engine_lost():
+            log.error("Lost the engine process.")
+            self.disconnect_engine()
+            # Any process started from here is gone too
+            self.process = None
+            self.restart_policy.record_failure()
+        if self.conn is None and not self.connect_engine():
+            if self.process is not None and self.process.poll() is not None:
+                log.error("Engine process exited with code %s.", self.process.returncode)
+                self.process = None
+                self.restart_policy.record_failure()
+            if self.process is None and self.restart_policy.allow():
+                self.restarts += 1
+                self.start_engine()
+            # Wait for the engine to start listening
+            return
+        if self.state.sequence() == self._sequence:
+            return
+        new = self.state.read()
+        if new is None:
+            return
+        if self.restart_policy.failures:
+            # The restarted engine is up and publishing
+            self.restart_policy.record_success()
+        old = self._engine_state
+        self._sequence = new.sequence
+        self._engine_state = new
+        if old is None or new.snapshot != old.snapshot:
+            self.snapshot_changed.emit(new.snapshot)
+        if new.mqtt_connected is not None and (
+                old is None or new.mqtt_connected != old.mqtt_connected):
+            self.mqtt_connection_changed.emit(new.mqtt_connected)
+        if new.wifi_connected is not None and (
+                old is None or new.wifi_connected != old.wifi_connected):
+            self.wifi_connection_changed.emit(new.wifi_connected)
+    
+    def stop(self):
+        """Stop the engine process, which frees the shared memory.
+        
+        Only called when the GUI quits normally. If the GUI crashes
+        instead, the engine keeps running for the next GUI to attach.
+        
+        """
+        self.timer.stop()
+        if self.conn is not None:
+            try:
+                self.conn.send(('stop',))
+            except (BrokenPipeError, OSError):
+                pass
+        elif self.process is not None:
+            # Not listening yet
+            self.process.terminate()
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+                self.process.wait()
+            self.process = None
+        self.disconnect_engine()
@@ -0,0 +1,792 @@
+"""The status engine for keeping track of when the dog goes outside.
+
+This module has no Qt dependency, so the same thresholds, logging and
+MQTT publishing can run headless on a small server using
+:py:mod:`asyncio`. The Qt classes in :py:mod:`humblepi.dogstatus`
+are thin adapters over these.
+
+"""
+
+import json
+import datetime as dt
+import pytz
+import os
+from typing import Optional, NamedTuple
+import enum
+import configparser
+import logging
+from traceback import format_exception
+import subprocess
+
+from paho.mqtt import client as mqtt_client
+
+from .backoff import ReconnectPolicy
+from .clock import SYSTEM_CLOCK
+from .eventlog import Action, DogEvent, EventIndex, to_epoch
+from .outbox import MQTTOutbox
+from .rates import RateWindow
+from .storage import open_log
+
+log = logging.getLogger(__name__)
+
+# Default thresholds, in seconds
+PEE_WARNING = 6 * 3600
+PEE_OVERDUE = 8 * 3600
+POOP_WARNING = 18 * 3600
+POOP_OVERDUE = 24 * 3600
+
+MQTT_QOS = 1 # At-least-once delivery for state messages
+
+
+class BoundSignal():
+    """The per-instance side of a :py:class:`Signal`."""
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def disconnect(self, slot):
+        try:
+            self.slots.remove(slot)
+        except ValueError:
+            raise TypeError("'{}' is not connected".format(slot))
+
+    def emit(self, *args):
+        for slot in list(self.slots):
+            slot(*args)
+
+
+class Signal():
+    """A minimal stand-in for ``pyqtSignal`` that calls slots directly.
+
+    Used as a class attribute the same way as ``pyqtSignal``, so Qt
+    adapters can replace it with a real signal of the same name.
+
+    """
+    def __init__(self, *types):
+        self.types = types
+
+    def __set_name__(self, owner, name):
+        self.attr = '_signal_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        bound = obj.__dict__.get(self.attr)
+        if bound is None:
+            bound = obj.__dict__[self.attr] = BoundSignal()
+        return bound
+
+
+class ActionTracker():
+    """Track how long it has been since the dog took one action.
+    
+    Used as a class attribute of an engine, the tracker is a template:
+    each engine instance gets its own copy on first use, with the same
+    thresholds, so clocks, times and signals are never shared between
+    engines. The copy reads its clock and timezone from its engine.
+    
+    """
+    name = ''
+    _last_status = 0
+    _last_time = '--:--'
+    seconds_warning = 3600
+    seconds_overdue = 3600
+    time_speedup = 1
+    _clock = None
+    
+    # Signals
+    status_changed = Signal(int)
+    time_changed = Signal(str)
+    
+    # Possible states
+    class states(enum.IntEnum):
+        UNKNOWN = 0
+        NORMAL = 1
+        WARNING = 2
+        OVERDUE = 3
+    
+    def __init__(self, seconds_warning: int=3600, seconds_overdue: int=3600, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_time = self.clock.now(self.timezone)
+        self.seconds_warning = seconds_warning
+        self.seconds_overdue = seconds_overdue
+    
+    def __set_name__(self, owner, name):
+        self.owner = owner
+        self.name = name
+    
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        tracker = obj.__dict__.get(self.name)
+        if tracker is None:
+            tracker = type(self)(seconds_warning=self.seconds_warning,
+                                 seconds_overdue=self.seconds_overdue)
+            tracker.name = self.name
+            tracker.owner = obj
+            tracker.last_time = tracker.clock.now(tracker.timezone)
+            obj.__dict__[self.name] = tracker
+        return tracker
+    
+    @property
+    def clock(self):
+        """The clock for this action, by default the owner's clock."""
+        if self._clock is not None:
+            return self._clock
+        return getattr(getattr(self, 'owner', None), 'clock', SYSTEM_CLOCK)
+    
+    @clock.setter
+    def clock(self, clock):
+        self._clock = clock
+    
+    @property
+    def timezone(self):
+        if hasattr(self, 'owner'):
+            timezone = self.owner.timezone
+        else:
+            timezone = pytz.utc
+        return timezone
+    
+    def reset_time(self,
+                   new_time: Optional[dt.datetime]=None, force=False):
+        """Set the current time as the last action time.
+        
+        Parameters
+        ==========
+        new_time
+          The new datetime to set. If ommitted, the current time will
+          be used.
+        force
+          If true, the time will be set no matter what, otherwise, the
+          time will only be set if it's newer that the current time.
+        
+        """
+        if new_time in [None, True, False]:
+            new_time = self.clock.now(self.timezone)
+        update_needed = (new_time > self.last_time) or force
+        if update_needed:
+            log.debug('Resetting {} to {}'.format(self.name, new_time))
+            self.last_time = new_time
+    
+    def seconds(self) -> int:
+        """Return the time (in seconds) since puppy has taken this action."""
+        # Determine correct timezone
+        now = self.clock.now(self.timezone)
+        elapsed_time = now - self.last_time
+        seconds = int(elapsed_time.total_seconds() * self.time_speedup)
+        return seconds
+    
+    def time_string(self) -> str:
+        """Prepare a string of how long it's been since puppy went outside."""
+        seconds = self.seconds()
+        hours = int((seconds / 3600))
+        minutes = int((seconds % 3600) / 60)
+        # Prepare the formatted string
+        fmt = '{hours}:{minutes:02d}'
+        time_str = fmt.format(hours=hours, minutes=minutes)
+        return time_str
+    
+    def status(self) -> int:
+        """Determine whether this action is overdue or not.
+        
+        Returns
+        =======
+        status
+          A member of self.states enum showing the current status
+          (eg. self.states.NORMAL).
+        
+        """
+        seconds = self.seconds()
+        if 0 <= seconds < self.seconds_warning:
+            status = self.states.NORMAL
+        elif self.seconds_warning <= seconds < self.seconds_overdue:
+            status = self.states.WARNING
+        elif self.seconds_overdue <= seconds:
+            status = self.states.OVERDUE
+        else:
+            status = self.states.UNKNOWN
+        return status
+    
+    def check_status_change(self):
+        """Compare current and last seen status, and emit a signal if it
+        changed."""
+        # Check overdue status
+        new_status = self.status()
+        if new_status != self._last_status:
+            self.status_changed.emit(new_status)
+            self._last_status = new_status
+        # check time string
+        new_time = self.time_string()
+        if new_time != self._last_time:
+            self.time_changed.emit(new_time)
+            self._last_time = new_time
+
+
+class StatusSnapshot(NamedTuple):
+    """An immutable view of both actions' status at one tick."""
+    peeing_status: int
+    peeing_time: str
+    pooping_status: int
+    pooping_time: str
+
+
+CONFIG_FILE = os.path.expanduser('~/.humblepirc')
+
+# Parsed config files, keyed by path, as (mtime, config) tuples
+_config_cache = {}
+
+
+def default_config():
+    config = configparser.ConfigParser()
+    config['MQTT'] = {
+        'username': '',
+        'password': '',
+        'hostname': 'localhost',
+        'port': 8883,
+        'use_tls': True,
+        'outbox': '~/.humblepi-outbox.json', # Unsent messages
+        'reconnect_min': 1, # seconds, longest wait after the first failure
+        'reconnect_max': 300, # seconds, longest wait between reconnects
+        'breaker_failures': 10, # failures in a row before pausing
+        'breaker_cooldown': 900, # seconds to pause reconnecting
+    }
+    config['HTTP'] = {
+        'enabled': False,
+        'host': '',
+        'port': 8080,
+    }
+    config['dog'] = {
+        'name': 'sheffield',
+        'logfile': '~/sheffield-bathroom-log.tsv',
+        'log_backend': 'auto', # tsv, sqlite, or auto from the file extension
+        'log_checksums': False, # checksum and fsync each TSV record
+        'timezone': 'America/Chicago',
+        'tick': 1, # seconds between status checks
+        'config_check': 5, # seconds between checks for config changes
+    }
+    config['peeing'] = {
+        'warning_hours': PEE_WARNING / 3600,
+        'overdue_hours': PEE_OVERDUE / 3600,
+    }
+    config['pooping'] = {
+        'warning_hours': POOP_WARNING / 3600,
+        'overdue_hours': POOP_OVERDUE / 3600,
+    }
+    return config
+
+
+def config_mtime(fpath=CONFIG_FILE):
+    """Modification time of the config file, or ``None`` if missing."""
+    try:
+        return os.stat(fpath).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_config(fpath=CONFIG_FILE):
+    """Parse the config file on top of the defaults.
+    
+    The parsed config is cached, and the file is only read again if
+    it has been modified since.
+    
+    """
+    mtime = config_mtime(fpath)
+    cached = _config_cache.get(fpath)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    config = default_config()
+    config.read(fpath)
+    _config_cache[fpath] = (mtime, config)
+    return config
+
+
+class StatusEngine():
+    """Qt-free engine that watches the dog's actions and publishes
+    changes.
+    
+    Call :py:meth:`run` for a blocking loop (eg. from a thread), or
+    await :py:meth:`run_async` inside an :py:mod:`asyncio` event
+    loop.
+    
+    """
+    dog_name = 'sheffield'
+    peeing = ActionTracker(seconds_warning=PEE_WARNING, seconds_overdue=PEE_OVERDUE)
+    pooping = ActionTracker(seconds_warning=POOP_WARNING, seconds_overdue=POOP_OVERDUE)
+    logfile = os.path.expanduser("~/sheffield-bathroom-log.tsv")
+    log_backend = 'auto'
+    log_checksums = False
+    mqtt_client = None
+    timezone = pytz.timezone('America/Chicago')
+    clock = SYSTEM_CLOCK
+    mqtt_hostname = None
+    mqtt_port = None
+    mqtt_connected = False
+    outbox_file = None # Keep the MQTT outbox in memory only
+    _outbox = None
+    _reconnect_policy = None
+    http_server = None
+    config_file = CONFIG_FILE
+    tick = 1 # seconds between status checks
+    config_check = 5 # seconds between checks for config changes
+    rate_window = 7 * 24 * 3600 # seconds of history for events per day
+    _rates = None
+    _events = None
+    _logs = None
+    _config_mtime = None
+    _last_config_check = 0
+    _last_snapshot = None
+    _publish_held = False # Hold back MQTT publishing during a commit
+    _publish_pending = False
+    
+    # Signals
+    mqtt_connection_changed = Signal(bool)
+    wifi_connection_changed = Signal(bool)
+    snapshot_changed = Signal(object)
+    config_changed = Signal() # The config file was modified
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Make this engine's actions now, in the thread that made it
+        self.peeing, self.pooping
+        # With Qt this is queued, so the config is applied on the
+        # thread that made the engine, which also owns the logs
+        self.config_changed.connect(self.check_config)
+    
+    def set_clock(self, clock):
+        """Use *clock* for this engine and its actions (eg. a
+        :py:class:`~humblepi.clock.VirtualClock` for simulations)."""
+        self.clock = clock
+        self.reconnect_policy.clock = clock
+    
+    def apply_config(self, config):
+        """Apply names, paths, thresholds and tick settings from a
+        parsed config to this engine and its actions."""
+        dog = config['dog']
+        self.dog_name = dog['name']
+        self.logfile = os.path.expanduser(dog['logfile'])
+        self.log_backend = dog['log_backend']
+        self.log_checksums = dog.getboolean('log_checksums')
+        # The backend, dog or timezone may have changed
+        for event_log in (self._logs or {}).values():
+            event_log.close()
+        self._logs = None
+        self.timezone = pytz.timezone(dog['timezone'])
+        self.tick = dog.getfloat('tick')
+        self.config_check = dog.getfloat('config_check')
+        self.outbox_file = os.path.expanduser(config['MQTT']['outbox'])
+        policy = self.reconnect_policy
+        policy.base = config['MQTT'].getfloat('reconnect_min')
+        policy.cap = config['MQTT'].getfloat('reconnect_max')
+        policy.failure_threshold = config['MQTT'].getint('breaker_failures')
+        policy.cooldown = config['MQTT'].getfloat('breaker_cooldown')
+        for action in (self.peeing, self.pooping):
+            section = config[action.name]
+            action.seconds_warning = section.getfloat('warning_hours') * 3600
+            action.seconds_overdue = section.getfloat('overdue_hours') * 3600
+    
+    def reload_config(self):
+        """Load the config file and apply it."""
+        self._config_mtime = config_mtime(self.config_file)
+        self.apply_config(load_config(self.config_file))
+    
+    def check_config(self):
+        """Reload the config if the file changed since it was last
+        applied.
+        
+        Returns
+        =======
+        changed
+          True if a new config was applied.
+        
+        """
+        self._last_config_check = self.clock.monotonic()
+        if config_mtime(self.config_file) == self._config_mtime:
+            return False
+        old_logfile = self.logfile
+        self.reload_config()
+        log.info("Applied new config from %s", self.config_file)
+        if self.logfile != old_logfile:
+            self.load_datetimes()
+        return True
+    
+    def tick_once(self):
+        """Do one tick's worth of work."""
+        if self.clock.monotonic() - self._last_config_check >= self.config_check:
+            self._last_config_check = self.clock.monotonic()
+            if config_mtime(self.config_file) != self._config_mtime:
+                self.config_changed.emit()
+        self.check_status_change()
+        self.maintain_mqtt()
+    
+    @property
+    def events(self):
+        """A sorted index of the logged events, filled by
+        :py:meth:`load_datetimes`."""
+        if self._events is None:
+            self._events = EventIndex()
+        return self._events
+    
+    def open_log(self, fpath=None):
+        """The storage backend for the log at *fpath* (default
+        ``self.logfile``), opened once and then reused."""
+        if fpath is None:
+            fpath = self.logfile
+        if self._logs is None:
+            self._logs = {}
+        if fpath not in self._logs:
+            self._logs[fpath] = open_log(fpath, backend=self.log_backend,
+                                         dog=self.dog_name, timezone=self.timezone,
+                                         checksums=self.log_checksums)
+        return self._logs[fpath]
+    
+    @property
+    def rates(self):
+        """Rolling event-rate windows for each :py:class:`Action`."""
+        if self._rates is None:
+            self._rates = {action: RateWindow(duration=self.rate_window)
+                           for action in Action}
+        return self._rates
+    
+    def events_per_day(self, action: Action) -> float:
+        """How many times per day the dog took *action*, averaged over
+        ``rate_window``."""
+        now = self.clock.now(pytz.utc).timestamp()
+        return self.rates[action].rate(now)
+    
+    @property
+    def outbox(self):
+        """Messages waiting for the MQTT broker, created on first use."""
+        if self._outbox is None:
+            self._outbox = MQTTOutbox(self.outbox_file)
+        return self._outbox
+    
+    @property
+    def reconnect_policy(self):
+        """When to retry the MQTT broker, created on first use."""
+        if self._reconnect_policy is None:
+            self._reconnect_policy = ReconnectPolicy(clock=self.clock)
+        return self._reconnect_policy
+    
+    def prepare_http(self):
+        """Start the HTTP status server, if enabled in the config."""
+        config = load_config(self.config_file)['HTTP']
+        if config.getboolean('enabled'):
+            from .http_status import start_http_server
+            self.http_server = start_http_server(self, host=config['host'],
+                                                 port=config.getint('port'))
+    
+    def prepare_mqtt(self):
+        config = load_config(self.config_file)['MQTT']
+        # Log into the MQTT client
+        self.mqtt_client = mqtt_client.Client()
+        if config.getboolean('use_tls'):
+            self.mqtt_client.tls_set()
+            log.debug("TLS enabled for MQTT")
+        self.mqtt_client.username_pw_set(
+            username=config['username'],
+            password=config['password'])
+        # The broker announces we're gone if the connection drops
+        self.mqtt_client.will_set(self.mqtt_topic('availability'),
+                                  payload='offline', qos=MQTT_QOS, retain=True)
+        # Unsent messages wait in the outbox, not in paho's own queue
+        self.mqtt_client.max_queued_messages_set(self.outbox.max_topics)
+        self.mqtt_client.on_connect = self.on_mqtt_connect
+        self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
+        log.debug("Connecting to MQTT server '%s:%d'",
+                  config['hostname'], config.getint('port'))
+        self.mqtt_hostname = config['hostname']
+        self.mqtt_port = config['port']
+        try:
+            self.mqtt_client.connect(host=config['hostname'],
+                                     port=config.getint('port'))
+        except Exception as e:
+            self.reconnect_policy.record_failure()
+            self.update_mqtt_status(was_successful=False, exception=e)
+        else:
+            self.reconnect_policy.record_attempt()
+            self.mqtt_connected = True
+            self.update_mqtt_status(was_successful=True)
+        # Connect signals for MQTT client
+        self.peeing.status_changed.connect(self.update_mqtt)
+        self.pooping.status_changed.connect(self.update_mqtt)
+    
+    def run(self):
+        # Start loop waiting for status changes
+        while True:
+            self.tick_once()
+            self.clock.sleep(self.tick)
+    
+    async def run_async(self):
+        """Check for status changes every tick without blocking the
+        event loop."""
+        while True:
+            self.tick_once()
+            await self.clock.sleep_async(self.tick)
+    
+    def snapshot(self) -> StatusSnapshot:
+        """Build a snapshot from the last status seen by each action."""
+        return StatusSnapshot(peeing_status=self.peeing._last_status,
+                              peeing_time=self.peeing._last_time,
+                              pooping_status=self.pooping._last_status,
+                              pooping_time=self.pooping._last_time)
+    
+    def check_status_change(self, *args):
+        """Update both actions, and emit a single snapshot if anything
+        changed."""
+        self.pooping.check_status_change()
+        self.peeing.check_status_change()
+        new_snapshot = self.snapshot()
+        if new_snapshot != self._last_snapshot:
+            self.snapshot_changed.emit(new_snapshot)
+            self._last_snapshot = new_snapshot
+    
+    def log_poop(self, when=None):
+        self.log_action(pooped=True, when=when)
+    
+    def log_pee(self, when=None):
+        self.log_action(pooped=False, when=when)
+    
+    def log_action(self, pooped=True, fpath=None, when=None):
+        # Determine default file path and action time if necessary
+        if fpath is None:
+            fpath = self.logfile
+        if when in [None, True, False]:
+            when = self.clock.now(self.timezone)
+        # Logging
+        action = Action.POOP if pooped else Action.PEE
+        self.store_events([DogEvent.from_datetime(when, action)], fpath=fpath)
+    
+    def store_events(self, events, fpath=None):
+        """Write *events* to the log in one go, and add them to the
+        index and rates."""
+        events = list(events)
+        self.open_log(fpath).append(events)
+        for event in events:
+            self.events.insert(event)
+            self.rates[event.action].add(event.epoch)
+    
+    def commit_pee(self, when=None):
+        self.commit_action(pooped=False, when=when)
+    
+    def commit_poop(self, when=None):
+        self.commit_action(pooped=True, when=when)
+    
+    def commit_action(self, pooped=True, when=None):
+        """Commit a single event, eg. from a button press."""
+        if when in [None, True, False]:
+            when = self.clock.now(self.timezone)
+        action = Action.POOP if pooped else Action.PEE
+        self.commit_events([DogEvent.from_datetime(when, action)])
+    
+    def commit_events(self, events, fpath=None):
+        """Apply several events together.
+        
+        The events are written to the log in one go, then each
+        action's last time is moved on, the status is checked once,
+        and at most one set of MQTT messages is published, so adding
+        a pee and a poop costs the same as adding one. If the log
+        can't be written nothing else is changed.
+        
+        Parameters
+        ==========
+        events
+          The :py:class:`~humblepi.eventlog.DogEvent` objects to add.
+        fpath
+          Path to the log file. If omitted, ``self.logfile`` is used.
+        
+        """
+        events = list(events)
+        if not events:
+            return
+        self.store_events(events, fpath=fpath)
+        for event in events:
+            action = self.pooping if event.action == Action.POOP else self.peeing
+            action.reset_time(event.to_datetime(self.timezone))
+        self._publish_held = True
+        try:
+            self.check_status_change()
+        finally:
+            self._publish_held = False
+        if self._publish_pending:
+            self._publish_pending = False
+            self.update_mqtt()
+    
+    def compact_log(self, fpath=None):
+        """Rewrite the log file in time order, eg. after backfilled
+        manual entries."""
+        self.open_log(fpath).compact()
+    
+    def load_datetimes(self, fpath=None):
+        """Read the latest datetime stamps from the log file.
+        
+        Parameters
+        ==========
+        fpath
+          Path to the log file to be used. If omitted, the value of
+          ``self.logfile`` will be used.
+        
+        Returns
+        =======
+        last_out
+          The datetime when the dog last peed.
+        last_poop
+          The datetime when the dog last pooped.
+        
+        """
+        event_log = self.open_log(fpath)
+        # Tidy up after a power cut before reading
+        event_log.recover()
+        self._events = event_log.load()
+        # Seed the rolling rates with the recent events
+        self._rates = None
+        recent = to_epoch(self.clock.now(pytz.utc)) - self.rate_window
+        for event in self.events.range(since=recent):
+            self.rates[event.action].add(event.epoch)
+        last_out = self.events.latest_before(Action.PEE)
+        last_poop = self.events.latest_before(Action.POOP)
+        # Convert to datetimes only for the events we keep
+        if last_out is not None:
+            last_out = last_out.to_datetime(self.timezone)
+            self.peeing.reset_time(last_out, force=True)
+        if last_poop is not None:
+            last_poop = last_poop.to_datetime(self.timezone)
+            self.pooping.reset_time(last_poop, force=True)
+        return last_out, last_poop
+    
+    def connect_puppy_view(self, view):
+        view.pee_button_clicked.connect(self.commit_pee)
+        view.poop_button_clicked.connect(self.commit_poop)
+        view.events_added.connect(self.commit_events)
+    
+    def state_dict(self) -> dict:
+        """Describe the current state of both actions as plain data."""
+        max_state = max(self.pooping.status(), self.peeing.status())
+        state = {'dog': self.dog_name, 'status': max_state.name}
+        for action, code in ((self.peeing, Action.PEE), (self.pooping, Action.POOP)):
+            state[action.name] = {
+                'status': action.status().name,
+                'time': action.time_string(),
+                'last_time': action.last_time.isoformat(),
+                'elapsed_seconds': action.seconds(),
+                'per_day': self.events_per_day(code),
+            }
+        return state
+    
+    def mqtt_topic(self, subtopic):
+        return 'dogstatus/{}/{}'.format(self.dog_name, subtopic)
+    
+    def mqtt_messages(self):
+        """Build the retained state messages as (topic, payload) tuples.
+        
+        The ``outside`` topic has just the most severe state name
+        (eg. "NORMAL"), while ``state`` has the full state as JSON.
+        
+        """
+        state = self.state_dict()
+        return [
+            (self.mqtt_topic('outside'), state['status']),
+            (self.mqtt_topic('state'), json.dumps(state)),
+        ]
+    
+    def on_mqtt_connect(self, client, userdata, flags, rc):
+        """Send the birth message and any waiting messages on
+        (re)connecting."""
+        if rc != mqtt_client.CONNACK_ACCEPTED:
+            self.reconnect_policy.record_failure()
+            return
+        self.reconnect_policy.record_success()
+        self.mqtt_connected = True
+        client.publish(self.mqtt_topic('availability'), payload='online',
+                       qos=MQTT_QOS, retain=True)
+        self.queue_mqtt_messages()
+        self.outbox.drain(client)
+        if len(self.outbox) == 0:
+            self.update_mqtt_status(True)
+    
+    def on_mqtt_disconnect(self, client, userdata, rc):
+        self.mqtt_connected = False
+        # Wait a random time before reconnecting, so that displays
+        # don't all rush back at once after a broker restart
+        self.reconnect_policy.record_failure()
+    
+    def reconnect_mqtt(self, client=None):
+        """Try to reconnect, keeping the reconnect policy informed."""
+        if client is None:
+            client = self.mqtt_client
+        self.reconnect_policy.record_attempt()
+        try:
+            client.reconnect()
+        except Exception:
+            self.reconnect_policy.record_failure()
+            raise
+    
+    def maintain_mqtt(self, client=None):
+        """Reconnect if the policy allows it, then handle any MQTT
+        traffic (acknowledgements, keep-alive pings) without blocking."""
+        if client is None:
+            client = self.mqtt_client
+        if client is None:
+            return
+        if not self.mqtt_connected and self.reconnect_policy.allow():
+            try:
+                self.reconnect_mqtt(client)
+            except Exception as e:
+                log.warning("MQTT reconnect failed, next try in %.0f s.",
+                            self.reconnect_policy.delay())
+                self.update_mqtt_status(False, exception=e)
+        client.loop(timeout=0)
+    
+    def queue_mqtt_messages(self):
+        """Put the current state messages in the outbox."""
+        for topic, payload in self.mqtt_messages():
+            self.outbox.put(topic, payload, qos=MQTT_QOS, retain=True, save=False)
+        self.outbox.save()
+    
+    def update_mqtt(self, new_state=None, client=None):
+        if self._publish_held:
+            # Both actions' changes go out together once the commit is done
+            self._publish_pending = True
+            return
+        # Queue the messages, then try to send everything waiting
+        if client is None:
+            client = self.mqtt_client
+        self.queue_mqtt_messages()
+        try:
+            if not self.mqtt_connected and self.reconnect_policy.allow():
+                self.reconnect_mqtt(client)
+            # Only publish once connected. paho queues QoS 1 messages it
+            # can't send and replays them all on reconnecting, which
+            # would undo the outbox's coalescing. Whatever is waiting
+            # goes out from on_mqtt_connect instead.
+            if self.mqtt_connected:
+                self.outbox.drain(client)
+        except Exception as e:
+            self.update_mqtt_status(False, exception=e)
+        else:
+            if len(self.outbox) == 0:
+                self.update_mqtt_status(True)
+                log.debug("Messages successfully published to %s.",
+                          self.mqtt_topic('#'))
+            else:
+                self.update_mqtt_status(False)
+                log.warning("MQTT messages not published, %d waiting in outbox.",
+                            len(self.outbox))
+    
+    def update_mqtt_status(self, was_successful, exception=None):
+        if was_successful:
+            log.debug("MQTT engaged successfully.")
+            self.mqtt_connection_changed.emit(True)
+            self.wifi_connection_changed.emit(True)
+        else:
+            # Check if an internet connection is available
+            has_internet = not subprocess.call(["ping", "-c1", "-W0.1", "8.8.8.8"])
+            self.wifi_connection_changed.emit(has_internet)
+            self.mqtt_connection_changed.emit(False)
+            log.error("MQTT failure.")
+        if exception is not None:
+            for chunk in format_exception(None, exception, exception.__traceback__):
+                for line in chunk.split("\n"):
+                    if line.strip():
+                        log.error(line)
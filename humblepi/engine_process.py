@@ -0,0 +1,411 @@
+"""Run the status engine in a separate process from the GUI.
+
+The engine (MQTT with TLS, pings, log I/O) then never holds the GUI's
+interpreter lock, so touch handling stays smooth, and either side can
+crash and be restarted without taking down the other. The engine runs
+in its own session rather than as a child of the GUI, and keeps going
+(publishing to MQTT) when the GUI goes away; a restarted GUI finds it
+again by name (see :py:func:`engine_names`) and reattaches.
+
+Live state goes from the engine to the GUI through a small block of
+shared memory guarded by a sequence counter (a "seqlock"): the engine
+makes the counter odd, writes the state, then makes it even again. The
+GUI reads the counter, the state, and the counter again, and tries
+again if the two differ or are odd. The GUI only has to compare one
+integer to know whether anything changed.
+
+Commands (eg. "the dog just peed", sent as a batch of events) go the
+other way through a :py:mod:`multiprocessing.connection` on a Unix
+socket that only the user can open. The engine takes the newest
+connection, so a restarted GUI replaces the one that died.
+
+This module has no Qt dependency, so the engine process does not load
+Qt. The GUI side is :py:class:`humblepi.dogstatus.DogStatusProcess`.
+
+"""
+
+import os
+import sys
+import queue
+import signal
+import struct
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import NamedTuple, Optional, Tuple
+
+from .engine import CONFIG_FILE, StatusEngine, StatusSnapshot
+from .eventlog import Action, DogEvent
+
+
+log = logging.getLogger(__name__)
+
+
+def engine_names(logfile) -> Tuple[str, str]:
+    """Names of the shared state and command socket of the engine that
+    keeps *logfile*.
+
+    They come from the log's path, so a restarted GUI finds the engine
+    that is still running, and engines for different logs (eg. in
+    tests) don't clash.
+
+    Returns
+    =======
+    state_name
+      Name of the :py:class:`SharedState` block.
+    address
+      Path of the engine's command socket.
+
+    """
+    fpath = os.path.abspath(os.path.expanduser(logfile))
+    name = 'humblepi-' + hashlib.sha1(fpath.encode()).hexdigest()[:12]
+    run_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return name, os.path.join(run_dir, name + '.sock')
+
+
+def connect_engine(address):
+    """Open a command connection to the engine listening at *address*,
+    or return ``None`` if none is."""
+    try:
+        return Client(address, family='AF_UNIX')
+    except OSError:
+        # No socket, or left behind by an engine that died
+        return None
+
+
+class EngineState(NamedTuple):
+    """One consistent read of the shared state."""
+    sequence: int
+    snapshot: StatusSnapshot
+    mqtt_connected: Optional[bool]
+    wifi_connected: Optional[bool]
+    event_count: int # Events in the log
+
+
+class SharedState():
+    """The engine's live state in a named shared-memory block.
+
+    Only the engine process should call :py:meth:`write`; any number of
+    readers may call :py:meth:`read`.
+
+    The block is kept out of Python's resource tracker, which would
+    otherwise remove it when any process that attached to it exits,
+    even while the engine is still using it. The engine removes it
+    with :py:meth:`unlink` when it stops, and a block left by an engine
+    that was killed is reused by the next one.
+
+    Parameters
+    ==========
+    name
+      Name of an existing block to attach to.
+    create
+      If true, create a new block (with a random name if *name* is
+      omitted).
+
+    """
+    seq_layout = struct.Struct('<Q')
+    layout = struct.Struct('<bbbb16s16sQ')
+    time_size = 16
+
+    def __init__(self, name: Optional[str]=None, create=False):
+        size = self.seq_layout.size + self.layout.size
+        self.shm = SharedMemory(name=name, create=create, size=size)
+        if os.name == 'posix':
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        if create:
+            self.shm.buf[:size] = bytes(size)
+        self._sequence = self.sequence()
+        # An odd count means a writer died part way through. Start from
+        # the next even count, so our own writes leave it even again.
+        self._sequence += self._sequence % 2
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def sequence(self) -> int:
+        """The current value of the sequence counter."""
+        return self.seq_layout.unpack_from(self.shm.buf, 0)[0]
+
+    def write(self, snapshot: StatusSnapshot, mqtt_connected=None,
+              wifi_connected=None, event_count=0):
+        """Publish a new state (engine side only)."""
+        def code(value):
+            return -1 if value is None else int(value)
+        def text(value):
+            return (value or '').encode()[:self.time_size]
+        buf = self.shm.buf
+        self._sequence += 1 # Odd: write in progress
+        self.seq_layout.pack_into(buf, 0, self._sequence)
+        self.layout.pack_into(buf, self.seq_layout.size,
+                              code(snapshot.peeing_status),
+                              code(snapshot.pooping_status),
+                              code(mqtt_connected), code(wifi_connected),
+                              text(snapshot.peeing_time), text(snapshot.pooping_time),
+                              event_count)
+        self._sequence += 1 # Even: consistent again
+        self.seq_layout.pack_into(buf, 0, self._sequence)
+
+    def read(self, retries=100) -> Optional[EngineState]:
+        """Read a consistent copy of the state.
+
+        Returns ``None`` if nothing has been written yet, or if the
+        writer was busy for every one of *retries* attempts.
+
+        """
+        buf = self.shm.buf
+        for attempt in range(retries):
+            before = self.sequence()
+            if before == 0:
+                return None
+            if before % 2:
+                continue
+            fields = self.layout.unpack_from(buf, self.seq_layout.size)
+            if self.sequence() == before:
+                break
+        else:
+            return None
+        (pee_status, poop_status, mqtt_connected, wifi_connected,
+         pee_time, poop_time, event_count) = fields
+        def tristate(value):
+            return None if value < 0 else bool(value)
+        def status(value):
+            return None if value < 0 else value
+        snapshot = StatusSnapshot(peeing_status=status(pee_status),
+                                  peeing_time=pee_time.rstrip(b'\0').decode(),
+                                  pooping_status=status(poop_status),
+                                  pooping_time=poop_time.rstrip(b'\0').decode())
+        return EngineState(sequence=before, snapshot=snapshot,
+                           mqtt_connected=tristate(mqtt_connected),
+                           wifi_connected=tristate(wifi_connected),
+                           event_count=event_count)
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        if os.name == 'posix':
+            # SharedMemory.unlink() unregisters it again
+            resource_tracker.register(self.shm._name, 'shared_memory')
+        self.shm.unlink()
+
+
+class EngineServer():
+    """Drive a :py:class:`StatusEngine` inside the engine process.
+
+    Parameters
+    ==========
+    engine
+      The engine to run, with its config already applied.
+    state
+      Where to publish the live state.
+    listener
+      Where GUIs connect to send commands. If omitted, connections can
+      be handed over with :py:meth:`attach`.
+
+    """
+    def __init__(self, engine: StatusEngine, state: SharedState, listener=None):
+        self.engine = engine
+        self.state = state
+        self.conn = None
+        self.connections = queue.Queue() # New connections from GUIs
+        self.mqtt_connected = None
+        self.wifi_connected = None
+        self.event_count = len(engine.events)
+        engine.snapshot_changed.connect(self.publish)
+        engine.mqtt_connection_changed.connect(self.set_mqtt_connected)
+        engine.wifi_connection_changed.connect(self.set_wifi_connected)
+        if listener is not None:
+            threading.Thread(target=self.accept_forever, args=(listener,),
+                             name='humblepi-engine-accept', daemon=True).start()
+
+    def accept_forever(self, listener):
+        """Hand each GUI that connects over to the engine loop."""
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                # The listener was closed
+                return
+            self.attach(conn)
+
+    def attach(self, conn):
+        """Take commands from *conn* from now on."""
+        self.connections.put(conn)
+
+    def set_mqtt_connected(self, connected):
+        self.mqtt_connected = connected
+        self.publish()
+
+    def set_wifi_connected(self, connected):
+        self.wifi_connected = connected
+        self.publish()
+
+    def publish(self, snapshot=None):
+        self.state.write(self.engine.snapshot(), mqtt_connected=self.mqtt_connected,
+                         wifi_connected=self.wifi_connected,
+                         event_count=self.event_count)
+
+    def commit_events(self, events):
+        """Commit a batch of ``(epoch, action)`` pairs together, see
+        :py:meth:`StatusEngine.commit_events`."""
+        events = [DogEvent(epoch, Action(action)) for epoch, action in events]
+        self.engine.commit_events(events)
+        self.event_count += len(events)
+        self.publish()
+
+    def handle(self, command):
+        """Carry out one command from the GUI.
+
+        Returns
+        =======
+        keep_going
+          False once the engine should stop.
+
+        """
+        name, *args = command
+        if name == 'stop':
+            return False
+        elif name == 'commit':
+            self.commit_events(*args)
+        else:
+            log.warning("Unknown engine command %r", name)
+        return True
+
+    def receive(self, timeout):
+        """The next command from the GUI, or ``None`` if there is none
+        within *timeout* seconds.
+
+        A GUI that connects replaces the last one. When the GUI goes
+        away, the engine carries on without it.
+
+        """
+        try:
+            while True:
+                conn = self.connections.get(block=self.conn is None, timeout=timeout)
+                if self.conn is not None:
+                    self.conn.close()
+                log.info("GUI connected to the engine.")
+                self.conn = conn
+        except queue.Empty:
+            pass
+        if self.conn is None:
+            return None
+        try:
+            if self.conn.poll(timeout):
+                return self.conn.recv()
+        except (EOFError, OSError):
+            log.info("GUI went away, keeping the engine running.")
+            self.conn.close()
+            self.conn = None
+        return None
+
+    def serve_forever(self):
+        """Tick the engine, answering commands as soon as they arrive
+        instead of sleeping."""
+        engine = self.engine
+        self.publish()
+        while True:
+            engine.tick_once()
+            deadline = engine.clock.monotonic() + engine.tick
+            timeout = engine.tick
+            while timeout > 0:
+                command = self.receive(timeout)
+                if command is not None and not self.handle(command):
+                    return
+                timeout = deadline - engine.clock.monotonic()
+
+
+def run_engine(config_file=CONFIG_FILE, connect=True):
+    """Entry point of the engine process.
+
+    Does nothing if an engine is already running for the same log.
+
+    Parameters
+    ==========
+    config_file
+      Config to load, as for the in-process engine.
+    connect
+      If false, skip MQTT and the HTTP server (eg. for tests).
+
+    """
+    engine = StatusEngine()
+    engine.config_file = config_file
+    engine.reload_config()
+    state_name, address = engine_names(engine.logfile)
+    conn = connect_engine(address)
+    if conn is not None:
+        conn.close()
+        log.warning("An engine is already running for %s.", engine.logfile)
+        return
+    engine.load_datetimes()
+    try:
+        state = SharedState(state_name, create=True)
+    except FileExistsError:
+        # Left behind by an engine that was killed
+        state = SharedState(state_name)
+    if os.path.exists(address):
+        os.remove(address)
+    # Only this user may send commands
+    old_umask = os.umask(0o077)
+    try:
+        listener = Listener(address, family='AF_UNIX')
+    finally:
+        os.umask(old_umask)
+    server = EngineServer(engine, state, listener)
+    if connect:
+        engine.prepare_mqtt()
+        engine.prepare_http()
+    try:
+        server.serve_forever()
+    finally:
+        listener.close()
+        state.close()
+        state.unlink()
+
+
+def start_engine_process(config_file=CONFIG_FILE, connect=True):
+    """Start :py:func:`run_engine` in a new process.
+
+    The process gets its own session, so it outlives the GUI that
+    started it. Connect to it with :py:func:`connect_engine` once it
+    is listening.
+
+    Returns
+    =======
+    process
+      The started :py:class:`subprocess.Popen`.
+
+    """
+    args = [sys.executable, '-m', 'humblepi.engine_process', '--config', config_file]
+    if not connect:
+        args.append('--no-connect')
+    # Run this copy of humblepi, even if it isn't installed
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [package_dir, env.get('PYTHONPATH')]))
+    return subprocess.Popen(args, env=env, start_new_session=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the status engine for a separate GUI process.")
+    parser.add_argument('--config', default=CONFIG_FILE, help='config file to load')
+    parser.add_argument('--no-connect', action='store_true',
+                        help="don't connect to MQTT or serve HTTP")
+    args = parser.parse_args(argv)
+    # Clean up the socket and shared memory if the GUI terminates us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    run_engine(config_file=args.config, connect=not args.no_connect)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
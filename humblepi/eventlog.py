@@ -0,0 +1,635 @@
+"""Read events from the bathroom log.
+
+The log is a tab-separated file with one event per line: a timestamp
+followed by "True" if the dog pooped or "False" if he only peed. Lines
+starting with "#" are comments. Older logs have naive timestamps
+(eg. "2019-08-04 19:55:46"), newer ones are ISO-8601 with a UTC
+offset.
+
+Lines may have a third column with a CRC-32 checksum of the rest of
+the line (see :py:func:`format_record`), so that records damaged by a
+power cut can be told apart from good ones. Damaged or unreadable
+lines are skipped with a warning rather than stopping the app, and
+:py:func:`recover_log` cleans up a torn end of the file at startup.
+
+Events are kept compact in memory: timestamps are stored as integer
+epoch seconds and only converted to timezone-aware datetimes when
+needed for display.
+
+"""
+
+import bisect
+import datetime as dt
+import enum
+import functools
+import logging
+import os
+import zlib
+from array import array
+from typing import Optional, Iterator, Iterable
+
+import pytz
+
+
+log = logging.getLogger(__name__)
+
+TAIL_SIZE = 4096 # Bytes at the end of the log checked by recover_log()
+
+
+class Action(enum.IntEnum):
+    PEE = 1
+    POOP = 2
+
+
+class BadRecord(ValueError):
+    """A line in the log that can't be read, eg. half written when
+    the power went out."""
+
+
+class DogEvent():
+    """A single bathroom event.
+
+    Only the epoch seconds and action code are stored, so each record
+    costs a few dozen bytes instead of a full datetime object.
+
+    """
+    __slots__ = ('epoch', 'action')
+
+    def __init__(self, epoch: int, action: int):
+        self.epoch = epoch
+        self.action = action
+
+    @classmethod
+    def from_datetime(cls, when: dt.datetime, action: int):
+        return cls(epoch=to_epoch(when), action=action)
+
+    def to_datetime(self, timezone=pytz.utc) -> dt.datetime:
+        """Convert the timestamp to an aware datetime in *timezone*."""
+        return from_epoch(self.epoch, timezone=timezone)
+
+    def __eq__(self, other):
+        if not isinstance(other, DogEvent):
+            return NotImplemented
+        return (self.epoch, self.action) == (other.epoch, other.action)
+
+    def __hash__(self):
+        return hash((self.epoch, self.action))
+
+    def __repr__(self):
+        return '{}(epoch={}, action={})'.format(
+            type(self).__name__, self.epoch, Action(self.action).name)
+
+
+class EventHistory():
+    """An in-memory history of events stored as parallel columns.
+
+    Epoch seconds and action codes are kept in two ``array`` columns
+    (9 bytes per event), so years of history fit easily in memory.
+    Indexing returns :py:class:`DogEvent` records built on demand.
+
+    """
+    def __init__(self, events: Iterable[DogEvent]=()):
+        self.epochs = array('q')
+        self.actions = array('B')
+        self.extend(events)
+
+    @classmethod
+    def from_log(cls, fpath, timezone=pytz.utc, **kwargs):
+        """Load a history from the log file at *fpath*.
+
+        Extra keyword arguments are passed to
+        :py:func:`iter_events`.
+
+        """
+        return cls(iter_events(fpath, timezone=timezone, **kwargs))
+
+    def append(self, event: DogEvent):
+        self.epochs.append(event.epoch)
+        self.actions.append(event.action)
+
+    def extend(self, events: Iterable[DogEvent]):
+        for event in events:
+            self.append(event)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the event columns, in bytes."""
+        return (self.epochs.itemsize * len(self.epochs)
+                + self.actions.itemsize * len(self.actions))
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return DogEvent(self.epochs[idx], self.actions[idx])
+
+    def __iter__(self):
+        for epoch, action in zip(self.epochs, self.actions):
+            yield DogEvent(epoch, action)
+
+
+class EventIndex(EventHistory):
+    """An event history kept sorted by time.
+
+    Events can be inserted in any order (eg. backfilled manual
+    entries), and binary search gives O(log n) range and "latest
+    before" lookups. A separate sorted column of epochs is kept for
+    each action.
+
+    """
+    def __init__(self, events: Iterable[DogEvent]=()):
+        history = EventHistory(events)
+        # Sort once, rather than inserting one at a time
+        order = sorted(range(len(history)), key=history.epochs.__getitem__)
+        self.epochs = array('q', (history.epochs[i] for i in order))
+        self.actions = array('B', (history.actions[i] for i in order))
+        self.by_action = {action: array('q') for action in Action}
+        for epoch, action in zip(self.epochs, self.actions):
+            self.by_action[action].append(epoch)
+
+    def append(self, event: DogEvent):
+        self.insert(event)
+
+    def insert(self, event: DogEvent):
+        """Add an event, keeping the index in time order."""
+        epochs = self.epochs
+        if not epochs or event.epoch >= epochs[-1]:
+            epochs.append(event.epoch)
+            self.actions.append(event.action)
+        else:
+            idx = bisect.bisect_right(epochs, event.epoch)
+            epochs.insert(idx, event.epoch)
+            self.actions.insert(idx, event.action)
+        action_epochs = self.by_action[event.action]
+        action_epochs.insert(bisect.bisect_right(action_epochs, event.epoch), event.epoch)
+
+    def range(self, since: Optional[int]=None, until: Optional[int]=None) -> list:
+        """Events with ``since <= epoch < until``, in time order."""
+        start = 0 if since is None else bisect.bisect_left(self.epochs, since)
+        stop = len(self) if until is None else bisect.bisect_left(self.epochs, until)
+        return self[start:stop]
+
+    def latest_before(self, action: Action, epoch: Optional[int]=None) -> Optional[DogEvent]:
+        """The most recent *action* at or before *epoch*.
+
+        If *epoch* is omitted, the most recent *action* overall is
+        returned. Returns ``None`` if there is no such event.
+
+        """
+        action_epochs = self.by_action[action]
+        if epoch is None:
+            idx = len(action_epochs)
+        else:
+            idx = bisect.bisect_right(action_epochs, epoch)
+        if idx == 0:
+            return None
+        return DogEvent(action_epochs[idx - 1], action)
+
+
+def compact_log(fpath, timezone=pytz.utc):
+    """Rewrite the log file in time order.
+
+    Comment lines are kept at the top, and each event line is kept
+    exactly as written. Unreadable lines are moved to the quarantine
+    file (see :py:func:`quarantine`). The new file is synced to disk
+    and then replaces the old one atomically, so a power cut leaves
+    either the old log or the new one.
+
+    """
+    parser = timestamp_parser(timezone)
+    comments = []
+    lines = []
+    bad = []
+    with open(fpath, mode='rb') as fp:
+        for line in fp:
+            try:
+                event = parse_record(line, parser)
+            except BadRecord:
+                bad.append(line.rstrip(b'\n'))
+                continue
+            if event is None:
+                if line.strip():
+                    comments.append(line)
+            else:
+                lines.append((event.epoch, line if line.endswith(b'\n') else line + b'\n'))
+    # Stable sort keeps same-second events in their logged order
+    lines.sort(key=lambda item: item[0])
+    tmp_path = '{}.tmp'.format(fpath)
+    with open(tmp_path, mode='wb') as fp:
+        fp.writelines(comments)
+        fp.writelines(line for epoch, line in lines)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, fpath)
+    fsync_directory(fpath)
+    if bad:
+        quarantine(fpath, bad)
+
+
+def fsync_directory(fpath):
+    """Sync the directory holding *fpath*, so that the file's new name
+    (eg. after :py:func:`os.replace`) survives a power cut."""
+    if os.name != 'posix':
+        # Directories can't be opened on Windows
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(fpath)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def quarantine_path(fpath):
+    return '{}.quarantine'.format(fpath)
+
+
+def quarantine(fpath, records):
+    """Move unreadable *records* (bytes, without newlines) out of the
+    way into "<fpath>.quarantine", so they can be looked at later."""
+    with open(quarantine_path(fpath), mode='ab') as fp:
+        fp.writelines(record + b'\n' for record in records)
+    log.warning("Moved %d unreadable records from %s to %s",
+                len(records), fpath, quarantine_path(fpath))
+
+
+def recover_log(fpath, timezone=pytz.utc, tail_size=TAIL_SIZE, checksums=False) -> int:
+    """Clean up records at the end of the log that were cut short,
+    eg. by a power cut while writing.
+
+    Only the last *tail_size* bytes are checked, so this is quick
+    however long the log is. A record counts as torn if it can't be
+    parsed (including a checksum that doesn't match). Torn records are
+    moved to the quarantine file, and any good records after them are
+    kept. A final record that is whole but missing its newline (eg.
+    after editing by hand) is kept, and the newline added.
+
+    If *checksums* is true, the log is written with checksums, so a
+    final record without one was cut short and counts as torn.
+
+    Returns
+    =======
+    count
+      The number of records moved to quarantine.
+
+    """
+    try:
+        size = os.path.getsize(fpath)
+    except FileNotFoundError:
+        return 0
+    with open(fpath, mode='r+b') as fp:
+        start = max(size - tail_size, 0)
+        fp.seek(start)
+        tail = fp.read()
+        if start > 0:
+            # Skip ahead to the first whole line
+            skip = tail.find(b'\n') + 1
+            start += skip
+            tail = tail[skip:]
+        *lines, last = tail.split(b'\n')
+        parser = timestamp_parser(timezone)
+        good = []
+        bad = []
+        first_bad = None # Offset of the first bad record
+        offset = start
+        for raw in lines:
+            try:
+                parse_record(raw, parser)
+            except BadRecord:
+                bad.append(raw)
+                if first_bad is None:
+                    first_bad = offset
+            else:
+                if first_bad is not None:
+                    good.append(raw + b'\n')
+            offset += len(raw) + 1
+        if last:
+            # No newline, so the write may never have finished
+            try:
+                parse_record(last, parser)
+                if checksums and last.count(b'\t') < 2:
+                    raise BadRecord("Missing checksum in {!r}".format(last))
+            except BadRecord:
+                bad.append(last)
+                if first_bad is None:
+                    first_bad = offset
+            else:
+                if first_bad is not None:
+                    good.append(last + b'\n')
+                else:
+                    fp.seek(0, os.SEEK_END)
+                    fp.write(b'\n')
+                    fp.flush()
+                    os.fsync(fp.fileno())
+        if not bad:
+            return 0
+        fp.seek(first_bad)
+        fp.truncate()
+        fp.writelines(good)
+        fp.flush()
+        os.fsync(fp.fileno())
+    quarantine(fpath, bad)
+    return len(bad)
+
+
+def write_synthetic_log(fpath, count, start: Optional[dt.datetime]=None,
+                        timezone=pytz.utc, legacy=False):
+    """Write a log of *count* made-up events, for benchmarks.
+
+    Events are four hours apart, every third one a poop, in the same
+    ISO format written by the status engine, or in the old naive
+    format if *legacy* is true.
+
+    """
+    if start is None:
+        start = timezone.localize(dt.datetime(2015, 1, 1))
+    epoch = to_epoch(start)
+    with open(fpath, mode='w') as fp:
+        for i in range(count):
+            when = from_epoch(epoch + i * 4 * 3600, timezone=timezone)
+            if legacy:
+                timestamp = when.replace(tzinfo=None).isoformat(sep=' ')
+            else:
+                timestamp = when.isoformat()
+            fp.write('{}\t{}\n'.format(timestamp, i % 3 == 0))
+
+
+def record_checksum(record: str) -> str:
+    """The CRC-32 of *record*, as 8 hex digits."""
+    return '{:08x}'.format(zlib.crc32(record.encode()))
+
+
+def format_record(when: dt.datetime, action: int, checksum=False) -> str:
+    """Format one line of the log, including the newline.
+
+    Parameters
+    ==========
+    checksum
+      If true, add a third column with the CRC-32 of the first two.
+
+    """
+    record = '{}\t{}'.format(when.isoformat(), action == Action.POOP)
+    if checksum:
+        record = '{}\t{}'.format(record, record_checksum(record))
+    return record + '\n'
+
+
+def to_epoch(when: dt.datetime) -> int:
+    """Convert an aware datetime to integer epoch seconds."""
+    return int(when.timestamp())
+
+
+def from_epoch(epoch: int, timezone=pytz.utc) -> dt.datetime:
+    """Convert integer epoch seconds to an aware datetime."""
+    return dt.datetime.fromtimestamp(epoch, tz=pytz.utc).astimezone(timezone)
+
+
+def parse_timestamp(text: str, timezone=pytz.utc) -> dt.datetime:
+    """Convert a timestamp from the log into an aware datetime.
+
+    Naive (legacy) timestamps are assumed to be in *timezone*.
+
+    """
+    when = dt.datetime.fromisoformat(text)
+    # Convert naive timezone to aware timezone
+    if when.tzinfo is None:
+        when = timezone.localize(when)
+    return when
+
+
+class TimestampParser():
+    """Turn timestamps from the log straight into epoch seconds.
+
+    The log only ever has two formats, ISO-8601 with a UTC offset
+    ("2019-08-04T19:55:46-05:00") and the older naive one
+    ("2019-08-04 19:55:46"), either with optional microseconds. These
+    are picked apart by position, without building datetime objects.
+    The date, the hour and minute, and the UTC offset are each looked
+    up in a cache, and only checked and worked out the first time they
+    are seen; the seconds come from a table. For naive timestamps the
+    offset of *timezone* is cached per day. On days when it changes
+    (daylight saving) and for anything unexpected, the general
+    :py:func:`parse_timestamp` is used instead.
+
+    """
+    epoch_ordinal = dt.date(1970, 1, 1).toordinal()
+    # Two-digit fields, which raise KeyError if out of range
+    hours = {'{:02d}'.format(i).encode(): i for i in range(24)}
+    sixties = {'{:02d}'.format(i).encode(): i for i in range(60)}
+    seconds = {b':' + key: value for key, value in sixties.items()}
+
+    def __init__(self, timezone=pytz.utc):
+        self.timezone = timezone
+        self._days = {} # date -> seconds from 1970 to midnight UTC
+        self._local_days = {} # date -> seconds from 1970 to local midnight
+        self._minutes = {} # "Thh:mm" -> seconds since midnight
+        self._offsets = {} # "+hh:mm" -> offset in seconds
+
+    def date(self, date: bytes) -> dt.date:
+        if len(date) != 10 or date[4] != 45 or date[7] != 45: # "-"
+            raise KeyError(date)
+        return dt.date(int(date[0:4]), int(date[5:7]), int(date[8:10]))
+
+    def day_seconds(self, date: bytes) -> int:
+        """Seconds from the epoch to midnight UTC at the start of *date*."""
+        day = self.date(date)
+        seconds = self._days[date] = (day.toordinal() - self.epoch_ordinal) * 86400
+        return seconds
+
+    def local_day_seconds(self, date: bytes) -> Optional[int]:
+        """Seconds from the epoch to midnight in *timezone* at the start
+        of *date*, or ``None`` if the UTC offset changes that day."""
+        day = self.date(date)
+        first = self.timezone.localize(dt.datetime.combine(day, dt.time.min))
+        last = self.timezone.localize(dt.datetime.combine(day, dt.time.max))
+        if first.utcoffset() == last.utcoffset():
+            seconds = to_epoch(first)
+        else:
+            seconds = None
+        self._local_days[date] = seconds
+        return seconds
+
+    def local_epoch(self, date: bytes, seconds: int) -> int:
+        """Epoch seconds for a naive time *seconds* after midnight on
+        *date* in *timezone*.
+
+        Raises
+        ======
+        KeyError
+          The UTC offset changes that day.
+
+        """
+        if date in self._local_days:
+            day = self._local_days[date]
+        else:
+            day = self.local_day_seconds(date)
+        if day is None:
+            raise KeyError(date)
+        return day + seconds
+
+    def minute_seconds(self, minute: bytes) -> int:
+        """Seconds from midnight for a time like "T19:55"."""
+        if len(minute) != 6 or minute[0] not in b'T ' or minute[3] != 58: # ":"
+            raise KeyError(minute)
+        seconds = self._minutes[minute] = (self.hours[minute[1:3]] * 3600
+                                           + self.sixties[minute[4:6]] * 60)
+        return seconds
+
+    def offset_seconds(self, offset: bytes) -> int:
+        """Seconds east of UTC for an offset like "-05:00"."""
+        if len(offset) != 6 or offset[0] not in b'+-' or offset[3] != 58: # ":"
+            raise KeyError(offset)
+        seconds = self.hours[offset[1:3]] * 3600 + self.sixties[offset[4:6]] * 60
+        if offset[0] == 45: # "-"
+            seconds = -seconds
+        self._offsets[offset] = seconds
+        return seconds
+
+    def epoch(self, text: bytes) -> int:
+        """Epoch seconds for one timestamp from the log.
+
+        Raises
+        ======
+        ValueError
+          The timestamp can't be read.
+
+        """
+        try:
+            seconds = self._minutes.get(text[10:16])
+            if seconds is None:
+                seconds = self.minute_seconds(text[10:16])
+            seconds += self.seconds[text[16:19]]
+            rest = text[19:]
+            date = text[:10]
+            if rest:
+                if rest[0] == 46: # "."
+                    # Whole seconds are enough for the log
+                    if not rest[1:7].isdigit():
+                        raise KeyError(text)
+                    rest = rest[7:]
+                    if not rest:
+                        return self.local_epoch(date, seconds)
+                offset = self._offsets.get(rest)
+                if offset is None:
+                    offset = self.offset_seconds(rest)
+                day = self._days.get(date)
+                if day is None:
+                    day = self.day_seconds(date)
+                return day + seconds - offset
+            return self.local_epoch(date, seconds)
+        except (IndexError, KeyError, ValueError):
+            pass
+        # Something unusual, so leave it to the general parser
+        return to_epoch(parse_timestamp(text.decode(), timezone=self.timezone))
+
+
+@functools.lru_cache(maxsize=8)
+def timestamp_parser(timezone=pytz.utc) -> TimestampParser:
+    """A shared :py:class:`TimestampParser` for *timezone*."""
+    return TimestampParser(timezone)
+
+
+# The "pooped" column of a record
+RECORD_ACTIONS = {b'True': Action.POOP, b'False': Action.PEE}
+
+
+def parse_record(raw: bytes, parser: TimestampParser) -> Optional[DogEvent]:
+    """Parse one line of the log, as bytes, into an event.
+
+    Returns
+    =======
+    event
+      The parsed event, or ``None`` if the line is blank or a comment.
+
+    Raises
+    ======
+    BadRecord
+      The line is damaged, or its checksum doesn't match.
+
+    """
+    raw = raw.strip()
+    if not raw or raw[0] == 35: # "#"
+        return None
+    fields = raw.split(b'\t')
+    nfields = len(fields)
+    action = RECORD_ACTIONS.get(fields[1]) if 2 <= nfields <= 3 else None
+    if action is None:
+        raise BadRecord("Malformed record {!r}".format(raw))
+    if nfields == 3:
+        checksum = '{:08x}'.format(zlib.crc32(raw[:-len(fields[2]) - 1])).encode()
+        if fields[2] != checksum:
+            raise BadRecord("Checksum mismatch in {!r}".format(raw))
+    try:
+        epoch = parser.epoch(fields[0])
+    except ValueError as e:
+        raise BadRecord("Bad timestamp in {!r}".format(raw)) from e
+    return DogEvent(epoch, action)
+
+
+def parse_line(line: str, timezone=pytz.utc) -> Optional[DogEvent]:
+    """Parse one line of the log into an event.
+
+    Returns
+    =======
+    event
+      The parsed event, or ``None`` if the line is blank or a comment.
+
+    Raises
+    ======
+    BadRecord
+      The line is damaged, or its checksum doesn't match.
+
+    """
+    return parse_record(line.encode(), timestamp_parser(timezone))
+
+
+def iter_events(fpath, timezone=pytz.utc,
+                since: Optional[dt.datetime]=None,
+                until: Optional[dt.datetime]=None,
+                actions: Optional[Iterable[Action]]=None) -> Iterator[DogEvent]:
+    """Lazily yield events from the log file, one at a time.
+
+    The log is not guaranteed to be in time order (manual entries can
+    be in the past), so the whole file is scanned, but only one line
+    is held in memory at a time. Damaged lines are skipped.
+
+    Parameters
+    ==========
+    fpath
+      Path to the log file. A missing file yields no events.
+    timezone
+      Timezone used for legacy timestamps without a UTC offset.
+    since
+      If given, only events at or after this time are yielded.
+    until
+      If given, only events before this time are yielded.
+    actions
+      If given, only events with one of these actions are yielded.
+
+    """
+    if not os.path.exists(fpath):
+        return
+    if actions is not None:
+        actions = set(actions)
+    if since is not None:
+        since = to_epoch(since)
+    if until is not None:
+        until = to_epoch(until)
+    parser = timestamp_parser(timezone)
+    with open(fpath, mode='rb') as fp:
+        for lineno, line in enumerate(fp, start=1):
+            try:
+                event = parse_record(line, parser)
+            except BadRecord as e:
+                log.warning("Skipping line %d of %s: %s", lineno, fpath, e)
+                continue
+            if event is None:
+                continue
+            if since is not None and event.epoch < since:
+                continue
+            if until is not None and event.epoch >= until:
+                continue
+            if actions is not None and event.action not in actions:
+                continue
+            yield event
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Export the bathroom log to standard formats.
+
+Events are streamed from the log one at a time, so CSV and JSON Lines
+exports run in constant memory whatever the size of the log. NumPy
+archives need the whole columns at once, but these are gathered in
+compact arrays (9 bytes per event).
+
+Examples
+========
+::
+
+    python -m humblepi.export history.csv --since 2019-08-01
+    python -m humblepi.export poops.jsonl --action poop --timezone UTC
+    python -m humblepi.export history.npz
+    python -m humblepi.export bench.csv --synthetic 1000000
+
+"""
+
+import sys
+import os
+import csv
+import json
+import time
+import argparse
+import logging
+import tempfile
+from array import array
+from typing import Iterable
+
+import pytz
+
+from .eventlog import Action, DogEvent, parse_timestamp, write_synthetic_log
+from .storage import open_log
+
+
+log = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl', 'npz')
+
+
+def export_csv(events: Iterable[DogEvent], fp, timezone=pytz.utc) -> int:
+    """Write events to *fp* as CSV, with times converted to *timezone*.
+
+    Returns
+    =======
+    count
+      The number of events written.
+
+    """
+    writer = csv.writer(fp)
+    writer.writerow(['timestamp', 'epoch', 'action'])
+    count = 0
+    for event in events:
+        writer.writerow([event.to_datetime(timezone).isoformat(),
+                         event.epoch, Action(event.action).name])
+        count += 1
+    return count
+
+
+def export_jsonl(events: Iterable[DogEvent], fp, timezone=pytz.utc) -> int:
+    """Write events to *fp* as JSON Lines, one object per event."""
+    count = 0
+    for event in events:
+        record = {'timestamp': event.to_datetime(timezone).isoformat(),
+                  'epoch': event.epoch,
+                  'action': Action(event.action).name}
+        fp.write(json.dumps(record))
+        fp.write('\n')
+        count += 1
+    return count
+
+
+def export_npz(events: Iterable[DogEvent], fpath) -> int:
+    """Save events to a NumPy ``.npz`` with ``epoch`` and ``action``
+    columns.
+
+    Requires NumPy, which is not otherwise needed by humblepi.
+
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("NumPy is needed to export .npz files, "
+                          "try 'pip install numpy'.") from None
+    epochs = array('q')
+    actions = array('B')
+    for event in events:
+        epochs.append(event.epoch)
+        actions.append(event.action)
+    np.savez_compressed(fpath,
+                        epoch=np.frombuffer(epochs, dtype=np.int64),
+                        action=np.frombuffer(actions, dtype=np.uint8))
+    return len(epochs)
+
+
+def export(events: Iterable[DogEvent], output, fmt='csv', timezone=pytz.utc) -> int:
+    """Export *events* to the file path *output* ("-" for stdout)."""
+    if fmt == 'npz':
+        if output == '-':
+            raise ValueError("Cannot write .npz files to stdout.")
+        return export_npz(events, output)
+    exporter = {'csv': export_csv, 'jsonl': export_jsonl}[fmt]
+    if output == '-':
+        return exporter(events, sys.stdout, timezone=timezone)
+    with open(output, mode='w', newline='') as fp:
+        return exporter(events, fp, timezone=timezone)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the bathroom log.")
+    parser.add_argument('output', help="file to write, or '-' for stdout")
+    parser.add_argument('--format', '-f', choices=FORMATS,
+                        help='output format (default: from the file extension)')
+    parser.add_argument('--logfile', help='bathroom log (default from config)')
+    parser.add_argument('--since', help='only events on or after this date/time')
+    parser.add_argument('--until', help='only events before this date/time')
+    parser.add_argument('--action', choices=[a.name.lower() for a in Action],
+                        action='append', help='only these actions (may be repeated)')
+    parser.add_argument('--timezone', help='timezone for exported times (default from config)')
+    parser.add_argument('--synthetic', type=int, metavar='N',
+                        help='export N made-up events instead, to measure throughput')
+    args = parser.parse_args(argv)
+    if args.format is None:
+        ext = os.path.splitext(args.output)[1].lstrip('.')
+        args.format = ext if ext in FORMATS else 'csv'
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from .engine import StatusEngine
+    # Use the same settings as the running app
+    engine = StatusEngine()
+    engine.reload_config()
+    log_timezone = engine.timezone
+    timezone = pytz.timezone(args.timezone) if args.timezone else log_timezone
+    logfile = args.logfile or engine.logfile
+    backend = engine.log_backend
+    tmpdir = None
+    if args.synthetic:
+        tmpdir = tempfile.TemporaryDirectory()
+        logfile = os.path.join(tmpdir.name, 'synthetic-log.tsv')
+        backend = 'tsv'
+        write_synthetic_log(logfile, args.synthetic, timezone=log_timezone)
+    event_log = open_log(logfile, backend=backend, dog=engine.dog_name,
+                         timezone=log_timezone)
+    try:
+        since = args.since and parse_timestamp(args.since, timezone=timezone)
+        until = args.until and parse_timestamp(args.until, timezone=timezone)
+        actions = args.action and [Action[a.upper()] for a in args.action]
+        events = event_log.iter_events(since=since or None, until=until or None,
+                                       actions=actions or None)
+        start = time.perf_counter()
+        count = export(events, args.output, fmt=args.format, timezone=timezone)
+        elapsed = time.perf_counter() - start
+    finally:
+        event_log.close()
+        if tmpdir is not None:
+            tmpdir.cleanup()
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    print("Exported {} events in {:.2f} s ({:.0f} events/s)".format(count, elapsed, rate),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""A scrollable history of bathroom events for the touchscreen.
+
+The model reads rows lazily from the engine's
+:py:class:`~humblepi.eventlog.EventIndex`: the view starts with one
+page of rows and asks for more as the user scrolls towards the end.
+Formatted rows are kept in a small cache, so memory does not grow
+with the size of the log.
+
+"""
+
+import logging
+from collections import OrderedDict
+
+from PyQt5 import QtWidgets, QtCore
+from PyQt5.QtCore import Qt
+
+from .eventlog import Action, EventIndex, from_epoch
+
+
+log = logging.getLogger(__name__)
+
+
+class HistoryModel(QtCore.QAbstractTableModel):
+    """Table model showing events newest-first, fetched in pages.
+
+    Parameters
+    ==========
+    events
+      The sorted event index to show.
+    timezone
+      Timezone in which to display the event times.
+
+    """
+    page_size = 100
+    cache_size = 500 # Most formatted rows to keep around
+    headers = ('Time', 'Action')
+    time_fmt = '%a %Y-%m-%d %H:%M'
+
+    def __init__(self, events: EventIndex, timezone, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = events
+        self.timezone = timezone
+        self._loaded = 0
+        self._cache = OrderedDict()
+        self.fetchMore()
+
+    def reset(self):
+        """Start over, eg. after new events have been added."""
+        self.beginResetModel()
+        self._loaded = 0
+        self._cache.clear()
+        self.endResetModel()
+        self.fetchMore()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._loaded
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return False
+        return self._loaded < len(self.events)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return
+        remaining = len(self.events) - self._loaded
+        count = min(self.page_size, remaining)
+        if count <= 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def row(self, row):
+        """Formatted (time, action) strings for *row*, newest first."""
+        cached = self._cache.get(row)
+        if cached is not None:
+            self._cache.move_to_end(row)
+            return cached
+        event = self.events[len(self.events) - 1 - row]
+        when = from_epoch(event.epoch, timezone=self.timezone)
+        cached = (when.strftime(self.time_fmt), Action(event.action).name.title())
+        self._cache[row] = cached
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return cached
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        return self.row(index.row())[index.column()]
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+        return None
+
+
+class HistoryDialog(QtWidgets.QDialog):
+    """Full-screen dialog with a scrolling list of past events."""
+    row_height = 48 # Big enough to scroll with a finger
+
+    def __init__(self, events: EventIndex, timezone, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setWindowTitle("History")
+        self.model = HistoryModel(events, timezone, parent=self)
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.model)
+        # Fixed row heights let the view skip measuring each row
+        vheader = self.table.verticalHeader()
+        vheader.setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        vheader.setDefaultSectionSize(self.row_height)
+        vheader.hide()
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        self.table.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        QtWidgets.QScroller.grabGesture(self.table.viewport(),
+                                        QtWidgets.QScroller.LeftMouseButtonGesture)
+        self.btnClose = QtWidgets.QPushButton("Close")
+        self.btnClose.clicked.connect(self.hide)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addWidget(self.btnClose)
+
+    def set_events(self, events: EventIndex):
+        """Show *events*, starting again from the newest."""
+        self.model.events = events
+        self.model.reset()
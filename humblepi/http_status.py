@@ -0,0 +1,188 @@
+"""A small HTTP server that reports the dog's status as JSON.
+
+Endpoints
+=========
+``/status``
+  The current status of each action.
+``/history?limit=N``
+  The most recent *N* events from the log (default 50).
+
+Every response carries an ``ETag``. A request with a matching
+``If-None-Match`` header gets an empty 304 response. If ``/status`` is
+also given ``?wait=SECONDS``, the request is held open until the
+status changes (or the wait runs out), so clients learn about changes
+immediately without busy polling.
+
+A ``wait`` or ``limit`` that isn't a number gets a 400 response.
+
+"""
+
+import json
+import math
+import logging
+import os
+import threading
+import uuid
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from .eventlog import Action
+
+
+log = logging.getLogger(__name__)
+
+MAX_WAIT = 60 # Longest a long-poll request may be held, in seconds
+DEFAULT_HISTORY = 50
+
+
+class StatusPublisher():
+    """Keep the current status JSON and let requests wait for changes.
+
+    Connected to the engine's ``snapshot_changed`` signal, so it is
+    updated from whichever thread runs the engine. The version count
+    starts again with each process, so the ETag also carries a random
+    nonce: an ETag from before a restart never matches a new body.
+
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.nonce = uuid.uuid4().hex[:16]
+        self.version = 0
+        self.body = b''
+        self.condition = threading.Condition()
+        self.update()
+        engine.snapshot_changed.connect(self.update)
+
+    @property
+    def etag(self):
+        return '"status-{}-{}"'.format(self.nonce, self.version)
+
+    def update(self, snapshot=None):
+        body = json.dumps(self.engine.state_dict()).encode()
+        with self.condition:
+            self.version += 1
+            self.body = body
+            self.condition.notify_all()
+
+    def wait_for_change(self, etag, timeout):
+        """Block until the ETag no longer matches *etag*, or *timeout*
+        seconds pass.
+
+        Returns
+        =======
+        etag, body
+          The current ETag and JSON body.
+
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.etag != etag, timeout=timeout)
+            return self.etag, self.body
+
+
+def history_etag(fpath):
+    """An ETag for the log file based on its size and mtime.
+
+    An SQLite log in WAL mode is written to a separate "-wal" file
+    between checkpoints, so that file is included too.
+
+    """
+    parts = []
+    for path in (fpath, fpath + '-wal'):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        parts.append('{}-{}'.format(stat.st_size, stat.st_mtime_ns))
+    if not parts:
+        return '"history-empty"'
+    return '"history-{}"'.format('-'.join(parts))
+
+
+def history_json(engine, limit=DEFAULT_HISTORY):
+    """The last *limit* events from the engine's sorted event index."""
+    events = engine.events[-limit:] if limit > 0 else []
+    history = [{'time': event.to_datetime(engine.timezone).isoformat(),
+                'action': Action(event.action).name}
+               for event in events]
+    return json.dumps(history).encode()
+
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    # Set on the server by :py:func:`start_http_server`
+    publisher = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/status':
+            self.get_status(query)
+        elif url.path == '/history':
+            self.get_history(query)
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def get_status(self, query):
+        client_etag = self.headers.get('If-None-Match')
+        try:
+            wait = float(query.get('wait', [0])[0])
+            if not math.isfinite(wait):
+                raise ValueError(wait)
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "wait must be a number of seconds")
+            return
+        if client_etag is not None and wait > 0:
+            etag, body = self.publisher.wait_for_change(client_etag,
+                                                        timeout=min(wait, MAX_WAIT))
+        else:
+            with self.publisher.condition:
+                etag, body = self.publisher.etag, self.publisher.body
+        self.send_body(etag, body, client_etag)
+
+    def get_history(self, query):
+        engine = self.publisher.engine
+        try:
+            limit = int(query.get('limit', [DEFAULT_HISTORY])[0])
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "limit must be a whole number")
+            return
+        etag = '{}-{}"'.format(history_etag(engine.logfile)[:-1], limit)
+        client_etag = self.headers.get('If-None-Match')
+        body = b'' if client_etag == etag else history_json(engine, limit=limit)
+        self.send_body(etag, body, client_etag)
+
+    def send_body(self, etag, body, client_etag=None):
+        if client_etag == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+def start_http_server(engine, host='', port=8080):
+    """Serve the engine's status over HTTP from a background thread.
+
+    Returns
+    =======
+    server
+      The running server. Call ``server.shutdown()`` to stop it.
+
+    """
+    handler = type('Handler', (StatusRequestHandler,),
+                   {'publisher': StatusPublisher(engine)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    log.info("Serving status over HTTP on %s:%d", host, server.server_port)
+    return server
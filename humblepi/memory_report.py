@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Report how much memory the touchscreen app uses after startup.
+
+Builds the same objects as ``run_humble_pi`` (without connecting to
+MQTT or entering the event loop) and prints the resident set size.
+Run it on the Pi with ``python -m humblepi.memory_report``. Without a
+display, set ``QT_QPA_PLATFORM=offscreen``.
+
+"""
+
+import sys
+import argparse
+
+# Resident memory we aim to stay under so the app can share a Pi Zero
+# (512 MB) with other services
+TARGET_MB = 80
+
+
+def resident_mb():
+    """Current resident set size of this process, in MB."""
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("VmRSS not found in /proc/self/status")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--headless', action='store_true',
+                        help='measure the status engine without Qt')
+    args = parser.parse_args()
+    baseline = resident_mb()
+    if args.headless:
+        from humblepi.engine import StatusEngine
+        dog_status = StatusEngine()
+    else:
+        from PyQt5 import QtWidgets
+        from humblepi.puppy_status_view import PuppyStatusView
+        from humblepi.dogstatus import DogStatus
+        app = QtWidgets.QApplication(sys.argv)
+        puppy_view = PuppyStatusView()
+        dog_status = DogStatus()
+        puppy_view.connect_dog_status(dog_status)
+        dog_status.connect_puppy_view(puppy_view)
+        puppy_view.show()
+        app.processEvents()
+    dog_status.reload_config()
+    dog_status.load_datetimes()
+    rss = resident_mb()
+    print("Interpreter baseline: {:.1f} MB".format(baseline))
+    print("Resident after startup: {:.1f} MB (target {} MB)".format(rss, TARGET_MB))
+    return 0 if rss <= TARGET_MB else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
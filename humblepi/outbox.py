@@ -0,0 +1,104 @@
+"""Keep MQTT messages on disk until the broker can be reached.
+
+Only the newest message for each topic matters for retained state, so
+the outbox holds at most one message per topic. Messages are saved to
+a small JSON file, so they survive a restart as well as a Wi-Fi
+outage.
+
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from paho.mqtt import client as mqtt_client
+
+
+log = logging.getLogger(__name__)
+
+
+class MQTTOutbox():
+    """A bounded, on-disk outbox of unsent MQTT messages.
+
+    Parameters
+    ==========
+    fpath
+      JSON file in which to keep the messages. If ``None``, the
+      outbox is only kept in memory.
+    max_topics
+      The most topics to hold. When full, the topic that was least
+      recently updated is dropped.
+
+    """
+    def __init__(self, fpath=None, max_topics=64):
+        self.fpath = fpath
+        self.max_topics = max_topics
+        self.messages = OrderedDict()
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        if self.fpath is None or not os.path.exists(self.fpath):
+            return
+        try:
+            with open(self.fpath) as fp:
+                messages = json.load(fp)
+        except (OSError, ValueError) as e:
+            log.warning("Could not read MQTT outbox %s: %s", self.fpath, e)
+            return
+        with self._lock:
+            for topic, payload, qos, retain in messages:
+                self.messages[topic] = (payload, qos, retain)
+
+    def save(self):
+        """Write the outbox to disk, replacing the old file atomically."""
+        if self.fpath is None:
+            return
+        with self._lock:
+            messages = [(topic, *msg) for topic, msg in self.messages.items()]
+        tmp_path = self.fpath + '.tmp'
+        with open(tmp_path, mode='w') as fp:
+            json.dump(messages, fp)
+        os.replace(tmp_path, self.fpath)
+
+    def put(self, topic, payload, qos=0, retain=False, save=True):
+        """Add a message, replacing any unsent message on the same topic."""
+        with self._lock:
+            self.messages.pop(topic, None)
+            self.messages[topic] = (payload, qos, retain)
+            while len(self.messages) > self.max_topics:
+                dropped, _ = self.messages.popitem(last=False)
+                log.warning("MQTT outbox full, dropping message for %s", dropped)
+        if save:
+            self.save()
+
+    def drain(self, client):
+        """Publish all waiting messages in one batch.
+
+        Messages that the client accepts are removed. Draining stops at
+        the first failure, and the rest are kept for next time.
+
+        Returns
+        =======
+        sent
+          The number of messages sent.
+
+        """
+        sent = 0
+        with self._lock:
+            for topic, (payload, qos, retain) in list(self.messages.items()):
+                msg = client.publish(topic=topic, payload=payload, qos=qos, retain=retain)
+                if msg.rc != mqtt_client.MQTT_ERR_SUCCESS:
+                    break
+                del self.messages[topic]
+                sent += 1
+            if sent:
+                self.save()
+        if sent:
+            log.debug("Sent %d messages from MQTT outbox.", sent)
+        return sent
+
+    def __len__(self):
+        return len(self.messages)
@@ -1,7 +1,6 @@
 import os
 import logging
 from enum import Enum
-import datetime as dt
 import pytz
 from pathlib import Path
 
@@ -10,6 +9,8 @@ from PyQt5.QtCore import pyqtSignal
 # from PyQt5.QtWidgets import QMainWindow, QPushButton
 
 from .dogstatus import DogAction
+from .clock import SYSTEM_CLOCK
+from .eventlog import Action, DogEvent, EventIndex
 
 
 log = logging.getLogger(__name__)
@@ -19,39 +20,83 @@ load_icon = lambda p: QtGui.QIcon(str(p))
 load_pixmap = lambda p: QtGui.QPixmap(str(p))
 
 
+def load_scaled_pixmap(path, height):
+    """Load a pixmap scaled to *height*, shared through Qt's pixmap
+    cache so it is only decoded and scaled once."""
+    key = '{}@{}'.format(path, height)
+    pixmap = QtGui.QPixmapCache.find(key)
+    if pixmap is None:
+        pixmap = load_pixmap(path).scaledToHeight(height)
+        QtGui.QPixmapCache.insert(key, pixmap)
+    return pixmap
+
+
 class PuppyStatusView(QtCore.QObject):
     timezone = pytz.utc
     
     ui_root = Path(__file__).parent
     ui_file = ui_root/'./dog_status_window.ui'
     ui_file_manual = ui_root/'./manual_addition_dialog.ui'
-    icoPeeBlack = None
+    ico_height = 32 # Height of the connection status icons
     
     pee_button_clicked = pyqtSignal(object) # Datetime for when the "click" took place
     poop_button_clicked = pyqtSignal(object) # Datetime for when the "click" took place
+    events_added = pyqtSignal(object) # List of DogEvents to add together
     
     states = DogAction.states
     
-    btn_flasher = QtCore.QTimer(singleShot=False)
+    flash_interval = 0.5 # in seconds
+    flash_checks = 4 # times per flash_interval to check the clock
+    clock = SYSTEM_CLOCK
+    _snapshot = None
+    _manual_dialog = None
+    _ui_manual = None
+    history_dialog = None
+    dog_status = None
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.flashing = set() # Styling functions to toggle on each flash
+        self._flash_highlight = None # Highlighting at the last flash
+        self.btn_flasher = QtCore.QTimer(self, singleShot=False)
+        self.btn_flasher.timeout.connect(self.flash)
         self.load_ui()
     
     def show(self):
-        self.btn_flasher.start(500)
+        self.btn_flasher.start(int(self.flash_interval * 1000 / self.flash_checks))
         self.window.show()
         self.set_layout()
     
     def connect_dog_status(self, status):
-        status.pooping.status_changed.connect(self.update_pooping_status)
-        status.pooping.time_changed.connect(self.update_pooping_time)
-        status.peeing.status_changed.connect(self.update_peeing_status)
-        status.peeing.time_changed.connect(self.update_peeing_time)
+        status.snapshot_changed.connect(self.apply_snapshot)
         status.mqtt_connection_changed.connect(self.update_mqtt_status)
         status.wifi_connection_changed.connect(self.update_wifi_status)
         self.timezone = status.timezone
+        self.clock = status.clock
+        self.dog_status = status
 
+    def apply_snapshot(self, snapshot):
+        """Update the buttons from a status snapshot in one batch.
+        
+        Only the parts that differ from the previous snapshot are
+        restyled, and the window is repainted once at the end.
+        
+        """
+        old = self._snapshot
+        self.window.setUpdatesEnabled(False)
+        try:
+            if old is None or snapshot.peeing_status != old.peeing_status:
+                self.update_peeing_status(snapshot.peeing_status)
+            if old is None or snapshot.peeing_time != old.peeing_time:
+                self.update_peeing_time(snapshot.peeing_time)
+            if old is None or snapshot.pooping_status != old.pooping_status:
+                self.update_pooping_status(snapshot.pooping_status)
+            if old is None or snapshot.pooping_time != old.pooping_time:
+                self.update_pooping_time(snapshot.pooping_time)
+        finally:
+            self.window.setUpdatesEnabled(True)
+        self._snapshot = snapshot
+    
     def update_mqtt_status(self, new_status):
         if new_status:
             self.ui.lblMQTTStatus.setPixmap(self.icoMQTTActive)
@@ -72,47 +117,80 @@ class PuppyStatusView(QtCore.QObject):
     
     def update_pooping_status(self, new_status):
         if new_status == self.states.WARNING:
-            self.disconnect_signal(self.btn_flasher.timeout, self.style_poop_button)
+            self.flashing.discard(self.style_poop_button)
             self.style_poop_button(highlight=True)
         elif new_status == self.states.OVERDUE:
-            self.btn_flasher.timeout.connect(self.style_poop_button)
+            self.flashing.add(self.style_poop_button)
+            self.style_poop_button(highlight=self.flash_highlight())
         else:
-            self.disconnect_signal(self.btn_flasher.timeout, self.style_poop_button)
+            self.flashing.discard(self.style_poop_button)
             self.style_poop_button(highlight=False)
     
     def update_peeing_status(self, new_status):
         if new_status == self.states.WARNING:
-            self.disconnect_signal(self.btn_flasher.timeout, self.style_pee_button)
+            self.flashing.discard(self.style_pee_button)
             self.style_pee_button(highlight=True)
         elif new_status == self.states.OVERDUE:
-            self.btn_flasher.timeout.connect(self.style_pee_button)
+            self.flashing.add(self.style_pee_button)
+            self.style_pee_button(highlight=self.flash_highlight())
         else:
-            self.disconnect_signal(self.btn_flasher.timeout, self.style_pee_button)
+            self.flashing.discard(self.style_pee_button)
             self.style_pee_button(highlight=False)
     
-    def disconnect_signal(self, signal, slot):
-        try:
-            signal.disconnect(slot)
-        except TypeError:
-            pass
+    def flash_highlight(self):
+        """Whether flashing buttons are highlighted right now.
+        
+        Alternates every ``flash_interval`` seconds of ``self.clock``,
+        so simulated time drives the flashing too.
+        
+        """
+        return int(self.clock.monotonic() / self.flash_interval) % 2 == 0
+    
+    def flash(self):
+        """Toggle the highlighting of any overdue buttons, if the clock
+        has moved on to the next flash.
+        
+        Called by ``btn_flasher`` several times per ``flash_interval``.
+        
+        """
+        highlight = self.flash_highlight()
+        if highlight == self._flash_highlight:
+            return
+        self._flash_highlight = highlight
+        for style_button in self.flashing:
+            style_button(highlight=highlight)
+    
+    @property
+    def manual_dialog(self):
+        """The dialog for manually adding events, built on first use."""
+        if self._manual_dialog is None:
+            self.load_manual_ui()
+        return self._manual_dialog
+    
+    @property
+    def ui_manual(self):
+        if self._ui_manual is None:
+            self.load_manual_ui()
+        return self._ui_manual
+    
+    def icon(self, filename):
+        """Load a button icon from disk the first time it's needed."""
+        if filename not in self._icons:
+            self._icons[filename] = load_icon(self.ui_root/filename)
+        return self._icons[filename]
     
     def load_ui(self):
         # Load the Qt Designer .ui files
         Ui_FrameWindow, QMainWindow = uic.loadUiType(self.ui_file)
-        Ui_ManualWindow, QManualDialog = uic.loadUiType(self.ui_file_manual)
         log.debug("Built windows using uic") 
         # Create the UI elements
         self.window = QMainWindow()
-        self.manual_dialog = QManualDialog()
         self.ui = Ui_FrameWindow()
-        self.ui_manual = Ui_ManualWindow()
         self.ui.setupUi(self.window)
-        self.ui_manual.setupUi(self.manual_dialog)
-        # Load the button icons from disk
-        self.icoPeeWhite = load_icon(self.ui_root/'dog-peeing-icon-white.svg')
-        self.icoPeeBlack = load_icon(self.ui_root/'dog-peeing-icon.svg')
-        self.icoPoopBlack = load_icon(self.ui_root/'dog-pooping-icon.svg')
-        self.icoPoopWhite = load_icon(self.ui_root/'dog-pooping-icon-white.svg')
+        self._icons = {}
+        # Secondary UI is built when first used
+        self._manual_dialog = None
+        self._ui_manual = None
         # Set the default button states
         self.style_pee_button(highlight=False)
         self.style_poop_button(highlight=False)
@@ -121,14 +199,11 @@ class PuppyStatusView(QtCore.QObject):
         self.ui.btnPoop.clicked.connect(self.poop_button_clicked.emit)
         # Connect signals for manually adding times
         self.ui.btnManualAdd.clicked.connect(self.show_manual_add_dialog)
-        self.ui_manual.btnCancel.clicked.connect(self.manual_dialog.hide)
-        self.ui_manual.btnOK.clicked.connect(self.add_manual_event)
         # Load icons for connection status from disk
-        ico_height = 32
-        self.icoMQTTActive = load_pixmap(self.ui_root/'mqtt-icon-active.png').scaledToHeight(ico_height)
-        self.icoMQTTInactive = load_pixmap(self.ui_root/'mqtt-icon-inactive.png').scaledToHeight(ico_height)
-        self.icoWifiActive = load_pixmap(self.ui_root/'wifi-icon-active.png').scaledToHeight(ico_height)
-        self.icoWifiInactive = load_pixmap(self.ui_root/'wifi-icon-inactive.png').scaledToHeight(ico_height)
+        self.icoMQTTActive = load_scaled_pixmap(self.ui_root/'mqtt-icon-active.png', self.ico_height)
+        self.icoMQTTInactive = load_scaled_pixmap(self.ui_root/'mqtt-icon-inactive.png', self.ico_height)
+        self.icoWifiActive = load_scaled_pixmap(self.ui_root/'wifi-icon-active.png', self.ico_height)
+        self.icoWifiInactive = load_scaled_pixmap(self.ui_root/'wifi-icon-inactive.png', self.ico_height)
         # Prepare the status bar for connection icons
         self.ui.lblWifiStatus = QtWidgets.QLabel("[Internet]")
         self.ui.lblWifiStatus.setPixmap(self.icoWifiActive)
@@ -136,25 +211,60 @@ class PuppyStatusView(QtCore.QObject):
         self.ui.lblMQTTStatus = QtWidgets.QLabel("[MQTT]")
         self.ui.lblMQTTStatus.setPixmap(self.icoMQTTActive)
         self.ui.statusbar.addWidget(self.ui.lblMQTTStatus)
+        # Button for scrolling back through past events
+        self.ui.btnHistory = QtWidgets.QPushButton("History")
+        self.ui.btnHistory.clicked.connect(self.show_history)
+        self.ui.statusbar.addPermanentWidget(self.ui.btnHistory)
+        self.history_dialog = None
+    
+    def load_manual_ui(self):
+        """Build the dialog for manually adding events."""
+        Ui_ManualWindow, QManualDialog = uic.loadUiType(self.ui_file_manual)
+        self._manual_dialog = QManualDialog()
+        self._ui_manual = Ui_ManualWindow()
+        self._ui_manual.setupUi(self._manual_dialog)
+        self._manual_dialog.setCursor(self.window.cursor())
+        # Connect signals for manually adding times
+        self._ui_manual.btnCancel.clicked.connect(self._manual_dialog.hide)
+        self._ui_manual.btnOK.clicked.connect(self.add_manual_event)
+        log.debug("Built manual addition dialog")
     
     def add_manual_event(self, *args, **kwargs):
-        # emit the selected datetime signals
+        # emit the selected events in one batch
         new_datetime = self.ui_manual.dteTarget.dateTime().toPyDateTime()
         new_datetime = self.timezone.localize(new_datetime)
+        events = []
         if self.ui_manual.chkPeed.isChecked():
-            self.pee_button_clicked.emit(new_datetime)
+            events.append(DogEvent.from_datetime(new_datetime, Action.PEE))
         if self.ui_manual.chkPooped.isChecked():
-            self.poop_button_clicked.emit(new_datetime)
+            events.append(DogEvent.from_datetime(new_datetime, Action.POOP))
+        if events:
+            self.events_added.emit(events)
         # Hide the dialog
         self.manual_dialog.hide()
     
     def show_manual_add_dialog(self, *args, **kwargs):
         # Set the default datetime value to now
-        now = dt.datetime.now()
+        now = self.clock.now()
         now = QtCore.QDateTime(now.year, now.month, now.day, now.hour, now.minute)
         self.ui_manual.dteTarget.setDateTime(now)
         self.manual_dialog.showFullScreen()
     
+    def show_history(self, *args, **kwargs):
+        """Show the history of past events, building the dialog on
+        first use."""
+        if self.dog_status is not None:
+            events = self.dog_status.events
+        else:
+            events = EventIndex()
+        if self.history_dialog is None:
+            from .history_view import HistoryDialog
+            self.history_dialog = HistoryDialog(events, self.timezone)
+            self.history_dialog.setCursor(self.window.cursor())
+        else:
+            self.history_dialog.set_events(events)
+        self.history_dialog.showFullScreen()
+    
     def style_pee_button(self, highlight=None):
         """Decide how to style the peeing button.
         
@@ -166,10 +276,10 @@ class PuppyStatusView(QtCore.QObject):
         # Determine how to style the button
         if highlight:
             css = 'background-color: yellow;'
-            icon = self.icoPeeBlack
+            icon = self.icon('dog-peeing-icon.svg')
         else:
             css = ''
-            icon = self.icoPeeBlack
+            icon = self.icon('dog-peeing-icon.svg')
         # Update the UI elements
         self.ui.btnPee.highlighted = highlight
         self.ui.btnPee.setIcon(icon)
@@ -187,10 +297,10 @@ class PuppyStatusView(QtCore.QObject):
         # Determine how to style the button
         if highlight:
             css = "background-color: brown; color: white;"
-            icon = self.icoPoopWhite
+            icon = self.icon('dog-pooping-icon-white.svg')
         else:
             css = ''
-            icon = self.icoPoopBlack
+            icon = self.icon('dog-pooping-icon.svg')
         # Update the UI elements
         self.ui.btnPoop.highlighted = highlight
         self.ui.btnPoop.setIcon(icon)
@@ -201,4 +311,5 @@ class PuppyStatusView(QtCore.QObject):
         self.window.showFullScreen()
         # Hide the cursor when over the window
         self.window.setCursor(QtGui.QCursor(QtCore.Qt.BlankCursor))
-        self.manual_dialog.setCursor(QtGui.QCursor(QtCore.Qt.BlankCursor))
+        if self._manual_dialog is not None:
+            self._manual_dialog.setCursor(QtGui.QCursor(QtCore.Qt.BlankCursor))
@@ -0,0 +1,79 @@
+"""Rolling "events per day" rates over a sliding window.
+
+Used by the LCD screens and the dog status engine, so that a rate can
+be kept up to date as events happen instead of re-reading a log.
+
+"""
+
+import bisect
+from collections import deque
+from typing import Optional
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+class RateWindow():
+    """Keep a sliding window of event timestamps and report a rate.
+
+    Exactly one of *count* or *duration* should be given.
+
+    Parameters
+    ==========
+    count
+      Keep the last *count* events. The rate is *count* divided by
+      the time since the oldest of them.
+    duration
+      Keep events from the last *duration* seconds. The rate is the
+      number of events divided by *duration*.
+
+    Adding events in time order and querying are O(1) amortized.
+
+    """
+    def __init__(self, count: Optional[int]=None, duration: Optional[float]=None):
+        if (count is None) == (duration is None):
+            raise ValueError("Give exactly one of 'count' or 'duration'.")
+        self.count = count
+        self.duration = duration
+        self.timestamps = deque(maxlen=count)
+
+    def expire(self, now: float):
+        """Drop events that have slid out of a fixed-duration window."""
+        if self.duration is None:
+            return
+        cutoff = now - self.duration
+        while self.timestamps and self.timestamps[0] <= cutoff:
+            self.timestamps.popleft()
+
+    def add(self, timestamp: float):
+        """Add an event at *timestamp* (epoch seconds)."""
+        timestamps = self.timestamps
+        if not timestamps or timestamp >= timestamps[-1]:
+            timestamps.append(timestamp)
+            self.expire(timestamp)
+        elif self.count is not None and len(timestamps) == self.count \
+             and timestamp <= timestamps[0]:
+            # Older than everything in a full window
+            return
+        elif self.duration is not None and timestamp <= timestamps[-1] - self.duration:
+            # Already outside the window
+            return
+        else:
+            # Rare: a back-dated event lands inside the window
+            if len(timestamps) == timestamps.maxlen:
+                timestamps.popleft()
+            bisect.insort(timestamps, timestamp)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def rate(self, now: float) -> float:
+        """Events per day as of *now* (epoch seconds)."""
+        self.expire(now)
+        if self.duration is not None:
+            return len(self.timestamps) / (self.duration / SECONDS_PER_DAY)
+        if len(self.timestamps) < self.count:
+            return 0.
+        days = (now - self.timestamps[0]) / SECONDS_PER_DAY
+        if days <= 0:
+            return float('inf')
+        return len(self.timestamps) / days
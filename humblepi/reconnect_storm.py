@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Simulate a broker restart with hundreds of displays connected.
+
+Every simulated display is a real status engine with its own
+:py:class:`~humblepi.backoff.ReconnectPolicy`, talking to a local
+stand-in for the MQTT broker. The broker accepts only so many
+connections per second, like a real one busy with TLS handshakes. The
+broker is stopped and restarted, and all of this runs on a
+:py:class:`~humblepi.clock.VirtualClock`, so minutes of simulated
+time take a few seconds.
+
+The report compares the reconnect policy with retrying on every tick,
+as the engine used to do.
+
+Examples
+========
+::
+
+    python -m humblepi.reconnect_storm --displays 500 --downtime 60
+
+"""
+
+import sys
+import random
+import logging
+import argparse
+import statistics
+from collections import Counter
+from types import SimpleNamespace
+from typing import NamedTuple
+
+from paho.mqtt import client as mqtt_client
+
+from .backoff import ReconnectPolicy
+from .clock import VirtualClock
+from .engine import StatusEngine
+
+
+class StormBroker():
+    """A broker stand-in that can be stopped, and that refuses
+    connections beyond *capacity* per second."""
+    def __init__(self, clock, capacity=50):
+        self.clock = clock
+        self.capacity = capacity
+        self.up = True
+        self.generation = 0 # Bumped on every restart
+        self.attempts = [] # Times of all connection attempts
+        self.refused = 0
+        self._second = None
+        self._accepted = 0
+
+    def stop(self):
+        self.up = False
+
+    def start(self):
+        self.up = True
+        self.generation += 1
+
+    def accept(self) -> bool:
+        now = self.clock.monotonic()
+        self.attempts.append(now)
+        if int(now) != self._second:
+            self._second = int(now)
+            self._accepted = 0
+        if not self.up or self._accepted >= self.capacity:
+            self.refused += 1
+            return False
+        self._accepted += 1
+        return True
+
+
+class StormClient():
+    """Stands in for a paho client, calling the engine's callbacks
+    from :py:meth:`loop` like the real one."""
+    def __init__(self, broker, engine):
+        self.broker = broker
+        self.engine = engine
+        self.generation = None # Broker generation we're connected to
+        self.connack_pending = False
+        self.connected_at = None
+
+    def reconnect(self):
+        self.generation = None
+        if not self.broker.accept():
+            raise ConnectionRefusedError("Broker refused the connection")
+        self.connack_pending = True
+
+    def loop(self, timeout=1.):
+        broker = self.broker
+        if self.connack_pending:
+            self.connack_pending = False
+            if broker.up:
+                self.generation = broker.generation
+                self.connected_at = broker.clock.monotonic()
+                self.engine.on_mqtt_connect(self, None, {}, mqtt_client.CONNACK_ACCEPTED)
+        elif self.generation is not None and (
+                not broker.up or broker.generation != self.generation):
+            self.generation = None
+            self.engine.on_mqtt_disconnect(self, None, 1)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if self.generation is None:
+            return SimpleNamespace(rc=mqtt_client.MQTT_ERR_NO_CONN)
+        return SimpleNamespace(rc=mqtt_client.MQTT_ERR_SUCCESS)
+
+
+class StormResult(NamedTuple):
+    """What happened after the broker came back."""
+    recovery: float # seconds until every display was connected
+    median: float # median seconds to reconnect
+    p90: float # 90th percentile seconds to reconnect
+    attempts: int # connection attempts during the outage and recovery
+    refused: int # attempts the broker turned away
+    peak_rate: int # most attempts in any one second
+
+
+def naive_policy(clock):
+    """Retry on every tick with no backoff, like the old engine."""
+    return ReconnectPolicy(base=0, cap=0, failure_threshold=float('inf'),
+                           clock=clock)
+
+
+def simulate(displays=300, downtime=30., capacity=50, tick=0.1, limit=3600.,
+             policy_factory=None, engine_class=StatusEngine, seed=0) -> StormResult:
+    """Bounce the broker under *displays* engines and time their
+    recovery.
+
+    Parameters
+    ==========
+    displays
+      How many engines to simulate.
+    downtime
+      Seconds the broker is stopped for.
+    capacity
+      Connections per second the broker accepts.
+    tick
+      Simulated seconds between each engine's MQTT checks.
+    limit
+      Give up if not everyone is back after this many seconds.
+    policy_factory
+      Called with the clock to make each engine's reconnect policy.
+      Defaults to the engine's own policy.
+    engine_class
+      The engine to simulate, eg. :py:class:`~humblepi.dogstatus.DogStatus`.
+    seed
+      Seed for the engines' random jitter.
+
+    """
+    clock = VirtualClock()
+    broker = StormBroker(clock, capacity=capacity)
+    clients = []
+    for i in range(displays):
+        engine = engine_class()
+        engine.set_clock(clock)
+        if policy_factory is not None:
+            engine._reconnect_policy = policy_factory(clock)
+        engine.reconnect_policy.rng = random.Random(seed + i)
+        # No network to ping, and nothing to show
+        engine.update_mqtt_status = lambda *args, **kwargs: None
+        client = StormClient(broker, engine)
+        engine.mqtt_client = client
+        engine.on_mqtt_connect(client, None, {}, mqtt_client.CONNACK_ACCEPTED)
+        client.generation = broker.generation
+        clients.append(client)
+    broker.attempts.clear()
+    # Take the broker down and let everyone notice
+    broker.stop()
+    down_at = clock.monotonic()
+    restarted = False
+    while clock.monotonic() - down_at < downtime + limit:
+        if not restarted and clock.monotonic() - down_at >= downtime:
+            broker.start()
+            up_at = clock.monotonic()
+            restarted = True
+        for client in clients:
+            client.engine.maintain_mqtt()
+        if restarted and all(c.generation == broker.generation for c in clients):
+            break
+        clock.advance(tick)
+    else:
+        raise RuntimeError("Not every display reconnected within {} s.".format(limit))
+    delays = sorted(c.connected_at - up_at for c in clients)
+    per_second = Counter(int(t) for t in broker.attempts)
+    return StormResult(recovery=delays[-1],
+                       median=statistics.median(delays),
+                       p90=delays[int(0.9 * (len(delays) - 1))],
+                       attempts=len(broker.attempts),
+                       refused=broker.refused,
+                       peak_rate=max(per_second.values()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--displays', type=int, default=300)
+    parser.add_argument('--downtime', type=float, default=30.,
+                        help='seconds the broker is down')
+    parser.add_argument('--capacity', type=int, default=50,
+                        help='connections the broker accepts per second')
+    parser.add_argument('--qt', action='store_true',
+                        help='simulate the Qt DogStatus instead of the bare engine')
+    args = parser.parse_args(argv)
+    # Hundreds of failed reconnects would drown out the report
+    logging.basicConfig(level=logging.ERROR)
+    engine_class = StatusEngine
+    if args.qt:
+        from .dogstatus import DogStatus as engine_class
+    print('\t'.join(['policy'] + list(StormResult._fields)))
+    for name, factory in (('backoff', None), ('every tick', naive_policy)):
+        result = simulate(displays=args.displays, downtime=args.downtime,
+                          capacity=args.capacity, policy_factory=factory,
+                          engine_class=engine_class)
+        print('\t'.join([name] + ['{:.1f}'.format(v) if isinstance(v, float) else str(v)
+                                  for v in result]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
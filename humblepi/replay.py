@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Replay the bathroom log through the status rules.
+
+Rather than ticking through time, the state timeline is worked out
+directly from the gaps between events: after each event an action is
+NORMAL until ``seconds_warning`` have passed, then WARNING until
+``seconds_overdue``, then OVERDUE until the next event. This makes the
+cost proportional to the number of events, not the length of time
+covered, so years of history replay in milliseconds.
+
+"""
+
+import sys
+import datetime as dt
+import argparse
+from collections import defaultdict
+from typing import NamedTuple, Iterable, Iterator, Optional
+
+import pytz
+
+from .engine import ActionTracker, StatusEngine
+from .eventlog import Action, EventHistory, from_epoch
+from .storage import open_log
+
+states = ActionTracker.states
+
+SECONDS_PER_WEEK = 7 * 24 * 3600
+
+
+class StateInterval(NamedTuple):
+    """A stretch of time during which an action had one status."""
+    start: int # epoch seconds
+    end: int # epoch seconds
+    action: Action
+    state: states
+
+    @property
+    def seconds(self):
+        return self.end - self.start
+
+
+def action_intervals(epochs: Iterable[int], action: Action,
+                     seconds_warning: float, seconds_overdue: float,
+                     until: int) -> Iterator[StateInterval]:
+    """Yield the state intervals for one action.
+
+    Parameters
+    ==========
+    epochs
+      Sorted epoch seconds when the action took place.
+    action
+      The action these events belong to.
+    seconds_warning, seconds_overdue
+      The same thresholds used by :py:class:`ActionTracker`.
+    until
+      Epoch seconds at which the replay ends.
+
+    """
+    epochs = [epoch for epoch in epochs if epoch < until]
+    next_epochs = epochs[1:] + [until]
+    for start, end in zip(epochs, next_epochs):
+        warning = start + int(seconds_warning)
+        overdue = start + int(seconds_overdue)
+        for state, state_start, state_end in (
+                (states.NORMAL, start, min(warning, end)),
+                (states.WARNING, warning, min(overdue, end)),
+                (states.OVERDUE, overdue, end)):
+            if state_start < state_end:
+                yield StateInterval(state_start, state_end, action, state)
+
+
+def replay(history: EventHistory, thresholds: dict,
+           until: Optional[int]=None) -> list:
+    """Work out the state timeline for every action in *history*.
+
+    Parameters
+    ==========
+    history
+      The events to replay. They do not need to be in time order.
+    thresholds
+      Maps each :py:class:`Action` to a ``(seconds_warning,
+      seconds_overdue)`` tuple.
+    until
+      Epoch seconds at which to stop. Defaults to the last event.
+
+    Returns
+    =======
+    intervals
+      :py:class:`StateInterval` tuples, sorted by action then time.
+
+    """
+    by_action = defaultdict(list)
+    for epoch, action in zip(history.epochs, history.actions):
+        by_action[action].append(epoch)
+    if until is None:
+        until = max(history.epochs, default=0)
+    intervals = []
+    for action, (seconds_warning, seconds_overdue) in thresholds.items():
+        intervals.extend(action_intervals(sorted(by_action[action]), Action(action),
+                                          seconds_warning, seconds_overdue,
+                                          until=until))
+    return intervals
+
+
+def week_start(epoch: int, timezone=pytz.utc) -> dt.date:
+    """The Monday of the week containing *epoch*, in *timezone*."""
+    day = from_epoch(epoch, timezone=timezone).date()
+    return day - dt.timedelta(days=day.weekday())
+
+
+def weekly_summary(intervals: Iterable[StateInterval], timezone=pytz.utc) -> dict:
+    """Add up the hours spent in each state, per week.
+
+    Intervals that cross midnight on Monday are split between the
+    weeks.
+
+    Returns
+    =======
+    summary
+      ``{week_start: {(action, state): hours}}``, where *week_start*
+      is the date of the Monday.
+
+    """
+    summary = defaultdict(lambda: defaultdict(float))
+    boundaries = {} # Cache of week start -> epoch of next week start
+    for interval in intervals:
+        start = interval.start
+        while start < interval.end:
+            week = week_start(start, timezone=timezone)
+            if week not in boundaries:
+                next_week = timezone.localize(dt.datetime.combine(
+                    week + dt.timedelta(days=7), dt.time()))
+                boundaries[week] = int(next_week.timestamp())
+            end = min(interval.end, boundaries[week])
+            summary[week][(interval.action, interval.state)] += (end - start) / 3600
+            start = end
+    return summary
+
+
+def thresholds_from(engine: StatusEngine) -> dict:
+    return {
+        Action.PEE: (engine.peeing.seconds_warning, engine.peeing.seconds_overdue),
+        Action.POOP: (engine.pooping.seconds_warning, engine.pooping.seconds_overdue),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Summarize hours per week spent in each status.")
+    parser.add_argument('logfile', nargs='?', help='bathroom log (default from config)')
+    args = parser.parse_args(argv)
+    # Use the same settings as the running app
+    engine = StatusEngine()
+    engine.reload_config()
+    event_log = open_log(args.logfile or engine.logfile, backend=engine.log_backend,
+                         dog=engine.dog_name, timezone=engine.timezone)
+    try:
+        history = EventHistory(event_log.iter_events())
+    finally:
+        event_log.close()
+    intervals = replay(history, thresholds_from(engine))
+    summary = weekly_summary(intervals, timezone=engine.timezone)
+    columns = [(action, state) for action in Action
+               for state in (states.WARNING, states.OVERDUE)]
+    print('\t'.join(['week'] + ['{} {}'.format(a.name, s.name) for a, s in columns]))
+    for week in sorted(summary):
+        hours = ['{:.1f}'.format(summary[week][column]) for column in columns]
+        print('\t'.join([week.isoformat()] + hours))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
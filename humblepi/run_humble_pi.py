@@ -4,13 +4,7 @@ import sys
 import logging
 from pathlib import Path
 import argparse
-
-from PyQt5 import QtWidgets
-from PyQt5.QtWidgets import QMainWindow
-
-
-from humblepi.puppy_status_view import PuppyStatusView
-from humblepi.dogstatus import DogStatus
+import asyncio
 
 log = logging.getLogger(__name__)
 
@@ -24,16 +18,48 @@ def main():
     else:
         logfile = Path("~/humblepi.log").expanduser()
         logging.basicConfig(filename=logfile, level=logging.INFO)
+    if args.headless:
+        run_headless()
+    else:
+        run_gui(engine_process=args.engine_process)
+
+
+def run_headless():
+    """Run only the status engine and MQTT publishing, without Qt."""
+    from humblepi.engine import StatusEngine
+    dog_status = StatusEngine()
+    dog_status.reload_config()
+    dog_status.load_datetimes()
+    dog_status.prepare_mqtt()
+    dog_status.prepare_http()
+    log.info("Starting headless status engine")
+    asyncio.run(dog_status.run_async())
+
+
+def run_gui(engine_process=False):
+    # Qt is imported here so that headless mode never loads it
+    from PyQt5 import QtWidgets
+    from humblepi.puppy_status_view import PuppyStatusView
+    from humblepi.dogstatus import DogStatus, DogStatusProcess
     # Create the Qt objections
     app = QtWidgets.QApplication(sys.argv)
     puppy_view = PuppyStatusView()
-    dog_status = DogStatus()
+    if engine_process:
+        dog_status = DogStatusProcess()
+    else:
+        dog_status = DogStatus()
+    dog_status.reload_config()
     dog_status.load_datetimes()
     # Connect signals and slots
     puppy_view.connect_dog_status(dog_status)
     dog_status.connect_puppy_view(puppy_view)
     # Start the status monitors
-    dog_status.prepare_mqtt()
+    if engine_process:
+        # The engine process connects to MQTT itself
+        app.aboutToQuit.connect(dog_status.stop)
+    else:
+        dog_status.prepare_mqtt()
+        dog_status.prepare_http()
     dog_status.start()
     # Prepare UI
     puppy_view.load_ui()
@@ -46,6 +72,10 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Show a UI about when the dog last peed/pooped.')
     parser.add_argument('--debug', '-d', action='store_true',
                         help='provide additional logging')
+    parser.add_argument('--headless', action='store_true',
+                        help='run the status engine and MQTT without a display')
+    parser.add_argument('--engine-process', action='store_true',
+                        help='run the status engine in its own process, apart from the GUI')
     args = parser.parse_args()
     return args
 
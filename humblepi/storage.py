@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""Storage backends for the bathroom log.
+
+Two backends share the same small interface (``append``,
+``iter_events``, ``load``, ``latest``, ``compact`` and ``recover``):
+
+:py:class:`TextLog`
+  The original tab-separated file (see :py:mod:`humblepi.eventlog`).
+:py:class:`SQLiteLog`
+  An SQLite database in WAL mode, with an index on (dog, action,
+  epoch). Several local processes (eg. the GUI, a headless publisher
+  and an export script) can read while another writes, and range or
+  "latest" queries use the index instead of scanning the whole log.
+
+:py:func:`open_log` picks the backend from the file extension, so
+setting ``logfile = ~/sheffield.db`` in the ``[dog]`` section of the
+config is enough to switch.
+
+Examples
+========
+::
+
+    python -m humblepi.storage migrate ~/sheffield-bathroom-log.tsv ~/sheffield.db
+    python -m humblepi.storage bench --events 100000
+    python -m humblepi.storage parse-bench --events 1000000
+
+"""
+
+import sys
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+import datetime as dt
+from itertools import islice
+from typing import Optional, Iterable, Iterator
+
+import pytz
+
+from .eventlog import (Action, DogEvent, EventIndex, compact_log, format_record,
+                       from_epoch, iter_events, parse_timestamp, record_checksum,
+                       recover_log, timestamp_parser, to_epoch, write_synthetic_log)
+
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+BACKENDS = ('auto', 'tsv', 'sqlite')
+BATCH_SIZE = 1000 # Rows per executemany() during migrations
+
+
+class TextLog():
+    """The tab-separated log file.
+
+    Parameters
+    ==========
+    fpath
+      Path to the log file.
+    timezone
+      Timezone for new timestamps, and for legacy timestamps without
+      a UTC offset.
+    checksums
+      If true, write a checksum with each record and flush it to disk
+      straight away, so a power cut can't leave a damaged record that
+      looks like a good one.
+
+    """
+    def __init__(self, fpath, timezone=pytz.utc, checksums=False):
+        self.fpath = fpath
+        self.timezone = timezone
+        self.checksums = checksums
+
+    def append(self, events: Iterable[DogEvent]):
+        """Add *events* to the end of the log in a single write."""
+        data = ''.join(format_record(event.to_datetime(self.timezone), event.action,
+                                     checksum=self.checksums)
+                       for event in events).encode()
+        with open(self.fpath, mode='a+b') as fp:
+            if fp.tell() > 0:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b'\n':
+                    # Don't run on from a record that was cut short
+                    data = b'\n' + data
+            fp.write(data)
+            if self.checksums:
+                fp.flush()
+                os.fsync(fp.fileno())
+
+    def iter_events(self, since: Optional[dt.datetime]=None,
+                    until: Optional[dt.datetime]=None,
+                    actions: Optional[Iterable[Action]]=None) -> Iterator[DogEvent]:
+        """Yield events in the order they were logged."""
+        return iter_events(self.fpath, timezone=self.timezone, since=since,
+                           until=until, actions=actions)
+
+    def load(self) -> EventIndex:
+        """Read the whole log into a sorted index."""
+        return EventIndex(self.iter_events())
+
+    def latest(self, action: Action) -> Optional[DogEvent]:
+        """The most recent *action*, or ``None``."""
+        return self.load().latest_before(action)
+
+    def compact(self):
+        """Rewrite the file in time order."""
+        compact_log(self.fpath, timezone=self.timezone)
+
+    def recover(self) -> int:
+        """Quarantine records torn at the end of the file."""
+        return recover_log(self.fpath, timezone=self.timezone, checksums=self.checksums)
+
+    def close(self):
+        pass
+
+
+class SQLiteLog():
+    """The log kept in an SQLite database.
+
+    Events for several dogs can share one database; each instance
+    only sees the rows for *dog*. Each event is only kept once, so
+    adding it again (eg. by running :py:func:`migrate` twice) does
+    nothing.
+
+    Parameters
+    ==========
+    fpath
+      Path to the database file, created if missing.
+    dog
+      Name of the dog whose events are read and written.
+    timezone
+      Unused, but accepted so both backends are built the same way.
+
+    """
+    schema = (
+        "CREATE TABLE IF NOT EXISTS events ("
+        " dog TEXT NOT NULL,"
+        " action INTEGER NOT NULL,"
+        " epoch INTEGER NOT NULL)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS events_unique"
+        " ON events (dog, action, epoch)",
+        # Replaced by the unique index, which serves the same queries
+        "DROP INDEX IF EXISTS events_dog_action_epoch",
+    )
+    # Databases from before the unique index may hold duplicates
+    dedupe_sql = ("DELETE FROM events WHERE rowid NOT IN"
+                  " (SELECT min(rowid) FROM events GROUP BY dog, action, epoch)")
+    insert_sql = "INSERT OR IGNORE INTO events (dog, action, epoch) VALUES (?, ?, ?)"
+
+    def __init__(self, fpath, dog='sheffield', timezone=pytz.utc):
+        self.fpath = fpath
+        self.dog = dog
+        self.timezone = timezone
+        # Shared by the GUI and engine threads, so guard it with a lock
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(fpath, timeout=5,
+                                          check_same_thread=False)
+        with self._lock, self.connection:
+            # Readers don't block the writer (or each other) in WAL mode
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            has_unique = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index'"
+                " AND name = 'events_unique'").fetchone()
+            create_table, *indexes = self.schema
+            self.connection.execute(create_table)
+            if not has_unique:
+                self.connection.execute(self.dedupe_sql)
+            for statement in indexes:
+                self.connection.execute(statement)
+
+    def append(self, events: Iterable[DogEvent]) -> int:
+        """Add *events* in a single transaction, skipping any that are
+        already there.
+
+        Returns
+        =======
+        count
+          The number of events added.
+
+        """
+        rows = [(self.dog, int(event.action), event.epoch) for event in events]
+        with self._lock, self.connection:
+            cursor = self.connection.executemany(self.insert_sql, rows)
+        return cursor.rowcount
+
+    def iter_events(self, since: Optional[dt.datetime]=None,
+                    until: Optional[dt.datetime]=None,
+                    actions: Optional[Iterable[Action]]=None) -> Iterator[DogEvent]:
+        """Yield events in time order.
+
+        Rows are fetched ``BATCH_SIZE`` at a time, so memory use stays
+        flat however many events match, and the lock is only held while
+        each batch is fetched.
+
+        """
+        sql = "SELECT epoch, action FROM events WHERE dog = ?"
+        params = [self.dog]
+        if actions is not None:
+            actions = [int(action) for action in actions]
+            sql += " AND action IN ({})".format(', '.join('?' * len(actions)))
+            params.extend(actions)
+        if since is not None:
+            sql += " AND epoch >= ?"
+            params.append(to_epoch(since))
+        if until is not None:
+            sql += " AND epoch < ?"
+            params.append(to_epoch(until))
+        sql += " ORDER BY epoch"
+        with self._lock:
+            cursor = self.connection.execute(sql, params)
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                for epoch, action in rows:
+                    yield DogEvent(epoch, action)
+        finally:
+            cursor.close()
+
+    def load(self) -> EventIndex:
+        """Read all of this dog's events into a sorted index."""
+        return EventIndex(self.iter_events())
+
+    def latest(self, action: Action) -> Optional[DogEvent]:
+        """The most recent *action*, found from the index alone."""
+        with self._lock:
+            epoch, = self.connection.execute(
+                "SELECT max(epoch) FROM events WHERE dog = ? AND action = ?",
+                (self.dog, int(action))).fetchone()
+        return None if epoch is None else DogEvent(epoch, action)
+
+    def compact(self):
+        """Fold the write-ahead log back into the database file.
+
+        Queries are always sorted, so there is nothing to reorder.
+
+        """
+        with self._lock:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def recover(self) -> int:
+        """Nothing to do: SQLite rolls back unfinished transactions
+        itself."""
+        return 0
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def open_log(fpath, backend='auto', dog='sheffield', timezone=pytz.utc,
+             checksums=False):
+    """Open the log at *fpath* with the right backend.
+
+    Parameters
+    ==========
+    backend
+      One of "tsv", "sqlite", or "auto" to choose SQLite for files
+      ending in .db, .sqlite or .sqlite3.
+    checksums
+      Passed on to :py:class:`TextLog`.
+
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown log backend {!r}, choose from {}."
+                         "".format(backend, ', '.join(BACKENDS)))
+    if backend == 'auto':
+        is_sqlite = os.path.splitext(fpath)[1].lower() in SQLITE_EXTENSIONS
+        backend = 'sqlite' if is_sqlite else 'tsv'
+    if backend == 'sqlite':
+        return SQLiteLog(fpath, dog=dog, timezone=timezone)
+    return TextLog(fpath, timezone=timezone, checksums=checksums)
+
+
+def migrate(src, dest, dog='sheffield', timezone=pytz.utc) -> int:
+    """Copy every event from the TSV log *src* into the SQLite
+    database *dest*.
+
+    Events are inserted in batches of ``BATCH_SIZE``, so the TSV file
+    is streamed rather than read into memory. Events already in *dest*
+    are skipped, so migrating again only copies what is new.
+
+    Returns
+    =======
+    count
+      The number of events copied.
+
+    """
+    database = SQLiteLog(dest, dog=dog, timezone=timezone)
+    events = iter_events(src, timezone=timezone)
+    count = 0
+    try:
+        while True:
+            batch = list(islice(events, BATCH_SIZE))
+            if not batch:
+                break
+            count += database.append(batch)
+    finally:
+        database.close()
+    return count
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def benchmark(count=100000, appends=1000, timezone=pytz.utc) -> dict:
+    """Time common operations on both backends with *count* made-up
+    events.
+
+    Returns
+    =======
+    timings
+      ``{operation: {backend: seconds}}``.
+
+    """
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tsv_path = os.path.join(tmpdir, 'log.tsv')
+        db_path = os.path.join(tmpdir, 'log.db')
+        write_synthetic_log(tsv_path, count, timezone=timezone)
+        timings['migrate'] = {'sqlite': _timed(migrate, tsv_path, db_path,
+                                               timezone=timezone)}
+        logs = {'tsv': TextLog(tsv_path, timezone=timezone),
+                'sqlite': SQLiteLog(db_path, timezone=timezone)}
+        last = logs['sqlite'].latest(Action.PEE).epoch
+        since = from_epoch(last - 7 * 24 * 3600)
+        new_events = [DogEvent(last + i, Action.PEE) for i in range(appends)]
+        def append_each(log):
+            for event in new_events:
+                log.append([event])
+        operations = {
+            'load': lambda log: log.load(),
+            'last week': lambda log: list(log.iter_events(since=since)),
+            'latest poop': lambda log: log.latest(Action.POOP),
+            '{} appends'.format(appends): append_each,
+        }
+        for name, operation in operations.items():
+            timings[name] = {backend: _timed(operation, log)
+                             for backend, log in logs.items()}
+        for log in logs.values():
+            log.close()
+    return timings
+
+
+def _general_iter_events(fpath, timezone=pytz.utc):
+    """Read the log the way :py:func:`iter_events` did before
+    :py:class:`~humblepi.eventlog.TimestampParser`: as text, with
+    every timestamp going through
+    :py:func:`~humblepi.eventlog.parse_timestamp`."""
+    with open(fpath, errors='replace') as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            fields = line.split('\t')
+            if len(fields) not in (2, 3) or fields[1] not in ('True', 'False'):
+                continue
+            if len(fields) == 3 and fields[2] != record_checksum(line[:-len(fields[2]) - 1]):
+                continue
+            timestamp = parse_timestamp(fields[0], timezone=timezone)
+            action = Action.POOP if fields[1] == 'True' else Action.PEE
+            yield DogEvent.from_datetime(timestamp, action=action)
+
+
+def parse_benchmark(count=1000000, timezone=pytz.utc, repeat=3) -> dict:
+    """Time reading *count* made-up events, in each timestamp format,
+    with the general timestamp parser and with the specialized one
+    used by :py:func:`~humblepi.eventlog.iter_events`.
+
+    Each reader starts with empty caches, as when the app starts, and
+    the best of *repeat* runs is kept.
+
+    Returns
+    =======
+    rates
+      ``{format: {parser: events per second}}``.
+
+    """
+    def general(fpath):
+        for event in _general_iter_events(fpath, timezone=timezone):
+            pass
+    def specialized(fpath):
+        timestamp_parser.cache_clear()
+        for event in iter_events(fpath, timezone=timezone):
+            pass
+    rates = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, legacy in (('iso', False), ('legacy', True)):
+            fpath = os.path.join(tmpdir, '{}.tsv'.format(name))
+            write_synthetic_log(fpath, count, timezone=timezone, legacy=legacy)
+            times = {'general': [], 'specialized': []}
+            for i in range(repeat):
+                times['general'].append(_timed(general, fpath))
+                times['specialized'].append(_timed(specialized, fpath))
+            rates[name] = {parser: count / min(elapsed) for parser, elapsed in times.items()}
+    return rates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the bathroom log storage.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='copy a TSV log into SQLite')
+    migrate_parser.add_argument('src', help='existing TSV log')
+    migrate_parser.add_argument('dest', help='SQLite database to create or add to')
+    migrate_parser.add_argument('--dog', help='dog name (default from config)')
+    bench_parser = subparsers.add_parser('bench', help='compare the TSV and SQLite backends')
+    bench_parser.add_argument('--events', type=int, default=100000,
+                              help='number of made-up events in each log')
+    parse_parser = subparsers.add_parser('parse-bench',
+                                         help='compare timestamp parsing speeds')
+    parse_parser.add_argument('--events', type=int, default=1000000,
+                              help='number of made-up events in each log')
+    args = parser.parse_args(argv)
+    from .engine import StatusEngine
+    # Use the same settings as the running app
+    engine = StatusEngine()
+    engine.reload_config()
+    if args.command == 'migrate':
+        count = migrate(os.path.expanduser(args.src), os.path.expanduser(args.dest),
+                        dog=args.dog or engine.dog_name, timezone=engine.timezone)
+        print("Copied {} events into {}".format(count, args.dest))
+    elif args.command == 'parse-bench':
+        rates = parse_benchmark(count=args.events, timezone=engine.timezone)
+        print('\t'.join(['format', 'general (events/s)', 'specialized (events/s)']))
+        for name, results in rates.items():
+            print('\t'.join([name, '{:.0f}'.format(results['general']),
+                             '{:.0f}'.format(results['specialized'])]))
+    else:
+        timings = benchmark(count=args.events, timezone=engine.timezone)
+        print('\t'.join(['operation', 'tsv (s)', 'sqlite (s)']))
+        for name, times in timings.items():
+            row = [name] + ['{:.4f}'.format(times[b]) if b in times else '-'
+                            for b in ('tsv', 'sqlite')]
+            print('\t'.join(row))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
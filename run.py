@@ -1,15 +1,34 @@
 #!/usr/bin/python
 
 import time
+START_TIME = time.perf_counter()
+
+import os
+import asyncio
+import importlib
+import threading
+import logging
+import configparser
 from contextlib import contextmanager
+from importlib import metadata
+from concurrent.futures import ThreadPoolExecutor
 
 import Adafruit_CharLCD as LCD
 
-from dogstatus import Dog, ERROR_COLOR
-from ipstatus import IPStatus
-from smokestatus import SmokeStatus
+from basestatus import RED as ERROR_COLOR
+
+log = logging.getLogger(__name__)
 
 TICK = 0.1 # sleep time in seconds to prevent excessive button presses
+REFRESH = 1. # time in seconds between screen refreshes
+# Buttons in the order they're checked
+BUTTONS = [LCD.LEFT, LCD.RIGHT, LCD.SELECT, LCD.UP, LCD.DOWN]
+
+# Screens to cycle through, as "module:ClassName". Can be overridden
+# with "screens" in the [LCD] section of ~/.humblepirc
+DEFAULT_SCREENS = ['ipstatus:IPStatus', 'smokestatus:SmokeStatus']
+# Other packages can add screens through this entry point group
+ENTRY_POINT_GROUP = 'humblepi.lcd_screens'
 
 def show_exception(e, lcd):
     # Notify user of exception
@@ -23,75 +42,258 @@ def show_exception(e, lcd):
     lcd.message(name)
     raise
 
-@contextmanager
-def wait_for_button(lcd):
-    lcd.set_backlight(0)
-    try:
-        yield
-    except NotImplementedError:
-        backlight_off = True
-        lcd.set_backlight(0)
-    else:
-        backlight_off = False
-    # Wait for user to release buttons
-    btns = [LCD.SELECT, LCD.LEFT, LCD.UP, LCD.DOWN, LCD.RIGHT]
-    while True:
-        pressed = False
-        for btn in btns:
-            if lcd.is_pressed(btn):
-                pressed = True
-        if not pressed:
-            if backlight_off:
-                lcd.set_backlight(1)
-            break
-
-
-def button_loop(lcd, statuses):
-    """Start looping and wait for user input."""
-    # Default to first status
-    active_status = statuses[0]
-    while True:
-        # Have statuses respond to button presses
-        if lcd.is_pressed(LCD.LEFT):
-            with wait_for_button(lcd):
-                active_status.pressed_left()
-        elif lcd.is_pressed(LCD.RIGHT):
-            with wait_for_button(lcd):
-                active_status.pressed_right()
-        elif lcd.is_pressed(LCD.SELECT):
-            with wait_for_button(lcd):
-                active_status.pressed_select()
-        # Change active status on "up" or "down" buttons
-        elif lcd.is_pressed(LCD.UP) or lcd.is_pressed(LCD.DOWN):
-            with wait_for_button(lcd):
-                old_idx = statuses.index(active_status)
-                if lcd.is_pressed(LCD.UP):
-                    new_idx = (old_idx + 1) % len(statuses)
-                if lcd.is_pressed(LCD.DOWN):
-                    new_idx = (old_idx - 1) % len(statuses)                
-                active_status = statuses[new_idx]
-                active_status.update_lcd(force=True)
+
+class ScreenRegistry():
+    """The screens available on the LCD, each imported and created only
+    when first shown.
+
+    A screen that can't be loaded (eg. a typo in the config file) is
+    logged and dropped, and the next one is shown instead.
+
+    Parameters
+    ----------
+    lcd : LCD
+      Passed to each screen when it is created.
+    specs : list
+      Screens as "module:ClassName" strings.
+
+    """
+    def __init__(self, lcd, specs):
+        self.lcd = lcd
+        self.specs = list(specs)
+        self._screens = {}
+
+    @classmethod
+    def from_config(cls, lcd, fpath='~/.humblepirc'):
+        """Build the registry from the config file and entry points."""
+        config = configparser.ConfigParser()
+        config.read(os.path.expanduser(fpath))
+        if config.has_option('LCD', 'screens'):
+            specs = config['LCD']['screens'].split()
+        else:
+            specs = list(DEFAULT_SCREENS)
+        try:
+            entry_points = metadata.entry_points(group=ENTRY_POINT_GROUP)
+        except TypeError:
+            # Python < 3.10
+            entry_points = metadata.entry_points().get(ENTRY_POINT_GROUP, [])
+        specs.extend(ep.value for ep in entry_points if ep.value not in specs)
+        return cls(lcd, specs)
+
+    def __len__(self):
+        return len(self.specs)
+
+    def __getitem__(self, idx):
+        if not self.specs:
+            raise IndexError("No LCD screens could be loaded")
+        idx = idx % len(self.specs)
+        spec = self.specs[idx]
+        if spec not in self._screens:
+            try:
+                module_name, class_name = spec.split(':')
+                module = importlib.import_module(module_name)
+                Screen = getattr(module, class_name)
+            except (ImportError, AttributeError, ValueError):
+                log.exception("Could not load LCD screen %s, skipping it.", spec)
+                del self.specs[idx]
+                return self[idx]
+            self._screens[spec] = Screen(lcd=self.lcd)
+            log.debug("Loaded screen %s", spec)
+        return self._screens[spec]
+
+
+class LockedLCD():
+    """Wrap an LCD so that calls from the event loop and from worker
+    threads never interleave on the bus.
+
+    Inside :py:meth:`drawing`, the LCD stays locked from the first call
+    until the end of the block, so that a screen's whole
+    clear/set_color/message sequence is drawn in one go.
+
+    """
+    def __init__(self, lcd):
+        self._lcd = lcd
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    @contextmanager
+    def drawing(self):
+        """Keep the LCD to this thread once it starts drawing.
+
+        The lock is only taken at the first call, so slow work done
+        before drawing (eg. reading a log file) doesn't hold up the
+        other threads.
+
+        """
+        if getattr(self._local, 'drawing', False):
+            # Already drawing further up the stack
+            yield
+            return
+        self._local.drawing = True
+        self._local.held = False
+        try:
+            yield
+        finally:
+            self._local.drawing = False
+            if self._local.held:
+                self._local.held = False
+                self._lock.release()
+
+    def __getattr__(self, name):
+        attr = getattr(self._lcd, name)
+        if not callable(attr):
+            return attr
+        def locked(*args, **kwargs):
+            local = self._local
+            if getattr(local, 'drawing', False) and not local.held:
+                # Held until the end of the drawing() block
+                self._lock.acquire()
+                local.held = True
+            with self._lock:
+                return attr(*args, **kwargs)
+        return locked
+
+
+class LCDApp():
+    """Respond to button presses and keep the active screen up to date.
+
+    Button polling runs on the event loop, while anything done by the
+    screens themselves (which may be slow, eg. reading a log file) is
+    run in worker threads: one for refreshes and one for button
+    presses. A press is therefore never queued behind a slow refresh,
+    and no new refresh is started while a press is being handled. Each
+    call into a screen draws atomically (see
+    :py:meth:`LockedLCD.drawing`), so a press and a refresh can't
+    garble the display between them.
+
+    Parameters
+    ----------
+    lcd : LockedLCD
+      A physical display adapter that allows control of a display.
+    statuses : ScreenRegistry
+      The ``BaseStatus`` screens to cycle through with UP/DOWN. Any
+      sequence works, but a registry only loads screens when needed.
+
+    """
+    def __init__(self, lcd, statuses):
+        self.lcd = lcd
+        self.statuses = statuses
+        self.active_idx = 0
+        self.active_status = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.input_executor = ThreadPoolExecutor(max_workers=1)
+        self.input_idle = None
+        self.first_draw = None
+
+    def draw(self, func, *args):
+        """Call into a screen, drawing its output in one go."""
+        with self.lcd.drawing():
+            return func(*args)
+
+    async def run_screen(self, func, *args):
+        """Run a (possibly slow) screen refresh in the refresh thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.draw, func, *args)
+
+    async def run_input(self, func, *args):
+        """Run a screen's response to a button in the input thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.input_executor, self.draw, func, *args)
+
+    async def wait_for_button(self, func, *args):
+        """Handle a button press and wait for the buttons to be released."""
+        self.lcd.set_backlight(0)
+        try:
+            await self.run_input(func, *args)
+        except NotImplementedError:
+            backlight_off = True
+            self.lcd.set_backlight(0)
         else:
-            # Update the LCD display based on current dog status
-            active_status.update_lcd()
+            backlight_off = False
+        # Wait for user to release buttons
+        while any(self.lcd.is_pressed(btn) for btn in BUTTONS):
+            await asyncio.sleep(TICK)
+        if backlight_off:
+            self.lcd.set_backlight(1)
+
+    async def change_status(self, step):
+        """Switch screens, loading the new one in the worker thread if
+        this is the first time it's shown."""
+        new_idx = (self.active_idx + step) % len(self.statuses)
+        new_status = await self.run_input(self.statuses.__getitem__, new_idx)
+        # Screens that fail to load are dropped, so the count may change
+        self.active_idx = new_idx % len(self.statuses)
+        self.active_status = new_status
+        return new_status
+
+    async def handle_button(self, button):
+        """Have the active screen respond to *button*."""
+        active_status = self.active_status
+        if button == LCD.LEFT:
+            await self.wait_for_button(active_status.pressed_left)
+        elif button == LCD.RIGHT:
+            await self.wait_for_button(active_status.pressed_right)
+        elif button == LCD.SELECT:
+            await self.wait_for_button(active_status.pressed_select)
+        # Change active status on "up" or "down" buttons
+        elif button == LCD.UP:
+            new_status = await self.change_status(+1)
+            await self.wait_for_button(new_status.update_lcd, True)
+        elif button == LCD.DOWN:
+            new_status = await self.change_status(-1)
+            await self.wait_for_button(new_status.update_lcd, True)
+
+    async def button_loop(self):
+        """Start looping and wait for user input."""
+        while True:
+            button = next((btn for btn in BUTTONS if self.lcd.is_pressed(btn)), None)
+            if button is None:
+                await asyncio.sleep(TICK)
+                continue
+            # Hold off refreshes until the press has been handled
+            self.input_idle.clear()
+            try:
+                await self.handle_button(button)
+            finally:
+                self.input_idle.set()
+
+    async def refresh_loop(self):
+        """Update the LCD display based on the active screen."""
+        force = False
+        while True:
+            # Skip refreshing while a button is being handled
+            await self.input_idle.wait()
+            status = self.active_status
+            await self.run_screen(status.update_lcd, force)
+            if self.first_draw is None:
+                self.first_draw = time.perf_counter() - START_TIME
+                log.info("Startup to first draw: %.3f s", self.first_draw)
+            if status is not self.active_status:
+                # The screen changed part way through, so cover up the
+                # old one straight away
+                force = True
+                continue
+            force = False
+            await asyncio.sleep(REFRESH)
+
+    async def run(self):
+        self.input_idle = asyncio.Event()
+        self.input_idle.set()
+        await self.change_status(0)
+        await asyncio.gather(self.button_loop(), self.refresh_loop())
 
 
 def main(lcd):
-    ## Prepare the list of statuses that will respond to commands
-    # Sheffield the dog
-    statuses = []
-    sheffield = Dog(lcd=lcd)
-    # For showing the current IP address
-    statuses.append(sheffield)
-    ipstatus = IPStatus(lcd=lcd)
-    statuses.append(ipstatus)
-    smokestatus = SmokeStatus(lcd=lcd)
-    statuses.append(smokestatus)
+    ## Prepare the screens that will respond to commands
+    lcd = LockedLCD(lcd)
+    statuses = ScreenRegistry.from_config(lcd)
 
     # Begin a loop that responds to button presses and updates LCD
-    button_loop(lcd, statuses)                    
+    app = LCDApp(lcd, statuses)
+    asyncio.run(app.run())
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     # Prepare the LCD display
     lcd = LCD.Adafruit_CharLCDPlate()
     try:
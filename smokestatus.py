@@ -1,8 +1,8 @@
+import os
 from datetime import datetime as dt, timedelta
 
-import pandas as pd
-
 from basestatus import BaseStatus, WHITE, RED, GREEN, BLUE, CYAN, MAGENTA, YELLOW
+from humblepi.rates import RateWindow
 
 class SmokeStatus(BaseStatus):
     target = 0.333
@@ -10,6 +10,7 @@ class SmokeStatus(BaseStatus):
     last_msg = None
     bad_color = YELLOW
     good_color = WHITE
+    rates = None
 
     def update_lcd(self, force=False):
         curr_avg = self.running_average()
@@ -25,14 +26,20 @@ class SmokeStatus(BaseStatus):
             self.last_msg = msg
 
     def running_average(self):
-        days = 7
-        df = pd.read_csv(self.logfile, names=('Datetime',))
-        dates = pd.to_datetime(df.Datetime)
-        last_three = dates.iloc[-3]
-        delta = dt.now() - last_three
-        days = delta.days + delta.seconds / 24. / 3600.
-        running_average = 3. / days 
-        return running_average
+        """Smokes per day, based on the last three."""
+        if self.rates is None:
+            self.load_rates()
+        return self.rates.rate(dt.now().timestamp())
+
+    def load_rates(self):
+        """Read the log once to seed the rolling rate."""
+        self.rates = RateWindow(count=3)
+        if os.path.exists(self.logfile):
+            with open(self.logfile) as f:
+                for line in f:
+                    if line.strip():
+                        when = dt.strptime(line.strip(), self.datetime_fmt)
+                        self.rates.add(when.timestamp())
 
     def pressed_left(self):
         self.register_smoke()
@@ -48,6 +55,8 @@ class SmokeStatus(BaseStatus):
         # Logging
         with open(self.logfile, 'a') as f:
             line = '{timestamp}\n'
-            line = line.format(timestamp=dt.now().strftime(self.datetime_fmt))
+            line = line.format(timestamp=self.last_outside.strftime(self.datetime_fmt))
             f.write(line)
+        if self.rates is not None:
+            self.rates.add(self.last_outside.timestamp())
         self.update_lcd(force=True)
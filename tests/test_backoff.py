@@ -0,0 +1,83 @@
+import random
+import unittest
+from unittest import mock
+
+from humblepi.backoff import ReconnectPolicy
+from humblepi.clock import VirtualClock
+from humblepi.engine import StatusEngine
+from humblepi.reconnect_storm import simulate, naive_policy
+
+
+class ReconnectPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.policy = ReconnectPolicy(base=1, cap=8, failure_threshold=5, cooldown=100,
+                                      timeout=10, clock=self.clock, rng=random.Random(0))
+
+    def test_backoff(self):
+        policy = self.policy
+        self.assertTrue(policy.allow())
+        limits = []
+        for i in range(4):
+            policy.record_failure()
+            limits.append(policy.max_delay())
+            self.assertLessEqual(policy.delay(), policy.max_delay())
+        self.assertEqual(limits, [1, 2, 4, 8])
+        self.clock.advance(8)
+        self.assertTrue(policy.allow())
+        policy.record_success()
+        self.assertEqual(policy.failures, 0)
+        self.assertTrue(policy.allow())
+
+    def test_circuit_breaker(self):
+        policy = self.policy
+        for i in range(5):
+            policy.record_failure()
+        self.assertEqual(policy.state, policy.states.OPEN)
+        self.clock.advance(99)
+        self.assertFalse(policy.allow())
+        self.clock.advance(1)
+        self.assertTrue(policy.allow())
+        self.assertEqual(policy.state, policy.states.HALF_OPEN)
+        # A failed trial opens the breaker again straight away
+        policy.record_attempt()
+        policy.record_failure()
+        self.assertEqual(policy.state, policy.states.OPEN)
+        self.assertEqual(policy.delay(), 100)
+
+    def test_timeout(self):
+        policy = self.policy
+        policy.record_attempt()
+        self.assertFalse(policy.allow())
+        self.clock.advance(10)
+        policy.allow()
+        self.assertEqual(policy.failures, 1)
+
+    def test_engine_reconnect(self):
+        engine = StatusEngine()
+        engine.set_clock(self.clock)
+        engine.update_mqtt_status = mock.MagicMock()
+        client = mock.MagicMock()
+        client.reconnect.side_effect = ConnectionRefusedError
+        engine.mqtt_client = client
+        engine.maintain_mqtt()
+        self.assertEqual(client.reconnect.call_count, 1)
+        # Waits before trying again
+        engine.reconnect_policy.next_attempt = self.clock.monotonic() + 1
+        engine.maintain_mqtt()
+        self.assertEqual(client.reconnect.call_count, 1)
+        self.clock.advance(1)
+        engine.maintain_mqtt()
+        self.assertEqual(client.reconnect.call_count, 2)
+
+
+class ReconnectStormTest(unittest.TestCase):
+    def test_storm(self):
+        with self.assertLogs('humblepi', level='WARNING'):
+            backoff = simulate(displays=200, downtime=30, capacity=50)
+            naive = simulate(displays=200, downtime=30, capacity=50,
+                             policy_factory=naive_policy)
+        # Everyone comes back, without hammering the broker
+        self.assertLess(backoff.recovery, 300)
+        self.assertLess(backoff.attempts * 10, naive.attempts)
+        self.assertLess(backoff.peak_rate * 5, naive.peak_rate)
@@ -3,6 +3,9 @@ import os
 import datetime as dt
 import pytz
 import time
+import json
+import tempfile
+import threading
 
 import unittest
 from unittest import mock
@@ -66,14 +69,72 @@ class DogStatusTest(unittest.TestCase):
         self.assertTrue(status_emitted)
         self.assertEqual(len(time_spy), 1)
     
+    def test_snapshot(self):
+        status = DogStatus()
+        status.peeing.reset_time(force=True)
+        status.pooping.reset_time(force=True)
+        snapshots = []
+        status.snapshot_changed.connect(snapshots.append)
+        status.check_status_change()
+        status.check_status_change()
+        # Only one snapshot for two unchanged ticks
+        self.assertEqual(len(snapshots), 1)
+        snapshot = snapshots[0]
+        self.assertEqual(snapshot.peeing_status, DogAction.states.NORMAL)
+        self.assertEqual(snapshot.pooping_time, '0:00')
+    
+    def test_config_reload_thread(self):
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+        status = DogStatus()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            status.config_file = os.path.join(tmpdir, 'humblepirc')
+            status.reload_config()
+            with open(status.config_file, mode='w') as fp:
+                fp.write('[dog]\ntimezone = UTC\n')
+            # A tick on the worker thread only notices the change...
+            worker = threading.Thread(target=status.tick_once)
+            worker.start()
+            worker.join()
+            self.assertEqual(status.timezone, chicago)
+            # ...which is applied on the thread that owns the logs
+            app.processEvents()
+            self.assertEqual(status.timezone, pytz.utc)
+            self.assertEqual(status.peeing.timezone, pytz.utc)
+    
     def test_update_mqtt(self):
         status = DogStatus()
         status.peeing.reset_time()
         status.pooping.reset_time()
         client = mock.MagicMock()
-        status.update_mqtt(client=client)
+        client.publish.return_value.rc = 0
+        with mock.patch('humblepi.engine.subprocess.call', return_value=0):
+            status.update_mqtt(client=client)
         client.reconnect.assert_called_with()
-        client.publish.assert_called_with(topic='dogstatus/sheffield/outside', payload='NORMAL')
+        # Nothing is published until the broker accepts the connection
+        client.publish.assert_not_called()
+        status.on_mqtt_connect(client, None, {}, 0)
+        client.publish.assert_any_call(topic='dogstatus/sheffield/outside', payload='NORMAL',
+                                       qos=1, retain=True)
+        # Check the structured state message
+        kwargs = client.publish.call_args_list[2][1]
+        self.assertEqual(kwargs['topic'], 'dogstatus/sheffield/state')
+        state = json.loads(kwargs['payload'])
+        self.assertEqual(state['status'], 'NORMAL')
+        self.assertEqual(state['pooping']['status'], 'NORMAL')
+        self.assertEqual(state['peeing']['elapsed_seconds'], 0)
+        # No reconnect needed while connected
+        client.reset_mock()
+        status.mqtt_connected = True
+        status.update_mqtt(client=client)
+        client.reconnect.assert_not_called()
+    
+    def test_mqtt_birth(self):
+        status = DogStatus()
+        client = mock.MagicMock()
+        status.on_mqtt_connect(client, None, {}, 0)
+        self.assertTrue(status.mqtt_connected)
+        client.publish.assert_any_call('dogstatus/sheffield/availability', payload='online',
+                                       qos=1, retain=True)
     
     def test_load_datetimes(self):
         # Prepare a test file
@@ -0,0 +1,175 @@
+import os
+import sys
+import asyncio
+import subprocess
+import datetime as dt
+import tempfile
+import unittest
+from unittest import mock
+
+import pytz
+
+from humblepi.engine import ActionTracker, StatusEngine, Signal, load_config
+from humblepi.eventlog import Action, DogEvent
+from humblepi.clock import VirtualClock
+
+
+chicago = pytz.timezone('America/Chicago')
+
+
+class SignalTest(unittest.TestCase):
+    def test_connect_emit(self):
+        class Emitter():
+            changed = Signal(int)
+        emitter = Emitter()
+        other = Emitter()
+        received = []
+        emitter.changed.connect(received.append)
+        emitter.changed.emit(3)
+        other.changed.emit(4)
+        self.assertEqual(received, [3])
+        emitter.changed.disconnect(received.append)
+        emitter.changed.emit(5)
+        self.assertEqual(received, [3])
+
+
+class ActionTrackerTest(unittest.TestCase):
+    def test_status_changed(self):
+        action = ActionTracker(seconds_warning=100, seconds_overdue=200)
+        received = []
+        action.status_changed.connect(received.append)
+        now = dt.datetime.now(chicago)
+        action.reset_time(now - dt.timedelta(seconds=105), force=True)
+        action.check_status_change()
+        self.assertEqual(received, [action.states.WARNING])
+
+
+class StatusEngineTest(unittest.TestCase):
+    def test_no_qt(self):
+        """Importing the engine should not pull in PyQt5."""
+        code = 'import sys, humblepi.engine; print("PyQt5" in sys.modules)'
+        out = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(out.strip(), b'False')
+
+    def test_run_async(self):
+        engine = StatusEngine()
+        snapshots = []
+        engine.snapshot_changed.connect(snapshots.append)
+        async def run_briefly():
+            try:
+                await asyncio.wait_for(engine.run_async(), timeout=0.1)
+            except asyncio.TimeoutError:
+                pass
+        asyncio.run(run_briefly())
+        self.assertEqual(len(snapshots), 1)
+
+    def test_simulated_week(self):
+        """Run a week of ticks on a virtual clock."""
+        clock = VirtualClock(start=chicago.localize(dt.datetime(2019, 8, 4, 8, 0)))
+        engine = StatusEngine()
+        engine.set_clock(clock)
+        engine.peeing.reset_time(force=True)
+        engine.pooping.reset_time(force=True)
+        changes = []
+        engine.pooping.status_changed.connect(changes.append)
+        # Take him out for a pee every 7 hours, but he never poops
+        for minute in range(7 * 24 * 60):
+            if minute % (7 * 60) == 0:
+                engine.peeing.reset_time()
+            engine.check_status_change()
+            clock.advance(60)
+        self.assertEqual(engine.pooping.seconds(), 7 * 24 * 3600)
+        self.assertEqual(engine.pooping.time_string(), '168:00')
+        states = ActionTracker.states
+        self.assertEqual(changes[-2:], [states.WARNING, states.OVERDUE])
+        self.assertEqual(engine.peeing.status(), states.WARNING)
+
+    def test_commit_events(self):
+        clock = VirtualClock(start=chicago.localize(dt.datetime(2019, 8, 4, 8, 0)))
+        engine = StatusEngine()
+        engine.set_clock(clock)
+        engine.mqtt_client = mock.MagicMock()
+        engine.mqtt_connected = True
+        engine.queue_mqtt_messages = mock.MagicMock()
+        engine.update_mqtt_status = mock.MagicMock()
+        snapshots = []
+        engine.snapshot_changed.connect(snapshots.append)
+        tmpdir = tempfile.TemporaryDirectory()
+        try:
+            engine.logfile = os.path.join(tmpdir.name, 'log.tsv')
+            # Both actions are overdue
+            engine.peeing.reset_time(clock.now(chicago) - dt.timedelta(days=2), force=True)
+            engine.pooping.reset_time(clock.now(chicago) - dt.timedelta(days=2), force=True)
+            engine.check_status_change()
+            del snapshots[:]
+            engine.peeing.status_changed.connect(engine.update_mqtt)
+            engine.pooping.status_changed.connect(engine.update_mqtt)
+            when = clock.now(chicago) - dt.timedelta(minutes=5)
+            engine.commit_events([DogEvent.from_datetime(when, Action.PEE),
+                                  DogEvent.from_datetime(when, Action.POOP)])
+            # Both statuses changed, but are published together
+            states = ActionTracker.states
+            self.assertEqual(engine.snapshot().peeing_status, states.NORMAL)
+            self.assertEqual(engine.snapshot().pooping_status, states.NORMAL)
+            self.assertEqual(len(snapshots), 1)
+            self.assertEqual(engine.queue_mqtt_messages.call_count, 1)
+            self.assertEqual(len(engine.events), 2)
+            with open(engine.logfile) as fp:
+                self.assertEqual(len(fp.readlines()), 2)
+            # Nothing to do for an empty batch
+            engine.commit_events([])
+            self.assertEqual(engine.queue_mqtt_messages.call_count, 1)
+        finally:
+            tmpdir.cleanup()
+
+    def test_separate_actions(self):
+        """Each engine has its own actions, clock and timezone."""
+        clock = VirtualClock(start=chicago.localize(dt.datetime(2019, 8, 4, 8, 0)))
+        simulated = StatusEngine()
+        simulated.set_clock(clock)
+        simulated.timezone = pytz.utc
+        simulated.peeing.seconds_warning = 60
+        other = StatusEngine()
+        self.assertIsNot(simulated.peeing, other.peeing)
+        self.assertIs(simulated.peeing.clock, clock)
+        self.assertIsNot(other.peeing.clock, clock)
+        self.assertIs(simulated.peeing.timezone, pytz.utc)
+        self.assertEqual(other.peeing.seconds_warning, 6 * 3600)
+        self.assertEqual(StatusEngine().pooping.clock, other.clock)
+
+
+class ConfigTest(unittest.TestCase):
+    config_file = 'test-humblepirc'
+
+    def tearDown(self):
+        if os.path.exists(self.config_file):
+            os.remove(self.config_file)
+
+    def write_config(self, text, mtime):
+        with open(self.config_file, mode='w') as fp:
+            fp.write(text)
+        os.utime(self.config_file, (mtime, mtime))
+
+    def test_defaults(self):
+        config = load_config(self.config_file)
+        self.assertEqual(config['dog']['name'], 'sheffield')
+        self.assertEqual(config['pooping'].getfloat('overdue_hours'), 24)
+        # Parsed configs are cached
+        self.assertIs(load_config(self.config_file), config)
+
+    def test_hot_reload(self):
+        engine = StatusEngine()
+        engine.config_file = self.config_file
+        self.write_config('[peeing]\nwarning_hours = 2\n[dog]\ntick = 0.5\n', mtime=1000)
+        engine.reload_config()
+        self.assertEqual(engine.peeing.seconds_warning, 7200)
+        self.assertEqual(engine.peeing.seconds_overdue, 8 * 3600)
+        self.assertEqual(engine.tick, 0.5)
+        # Unchanged file is not re-applied
+        self.assertFalse(engine.check_config())
+        # Changes are picked up without a restart
+        self.write_config('[peeing]\nwarning_hours = 3\n[dog]\ntimezone = UTC\n', mtime=2000)
+        self.assertTrue(engine.check_config())
+        self.assertEqual(engine.peeing.seconds_warning, 3 * 3600)
+        self.assertEqual(engine.tick, 1)
+        self.assertEqual(engine.pooping.timezone, pytz.utc)
@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from PyQt5 import QtWidgets
+
+from humblepi.dogstatus import DogStatusProcess
+from humblepi.engine import StatusSnapshot
+from humblepi.engine_process import SharedState, engine_names
+
+
+class SharedStateTest(unittest.TestCase):
+    def setUp(self):
+        self.state = SharedState(create=True)
+
+    def tearDown(self):
+        self.state.close()
+        self.state.unlink()
+
+    def test_round_trip(self):
+        self.assertIsNone(self.state.read())
+        snapshot = StatusSnapshot(peeing_status=2, peeing_time='6:12',
+                                  pooping_status=None, pooping_time='--:--')
+        self.state.write(snapshot, mqtt_connected=True, event_count=3)
+        reader = SharedState(self.state.name)
+        try:
+            state = reader.read()
+        finally:
+            reader.close()
+        self.assertEqual(state.sequence, 2)
+        self.assertEqual(state.snapshot, snapshot)
+        self.assertIs(state.mqtt_connected, True)
+        self.assertIsNone(state.wifi_connected)
+        self.assertEqual(state.event_count, 3)
+
+    def test_write_in_progress(self):
+        snapshot = StatusSnapshot(1, '0:00', 1, '0:00')
+        self.state.write(snapshot)
+        # Pretend the writer stopped half way through
+        self.state.seq_layout.pack_into(self.state.shm.buf, 0, 3)
+        self.assertIsNone(self.state.read(retries=5))
+
+    def test_restart_after_crash_mid_write(self):
+        snapshot = StatusSnapshot(1, '0:00', 1, '0:00')
+        self.state.write(snapshot)
+        # The engine died part way through its next write
+        self.state.seq_layout.pack_into(self.state.shm.buf, 0, 3)
+        # A restarted engine attaches and carries on
+        writer = SharedState(self.state.name)
+        try:
+            writer.write(snapshot, event_count=1)
+        finally:
+            writer.close()
+        state = self.state.read(retries=5)
+        self.assertIsNotNone(state)
+        self.assertEqual(state.sequence % 2, 0)
+        self.assertEqual(state.event_count, 1)
+
+
+class DogStatusProcessTest(unittest.TestCase):
+    def setUp(self):
+        self.app = QtWidgets.QApplication(sys.argv)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.logfile = os.path.join(self.tmpdir.name, 'log.tsv')
+        self.config_file = os.path.join(self.tmpdir.name, 'humblepirc')
+        with open(self.config_file, mode='w') as fp:
+            fp.write('[dog]\nlogfile = {}\ntick = 0.05\n'.format(self.logfile))
+        self.status = DogStatusProcess(config_file=self.config_file, connect_mqtt=False)
+        self.status.reload_config()
+
+    def tearDown(self):
+        self.status.stop()
+        self.tmpdir.cleanup()
+
+    def wait_for(self, condition, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "Timed out waiting for engine")
+            self.status.poll()
+            time.sleep(0.02)
+
+    def test_pending_commits_merged(self):
+        # While the engine is down, presses wait as a single commit
+        self.status.log_pee()
+        self.status.log_poop()
+        self.assertEqual(len(self.status.pending), 1)
+        name, events = self.status.pending[0]
+        self.assertEqual(name, 'commit')
+        self.assertEqual(len(events), 2)
+
+    def test_committed_events_indexed(self):
+        status = self.status
+        self.assertEqual(len(status.events), 0)
+        status.log_pee()
+        # Added straight away, without reading the log
+        with mock.patch.object(status, 'load_datetimes') as load:
+            self.assertEqual(len(status.events), 1)
+        load.assert_not_called()
+
+    def test_engine_process(self):
+        status = self.status
+        snapshots = []
+        status.snapshot_changed.connect(snapshots.append)
+        status.start_engine()
+        self.wait_for(lambda: snapshots)
+        # Button presses are logged by the engine
+        status.log_pee()
+        self.wait_for(lambda: status._engine_state.event_count == 1)
+        self.assertEqual(len(status.events), 1)
+        with open(self.logfile) as fp:
+            self.assertTrue(fp.read().endswith('\tFalse\n'))
+        # A dead engine is started again, and catches up on commands
+        status.process.kill()
+        status.process.wait()
+        status.log_poop()
+        self.wait_for(lambda: status.restarts == 1)
+        self.wait_for(lambda: status._engine_state.event_count == 2)
+        self.assertEqual(len(status.events), 2)
+
+    def test_gui_crash(self):
+        """The engine outlives a GUI that crashes, and the next GUI
+        attaches to it."""
+        gui = subprocess.Popen([sys.executable, '-c', GUI_SCRIPT, self.config_file],
+                               stdout=subprocess.PIPE, text=True)
+        try:
+            pid = int(gui.stdout.readline())
+        finally:
+            gui.kill()
+            gui.wait()
+            gui.stdout.close()
+        self.addCleanup(kill_quietly, pid)
+        # The engine doesn't go down with the GUI
+        time.sleep(0.5)
+        os.kill(pid, 0)
+        status = self.status
+        status.start_engine()
+        self.assertIsNone(status.process)
+        self.wait_for(lambda: status._engine_state is not None)
+        status.log_pee()
+        self.wait_for(lambda: status._engine_state.event_count == 1)
+        self.assertEqual(status.restarts, 0)
+        # Quitting the GUI normally stops the engine
+        status.stop()
+        state_name, address = engine_names(self.logfile)
+        deadline = time.monotonic() + 10
+        while os.path.exists(address):
+            self.assertLess(time.monotonic(), deadline, "Engine didn't stop")
+            time.sleep(0.05)
+
+
+# Starts the engine, prints its process ID once attached, then waits to
+# be killed
+GUI_SCRIPT = """
+import sys, time
+from humblepi.dogstatus import DogStatusProcess
+status = DogStatusProcess(config_file=sys.argv[1], connect_mqtt=False)
+status.reload_config()
+status.start_engine()
+while status.conn is None:
+    status.poll()
+    time.sleep(0.02)
+print(status.process.pid, flush=True)
+time.sleep(60)
+"""
+
+
+def kill_quietly(pid):
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
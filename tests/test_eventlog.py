@@ -0,0 +1,225 @@
+import os
+import datetime as dt
+import tempfile
+import unittest
+from unittest import mock
+
+import pytz
+
+from humblepi.eventlog import (iter_events, Action, DogEvent, EventHistory,
+                              EventIndex, compact_log, format_record, parse_line,
+                              recover_log, quarantine_path, BadRecord,
+                              TimestampParser, parse_timestamp, to_epoch)
+
+
+chicago = pytz.timezone('America/Chicago')
+
+
+class IterEventsTest(unittest.TestCase):
+    test_file = 'test-events.tsv'
+
+    def setUp(self):
+        self.t0 = chicago.localize(dt.datetime(2019, 8, 4, 19, 55, 46))
+        self.t1 = chicago.localize(dt.datetime(2019, 8, 5, 2, 59, 42))
+        with open(self.test_file, mode='w') as fp:
+            fp.writelines([
+                '# A comment line\n',
+                '2019-08-04 19:55:46\tTrue\n',
+                '\n',
+                f'{self.t1.isoformat()}\tFalse\n',
+            ])
+
+    def tearDown(self):
+        os.remove(self.test_file)
+
+    def test_iter_events(self):
+        events = list(iter_events(self.test_file, timezone=chicago))
+        self.assertEqual(events, [
+            DogEvent.from_datetime(self.t0, Action.POOP),
+            DogEvent.from_datetime(self.t1, Action.PEE),
+        ])
+
+    def test_time_range(self):
+        # Only events at or after ``since``
+        events = list(iter_events(self.test_file, timezone=chicago, since=self.t1))
+        self.assertEqual(events, [DogEvent.from_datetime(self.t1, Action.PEE)])
+        # Only events before ``until``
+        events = list(iter_events(self.test_file, timezone=chicago, until=self.t1))
+        self.assertEqual(events, [DogEvent.from_datetime(self.t0, Action.POOP)])
+
+    def test_action_filter(self):
+        events = list(iter_events(self.test_file, timezone=chicago,
+                                  actions=[Action.POOP]))
+        self.assertEqual(events, [DogEvent.from_datetime(self.t0, Action.POOP)])
+
+    def test_missing_file(self):
+        events = list(iter_events('not-a-real-file.tsv'))
+        self.assertEqual(events, [])
+
+
+class EventHistoryTest(unittest.TestCase):
+    def test_columns(self):
+        t0 = chicago.localize(dt.datetime(2019, 8, 4, 19, 55, 46))
+        history = EventHistory([DogEvent.from_datetime(t0, Action.POOP),
+                                DogEvent(epoch=1565000000, action=Action.PEE)])
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history.nbytes, 18)
+        self.assertEqual(history[1], DogEvent(1565000000, Action.PEE))
+        # Datetimes are only built when asked for
+        self.assertEqual(history[0].to_datetime(chicago), t0)
+        self.assertEqual(history[0].to_datetime(chicago).tzinfo.zone, 'America/Chicago')
+
+
+class EventIndexTest(unittest.TestCase):
+    def test_backfill(self):
+        index = EventIndex([DogEvent(300, Action.PEE), DogEvent(100, Action.POOP)])
+        # Insert an event in the past
+        index.insert(DogEvent(200, Action.PEE))
+        index.insert(DogEvent(400, Action.POOP))
+        self.assertEqual(list(index.epochs), [100, 200, 300, 400])
+        self.assertEqual(index.range(since=150, until=400),
+                         [DogEvent(200, Action.PEE), DogEvent(300, Action.PEE)])
+        self.assertEqual(index.latest_before(Action.PEE), DogEvent(300, Action.PEE))
+        self.assertEqual(index.latest_before(Action.PEE, 299), DogEvent(200, Action.PEE))
+        self.assertEqual(index.latest_before(Action.POOP, 399), DogEvent(100, Action.POOP))
+        self.assertIsNone(index.latest_before(Action.POOP, 99))
+
+    def test_compact_log(self):
+        test_file = 'test-compact.tsv'
+        with open(test_file, mode='w') as fp:
+            fp.writelines([
+                '2019-08-05 02:59:42\tFalse\n',
+                '# A comment\n',
+                '2019-08-04 19:55:46\tTrue\n',
+            ])
+        try:
+            compact_log(test_file, timezone=chicago)
+            with open(test_file) as fp:
+                lines = fp.readlines()
+        finally:
+            os.remove(test_file)
+        self.assertEqual(lines, [
+            '# A comment\n',
+            '2019-08-04 19:55:46\tTrue\n',
+            '2019-08-05 02:59:42\tFalse\n',
+        ])
+
+    def test_compact_log_synced(self):
+        """The new log is on disk before it replaces the old one."""
+        tmpdir = tempfile.TemporaryDirectory()
+        test_file = os.path.join(tmpdir.name, 'log.tsv')
+        with open(test_file, mode='w') as fp:
+            fp.write('2019-08-04 19:55:46\tTrue\n')
+        calls = []
+        def fsync(fd):
+            calls.append(('fsync', os.fstat(fd).st_ino))
+        def replace(src, dst):
+            calls.append(('replace', src))
+            os.rename(src, dst)
+        try:
+            with mock.patch('humblepi.eventlog.os.fsync', side_effect=fsync), \
+                 mock.patch('humblepi.eventlog.os.replace', side_effect=replace):
+                compact_log(test_file, timezone=chicago)
+            # The synced temporary file is now the log
+            expected = [('fsync', os.stat(test_file).st_ino),
+                        ('replace', test_file + '.tmp'),
+                        ('fsync', os.stat(tmpdir.name).st_ino)]
+        finally:
+            tmpdir.cleanup()
+        self.assertEqual(calls, expected)
+
+class TimestampParserTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = TimestampParser(chicago)
+
+    def assertParses(self, text):
+        self.assertEqual(self.parser.epoch(text.encode()),
+                         to_epoch(parse_timestamp(text, timezone=chicago)), text)
+
+    def test_formats(self):
+        when = chicago.localize(dt.datetime(2019, 8, 4, 19, 55, 46, 123456))
+        for stamp in [when, when.replace(microsecond=0), when.astimezone(pytz.utc)]:
+            self.assertParses(stamp.isoformat())
+            self.assertParses(stamp.replace(tzinfo=None).isoformat(sep=' '))
+        self.assertParses('2019-08-04T19:55:46+05:30')
+        self.assertParses('2019-08-04T19:55:46Z')
+
+    def test_dst_days(self):
+        # Naive times on the days the clocks change, including the
+        # repeated hour
+        for text in ['2019-03-10 01:59:59', '2019-03-10 03:00:00',
+                     '2019-11-03 01:30:00', '2019-11-03 02:30:00',
+                     '2019-11-03T01:30:00-06:00', '2019-11-04 01:30:00']:
+            self.assertParses(text)
+
+    def test_invalid(self):
+        for text in [b'', b'garbage', b'2019-13-01 00:00:00', b'2019-08-04 25:00:00',
+                     b'2019-08-04T19:55:4', b'2019-08-04T19:55:46+05:3x',
+                     b'2019-08-04 19:55:46.12345x']:
+            with self.assertRaises(ValueError):
+                self.parser.epoch(text)
+
+
+class CrashSafetyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.tmpdir.name, 'log.tsv')
+        self.t0 = chicago.localize(dt.datetime(2019, 8, 4, 19, 55, 46))
+        self.good = format_record(self.t0, Action.POOP, checksum=True)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_checksum(self):
+        self.assertEqual(self.good.count('\t'), 2)
+        self.assertEqual(parse_line(self.good, timezone=chicago),
+                         DogEvent.from_datetime(self.t0, Action.POOP))
+        # A flipped bit is caught
+        with self.assertRaises(BadRecord):
+            parse_line(self.good.replace('True', 'Fals'), timezone=chicago)
+        with self.assertRaises(BadRecord):
+            parse_line(self.good.replace('19:55', '19:56'), timezone=chicago)
+
+    def test_skip_bad_lines(self):
+        with open(self.log_file, mode='w') as fp:
+            fp.writelines([self.good, '2019-08-04T1\n', 'garbage\n',
+                           '2019-08-05 02:59:42\tFalse\n'])
+        with self.assertLogs('humblepi.eventlog', level='WARNING'):
+            events = list(iter_events(self.log_file, timezone=chicago))
+        self.assertEqual(len(events), 2)
+
+    def test_recover_log(self):
+        later = format_record(self.t0 + dt.timedelta(hours=1), Action.PEE)
+        with open(self.log_file, mode='wb') as fp:
+            fp.write(self.good.encode() * 500)
+            fp.write(b'\0\0\0\0\n') # Zeroed block after a power cut
+            fp.write(later.encode())
+            fp.write(self.good[:20].encode()) # Torn final record
+        with self.assertLogs('humblepi.eventlog', level='WARNING'):
+            count = recover_log(self.log_file, timezone=chicago, tail_size=1024)
+        self.assertEqual(count, 2)
+        with open(self.log_file) as fp:
+            lines = fp.readlines()
+        self.assertEqual(len(lines), 501)
+        self.assertEqual(lines[-1], later)
+        with open(quarantine_path(self.log_file), mode='rb') as fp:
+            self.assertEqual(fp.read(), b'\0\0\0\0\n' + self.good[:20].encode() + b'\n')
+        # Nothing to do the second time around
+        self.assertEqual(recover_log(self.log_file, timezone=chicago), 0)
+
+    def test_recover_missing_newline(self):
+        later = format_record(self.t0 + dt.timedelta(hours=1), Action.PEE)
+        with open(self.log_file, mode='w') as fp:
+            fp.write(self.good + later.rstrip('\n')) # Edited by hand
+        self.assertEqual(recover_log(self.log_file, timezone=chicago), 0)
+        with open(self.log_file) as fp:
+            self.assertEqual(fp.read(), self.good + later)
+        self.assertFalse(os.path.exists(quarantine_path(self.log_file)))
+        # When every record has a checksum, one without was cut short
+        with open(self.log_file, mode='w') as fp:
+            fp.write(self.good + self.good.rsplit('\t', 1)[0])
+        with self.assertLogs('humblepi.eventlog', level='WARNING'):
+            count = recover_log(self.log_file, timezone=chicago, checksums=True)
+        self.assertEqual(count, 1)
+        with open(self.log_file) as fp:
+            self.assertEqual(fp.read(), self.good)
@@ -0,0 +1,81 @@
+import io
+import os
+import csv
+import json
+import datetime as dt
+import tempfile
+import unittest
+
+import pytz
+
+from humblepi.eventlog import Action, DogEvent, iter_events, write_synthetic_log
+from humblepi.export import export_csv, export_jsonl, export_npz, main
+from humblepi.storage import migrate
+
+
+chicago = pytz.timezone('America/Chicago')
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.logfile = os.path.join(self.tmpdir.name, 'log.tsv')
+        start = chicago.localize(dt.datetime(2019, 8, 1, 6, 0))
+        write_synthetic_log(self.logfile, 6, start=start, timezone=chicago)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_csv(self):
+        fp = io.StringIO()
+        count = export_csv(iter_events(self.logfile, timezone=chicago), fp,
+                           timezone=pytz.utc)
+        self.assertEqual(count, 6)
+        rows = list(csv.reader(io.StringIO(fp.getvalue())))
+        self.assertEqual(rows[0], ['timestamp', 'epoch', 'action'])
+        self.assertEqual(rows[1], ['2019-08-01T11:00:00+00:00', '1564657200', 'POOP'])
+        self.assertEqual(rows[2][2], 'PEE')
+
+    def test_jsonl(self):
+        fp = io.StringIO()
+        events = iter_events(self.logfile, timezone=chicago, actions=[Action.POOP])
+        count = export_jsonl(events, fp, timezone=chicago)
+        self.assertEqual(count, 2)
+        records = [json.loads(line) for line in fp.getvalue().splitlines()]
+        self.assertEqual(records[1], {'timestamp': '2019-08-01T18:00:00-05:00',
+                                      'epoch': 1564700400,
+                                      'action': 'POOP'})
+
+    def test_npz(self):
+        fpath = os.path.join(self.tmpdir.name, 'log.npz')
+        events = [DogEvent(1564657200, Action.POOP), DogEvent(1564671600, Action.PEE)]
+        try:
+            import numpy as np
+        except ImportError:
+            with self.assertRaises(ImportError):
+                export_npz(events, fpath)
+            return
+        self.assertEqual(export_npz(events, fpath), 2)
+        with np.load(fpath) as data:
+            self.assertEqual(list(data['epoch']), [1564657200, 1564671600])
+            self.assertEqual(list(data['action']), [Action.POOP, Action.PEE])
+
+    def test_main_filters(self):
+        output = os.path.join(self.tmpdir.name, 'out.jsonl')
+        main([output, '--logfile', self.logfile, '--timezone', 'America/Chicago',
+              '--since', '2019-08-01 14:00', '--until', '2019-08-02 02:00'])
+        with open(output) as fp:
+            records = [json.loads(line) for line in fp]
+        self.assertEqual([r['timestamp'] for r in records],
+                         ['2019-08-01T14:00:00-05:00', '2019-08-01T18:00:00-05:00',
+                          '2019-08-01T22:00:00-05:00'])
+
+    def test_main_sqlite(self):
+        database = os.path.join(self.tmpdir.name, 'log.db')
+        migrate(self.logfile, database, timezone=chicago)
+        output = os.path.join(self.tmpdir.name, 'out.csv')
+        main([output, '--logfile', database, '--action', 'poop'])
+        with open(output) as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][1:], ['1564657200', 'POOP'])
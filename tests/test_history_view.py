@@ -0,0 +1,44 @@
+import sys
+import unittest
+
+import pytz
+from PyQt5 import QtWidgets
+
+from humblepi.eventlog import Action, DogEvent, EventIndex
+from humblepi.history_view import HistoryModel, HistoryDialog
+from humblepi.puppy_status_view import PuppyStatusView
+
+
+chicago = pytz.timezone('America/Chicago')
+
+
+class HistoryModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = QtWidgets.QApplication(sys.argv)
+        self.events = EventIndex(DogEvent(1565000000 + i * 3600, Action.PEE)
+                                 for i in range(100000))
+
+    def test_paging(self):
+        model = HistoryModel(self.events, chicago)
+        # Only the first page is loaded
+        self.assertEqual(model.rowCount(), model.page_size)
+        self.assertTrue(model.canFetchMore())
+        model.fetchMore()
+        self.assertEqual(model.rowCount(), 2 * model.page_size)
+        # Newest events come first
+        self.assertEqual(model.data(model.index(0, 1)), 'Pee')
+        self.assertEqual(model.data(model.index(0, 0)),
+                         model.row(0)[0])
+
+    def test_bounded_cache(self):
+        model = HistoryModel(self.events, chicago)
+        model.cache_size = 10
+        for row in range(model.rowCount()):
+            model.row(row)
+        self.assertEqual(len(model._cache), 10)
+
+    def test_history_dialog(self):
+        view = PuppyStatusView()
+        view.show_history()
+        self.assertIsInstance(view.history_dialog, HistoryDialog)
+        self.assertTrue(view.history_dialog.isVisible())
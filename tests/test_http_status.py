@@ -0,0 +1,67 @@
+import json
+import threading
+import unittest
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+
+from humblepi.engine import StatusEngine
+from humblepi.http_status import start_http_server, StatusPublisher
+
+
+class HTTPStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = StatusEngine()
+        self.engine.peeing.reset_time(force=True)
+        self.engine.pooping.reset_time(force=True)
+        self.engine.logfile = 'not-a-real-log.tsv'
+        self.server = start_http_server(self.engine, host='127.0.0.1', port=0)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path, etag=None):
+        request = Request(self.url + path)
+        if etag is not None:
+            request.add_header('If-None-Match', etag)
+        return urlopen(request, timeout=5)
+
+    def test_status(self):
+        response = self.get('/status')
+        status = json.loads(response.read())
+        self.assertEqual(status['dog'], 'sheffield')
+        self.assertEqual(status['peeing']['elapsed_seconds'], 0)
+        # Unchanged status returns 304
+        with self.assertRaises(HTTPError) as cm:
+            self.get('/status', etag=response.headers['ETag'])
+        self.assertEqual(cm.exception.code, 304)
+
+    def test_long_poll(self):
+        etag = self.get('/status').headers['ETag']
+        # Change the status while the request is waiting
+        timer = threading.Timer(0.1, self.engine.check_status_change)
+        timer.start()
+        response = self.get('/status?wait=5', etag=etag)
+        timer.join()
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_restart(self):
+        """An ETag from before a restart doesn't match afterwards."""
+        etag = self.get('/status').headers['ETag']
+        restarted = StatusPublisher(self.engine)
+        self.assertEqual(restarted.version, self.server.RequestHandlerClass.publisher.version)
+        self.assertNotEqual(restarted.etag, etag)
+        self.assertEqual(restarted.wait_for_change(etag, timeout=0),
+                         (restarted.etag, restarted.body))
+
+    def test_history(self):
+        response = self.get('/history')
+        self.assertEqual(json.loads(response.read()), [])
+
+    def test_bad_query(self):
+        for path in ['/status?wait=soon', '/status?wait=nan', '/history?limit=ten']:
+            with self.assertRaises(HTTPError) as cm:
+                self.get(path)
+            self.assertEqual(cm.exception.code, 400)
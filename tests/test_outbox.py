@@ -0,0 +1,105 @@
+import os
+import unittest
+from types import SimpleNamespace
+
+from paho.mqtt import client as mqtt_client
+
+from humblepi.engine import StatusEngine
+from humblepi.outbox import MQTTOutbox
+
+
+class FakeBroker():
+    """A local stand-in for an MQTT broker that can be stopped and
+    restarted."""
+    def __init__(self):
+        self.up = True
+        self.retained = {}
+
+
+class FakeClient():
+    def __init__(self, broker):
+        self.broker = broker
+
+    def reconnect(self):
+        if not self.broker.up:
+            raise ConnectionRefusedError("Broker is down")
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self.broker.up:
+            return SimpleNamespace(rc=mqtt_client.MQTT_ERR_NO_CONN)
+        if retain:
+            self.broker.retained[topic] = payload
+        return SimpleNamespace(rc=mqtt_client.MQTT_ERR_SUCCESS)
+
+
+class QueueingClient(FakeClient):
+    """Queues QoS 1 messages it can't send, as paho does, to replay
+    them on reconnecting."""
+    def __init__(self, broker):
+        super().__init__(broker)
+        self.queued = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        msg = super().publish(topic=topic, payload=payload, qos=qos, retain=retain)
+        if qos > 0 and msg.rc == mqtt_client.MQTT_ERR_NO_CONN:
+            self.queued.append((topic, payload))
+        return msg
+
+
+class MQTTOutboxTest(unittest.TestCase):
+    outbox_file = 'test-outbox.json'
+
+    def tearDown(self):
+        if os.path.exists(self.outbox_file):
+            os.remove(self.outbox_file)
+
+    def test_coalesce(self):
+        outbox = MQTTOutbox(max_topics=2)
+        outbox.put('a', '1')
+        outbox.put('b', '1')
+        outbox.put('a', '2')
+        self.assertEqual(len(outbox), 2)
+        # The least recently updated topic is dropped when full
+        outbox.put('c', '1')
+        self.assertEqual(list(outbox.messages), ['a', 'c'])
+        self.assertEqual(outbox.messages['a'][0], '2')
+
+    def test_broker_outage(self):
+        broker = FakeBroker()
+        client = FakeClient(broker)
+        engine = StatusEngine()
+        engine.outbox_file = self.outbox_file
+        engine.update_mqtt_status = lambda *args, **kwargs: None
+        # Take the broker down and try to publish
+        broker.up = False
+        engine.update_mqtt(client=client)
+        engine.update_mqtt(client=client)
+        self.assertEqual(broker.retained, {})
+        self.assertEqual(len(engine.outbox), 2)
+        # The messages survive a restart
+        self.assertEqual(len(MQTTOutbox(self.outbox_file)), 2)
+        # Bring the broker back and reconnect
+        broker.up = True
+        engine.on_mqtt_connect(client, None, {}, mqtt_client.CONNACK_ACCEPTED)
+        self.assertEqual(len(engine.outbox), 0)
+        self.assertEqual(len(MQTTOutbox(self.outbox_file)), 0)
+        self.assertEqual(broker.retained['dogstatus/sheffield/availability'], 'online')
+        self.assertIn('dogstatus/sheffield/state', broker.retained)
+
+    def test_no_publish_while_disconnected(self):
+        broker = FakeBroker()
+        client = QueueingClient(broker)
+        engine = StatusEngine()
+        engine.update_mqtt_status = lambda *args, **kwargs: None
+        broker.up = False
+        # Status changes during the reconnect backoff stay in the outbox
+        for i in range(5):
+            engine.update_mqtt(client=client)
+        self.assertEqual(len(engine.outbox), 2)
+        self.assertEqual(client.queued, [])
+        # Reconnecting sends only the latest messages
+        broker.up = True
+        engine.on_mqtt_connect(client, None, {}, mqtt_client.CONNACK_ACCEPTED)
+        self.assertEqual(len(engine.outbox), 0)
+        self.assertEqual(client.queued, [])
+        self.assertIn('dogstatus/sheffield/outside', broker.retained)
@@ -5,6 +5,10 @@ import datetime as dt
 from PyQt5 import QtWidgets, QtCore
 
 from humblepi.puppy_status_view import PuppyStatusView
+from humblepi.clock import VirtualClock
+from humblepi.dogstatus import DogAction
+from humblepi.engine import StatusSnapshot
+from humblepi.eventlog import Action
 
 class PuppyStatusViewTestCase(unittest.TestCase):
     def setUp(self):
@@ -24,6 +28,40 @@ class PuppyStatusViewTestCase(unittest.TestCase):
         self.assertIn(view.ui.lblMQTTStatus, status_bar.children())
         self.assertIn(view.ui.lblWifiStatus, status_bar.children())
 
+    def test_apply_snapshot(self):
+        view = PuppyStatusView()
+        states = DogAction.states
+        snapshot = StatusSnapshot(peeing_status=states.NORMAL, peeing_time='1:23',
+                                  pooping_status=states.WARNING, pooping_time='19:02')
+        view.apply_snapshot(snapshot)
+        self.assertEqual(view.ui.btnPee.text(), '1:23')
+        self.assertEqual(view.ui.btnPoop.text(), '19:02')
+        self.assertTrue(view.ui.btnPoop.highlighted)
+        self.assertFalse(view.ui.btnPee.highlighted)
+
+    def test_flash_overdue(self):
+        view = PuppyStatusView()
+        clock = view.clock = VirtualClock()
+        view.update_peeing_status(DogAction.states.OVERDUE)
+        self.assertTrue(view.ui.btnPee.highlighted)
+        # The flashing follows the clock, not how often flash() is called
+        clock.advance(0.3)
+        view.flash()
+        self.assertTrue(view.ui.btnPee.highlighted)
+        clock.advance(0.3)
+        view.flash()
+        self.assertFalse(view.ui.btnPee.highlighted)
+        view.flash()
+        self.assertFalse(view.ui.btnPee.highlighted)
+        clock.advance(0.5)
+        view.flash()
+        self.assertTrue(view.ui.btnPee.highlighted)
+        # Back to normal stops the flashing
+        view.update_peeing_status(DogAction.states.NORMAL)
+        clock.advance(0.5)
+        view.flash()
+        self.assertFalse(view.ui.btnPee.highlighted)
+
 
 class ManualAdditionTestCase(unittest.TestCase):
     def setUp(self):
@@ -33,6 +71,13 @@ class ManualAdditionTestCase(unittest.TestCase):
         view = PuppyStatusView()
         self.assertTrue(view.manual_dialog)
 
+    def test_lazy_manual_window(self):
+        view = PuppyStatusView()
+        # The dialog isn't built until it's needed
+        self.assertIsNone(view._manual_dialog)
+        view.show_manual_add_dialog()
+        self.assertIsNotNone(view._manual_dialog)
+
     def test_show_manual_dialog(self):
         view = PuppyStatusView()
         view.show_manual_add_dialog()
@@ -45,3 +90,14 @@ class ManualAdditionTestCase(unittest.TestCase):
         view.show_manual_add_dialog()
         view.ui_manual.btnOK.click()
         self.assertFalse(view.manual_dialog.isVisible())
+
+    def test_manual_events_batched(self):
+        view = PuppyStatusView()
+        batches = []
+        view.events_added.connect(batches.append)
+        view.show_manual_add_dialog()
+        view.ui_manual.chkPeed.setChecked(True)
+        view.ui_manual.chkPooped.setChecked(True)
+        view.ui_manual.btnOK.click()
+        self.assertEqual(len(batches), 1)
+        self.assertEqual([event.action for event in batches[0]], [Action.PEE, Action.POOP])
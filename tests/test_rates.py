@@ -0,0 +1,45 @@
+import unittest
+
+from humblepi.rates import RateWindow, SECONDS_PER_DAY
+
+
+DAY = SECONDS_PER_DAY
+
+
+class RateWindowTest(unittest.TestCase):
+    def test_count_window(self):
+        window = RateWindow(count=3)
+        window.add(0)
+        window.add(1 * DAY)
+        self.assertEqual(window.rate(now=2 * DAY), 0)
+        window.add(2 * DAY)
+        window.add(3 * DAY)
+        # Last three events were over the last two days
+        self.assertEqual(len(window), 3)
+        self.assertEqual(window.rate(now=4 * DAY), 1.)
+
+    def test_duration_window(self):
+        window = RateWindow(duration=7 * DAY)
+        for day in range(14):
+            window.add(day * DAY)
+            window.add(day * DAY + 3600)
+        self.assertEqual(window.rate(now=14 * DAY - 1), 2.)
+        # Older events slide out of the window
+        self.assertEqual(window.rate(now=20 * DAY), 1 / 7)
+
+    def test_backdated_event(self):
+        window = RateWindow(count=3)
+        for day in (1, 2, 4):
+            window.add(day * DAY)
+        # Older than everything already kept
+        window.add(0)
+        self.assertEqual(list(window.timestamps), [1 * DAY, 2 * DAY, 4 * DAY])
+        # Lands inside the window
+        window.add(3 * DAY)
+        self.assertEqual(list(window.timestamps), [2 * DAY, 3 * DAY, 4 * DAY])
+
+    def test_needs_one_limit(self):
+        with self.assertRaises(ValueError):
+            RateWindow()
+        with self.assertRaises(ValueError):
+            RateWindow(count=3, duration=DAY)
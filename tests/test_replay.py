@@ -0,0 +1,79 @@
+import io
+import os
+import time
+import tempfile
+import datetime as dt
+import unittest
+from contextlib import redirect_stdout
+
+import pytz
+
+from humblepi.eventlog import Action, DogEvent, EventHistory
+from humblepi.replay import replay, weekly_summary, StateInterval, states, main
+from humblepi.storage import SQLiteLog
+
+
+chicago = pytz.timezone('America/Chicago')
+HOUR = 3600
+
+
+class ReplayTest(unittest.TestCase):
+    thresholds = {Action.PEE: (6 * HOUR, 8 * HOUR)}
+
+    def test_intervals(self):
+        t0 = 1565000000
+        history = EventHistory([DogEvent(t0 + 10 * HOUR, Action.PEE),
+                                DogEvent(t0, Action.PEE)])
+        intervals = replay(history, self.thresholds, until=t0 + 12 * HOUR)
+        self.assertEqual(intervals, [
+            StateInterval(t0, t0 + 6 * HOUR, Action.PEE, states.NORMAL),
+            StateInterval(t0 + 6 * HOUR, t0 + 8 * HOUR, Action.PEE, states.WARNING),
+            StateInterval(t0 + 8 * HOUR, t0 + 10 * HOUR, Action.PEE, states.OVERDUE),
+            StateInterval(t0 + 10 * HOUR, t0 + 12 * HOUR, Action.PEE, states.NORMAL),
+        ])
+
+    def test_weekly_summary(self):
+        # Sunday evening, so the overdue time crosses into the next week
+        t0 = chicago.localize(dt.datetime(2019, 8, 4, 16, 0))
+        history = EventHistory([DogEvent.from_datetime(t0, Action.PEE)])
+        intervals = replay(history, self.thresholds,
+                           until=int(t0.timestamp()) + 10 * HOUR)
+        summary = weekly_summary(intervals, timezone=chicago)
+        last_week = summary[dt.date(2019, 7, 29)]
+        this_week = summary[dt.date(2019, 8, 5)]
+        self.assertEqual(last_week[(Action.PEE, states.NORMAL)], 6)
+        self.assertEqual(last_week[(Action.PEE, states.WARNING)], 2)
+        self.assertEqual(this_week[(Action.PEE, states.OVERDUE)], 2)
+
+    def test_years_of_history(self):
+        # Five years of pees every 5 hours and poops every 20
+        t0 = 1500000000
+        history = EventHistory()
+        for i in range(5 * 365 * 24 // 5):
+            history.append(DogEvent(t0 + i * 5 * HOUR, Action.PEE))
+            if i % 4 == 0:
+                history.append(DogEvent(t0 + i * 5 * HOUR, Action.POOP))
+        thresholds = {Action.PEE: (6 * HOUR, 8 * HOUR),
+                      Action.POOP: (18 * HOUR, 24 * HOUR)}
+        start = time.perf_counter()
+        summary = weekly_summary(replay(history, thresholds), timezone=chicago)
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 1)
+        week = summary[max(summary)]
+        self.assertEqual(week[(Action.PEE, states.WARNING)], 0)
+        self.assertGreater(week[(Action.POOP, states.WARNING)], 0)
+
+    def test_main_sqlite(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            database = os.path.join(tmpdir, 'log.db')
+            event_log = SQLiteLog(database)
+            event_log.append([DogEvent(1565000000 + i * 12 * HOUR, Action.PEE)
+                              for i in range(14)])
+            event_log.close()
+            stdout = io.StringIO()
+            with redirect_stdout(stdout):
+                main([database])
+        # Twelve hours between pees, so four hours overdue each time
+        header, *weeks = stdout.getvalue().splitlines()
+        self.assertTrue(weeks)
+        self.assertGreater(sum(float(week.split('\t')[2]) for week in weeks), 0)
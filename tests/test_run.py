@@ -0,0 +1,166 @@
+import asyncio
+import importlib
+import os
+import sys
+import threading
+import types
+import unittest
+
+try:
+    import Adafruit_CharLCD
+except ImportError:
+    # The LCD library only installs on a Raspberry Pi
+    Adafruit_CharLCD = types.ModuleType('Adafruit_CharLCD')
+    (Adafruit_CharLCD.SELECT, Adafruit_CharLCD.RIGHT, Adafruit_CharLCD.DOWN,
+     Adafruit_CharLCD.UP, Adafruit_CharLCD.LEFT) = range(5)
+    sys.modules['Adafruit_CharLCD'] = Adafruit_CharLCD
+
+import run
+from basestatus import BaseStatus
+
+
+class FakeLCD():
+    """Records what is drawn instead of driving a display."""
+    def __init__(self):
+        self.calls = []
+
+    def clear(self):
+        self.calls.append(('clear',))
+
+    def set_color(self, *color):
+        self.calls.append(('set_color', color))
+
+    def message(self, text):
+        self.calls.append(('message', text))
+
+    def set_backlight(self, value):
+        pass
+
+    def is_pressed(self, button):
+        return False
+
+
+class TextStatus(BaseStatus):
+    text = 'Hello'
+
+    def update_lcd(self, force=False):
+        self.lcd.clear()
+        self.lcd.message(self.text)
+
+
+class SlowStatus(BaseStatus):
+    """Waits for the test, either part way through drawing or before
+    drawing anything."""
+    text = 'Slow'
+    wait_before = False
+
+    def __init__(self, lcd):
+        super().__init__(lcd)
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+
+    def update_lcd(self, force=False):
+        if self.wait_before:
+            self.started.set()
+            self.proceed.wait(timeout=5)
+        self.lcd.clear()
+        if not self.wait_before:
+            self.started.set()
+            self.proceed.wait(timeout=5)
+        self.lcd.message(self.text)
+
+
+class ScreenRegistryTest(unittest.TestCase):
+    def test_default_screens(self):
+        for spec in run.DEFAULT_SCREENS:
+            module_name, class_name = spec.split(':')
+            module = importlib.import_module(module_name)
+            self.assertTrue(issubclass(getattr(module, class_name), BaseStatus))
+        registry = run.ScreenRegistry.from_config(FakeLCD(), fpath=os.devnull)
+        self.assertEqual(registry.specs[:2], run.DEFAULT_SCREENS)
+
+    def test_lazy_load(self):
+        lcd = FakeLCD()
+        registry = run.ScreenRegistry(lcd, ['basestatus:BaseStatus', 'test_run:TextStatus'])
+        self.assertEqual(registry._screens, {})
+        status = registry[1]
+        self.assertIsInstance(status, TextStatus)
+        self.assertIs(status.lcd, lcd)
+        self.assertIs(registry[1], status)
+        self.assertEqual(list(registry._screens), ['test_run:TextStatus'])
+
+    def test_bad_screen(self):
+        registry = run.ScreenRegistry(FakeLCD(), [
+            'nosuchmodule:Screen', 'basestatus:NoSuchScreen',
+            'not a spec', 'basestatus:BaseStatus'])
+        with self.assertLogs('run', level='ERROR') as cm:
+            status = registry[0]
+        self.assertIsInstance(status, BaseStatus)
+        self.assertEqual(len(cm.records), 3)
+        self.assertEqual(registry.specs, ['basestatus:BaseStatus'])
+        # Nothing left to show
+        registry = run.ScreenRegistry(FakeLCD(), ['nosuchmodule:Screen'])
+        with self.assertLogs('run', level='ERROR'):
+            with self.assertRaises(IndexError):
+                registry[0]
+
+
+class LCDAppTest(unittest.TestCase):
+    def setUp(self):
+        self.fake_lcd = FakeLCD()
+        self.lcd = run.LockedLCD(self.fake_lcd)
+
+    def test_change_status(self):
+        registry = run.ScreenRegistry(self.lcd, [
+            'basestatus:BaseStatus', 'nosuchmodule:Screen', 'test_run:TextStatus'])
+        app = run.LCDApp(self.lcd, registry)
+        with self.assertLogs('run', level='ERROR'):
+            status = asyncio.run(app.change_status(+1))
+        self.assertIsInstance(status, TextStatus)
+        self.assertEqual(app.active_idx, 1)
+        self.assertIs(app.active_status, status)
+        status = asyncio.run(app.change_status(+1))
+        self.assertEqual(app.active_idx, 0)
+        self.assertIs(type(status), BaseStatus)
+
+    def test_atomic_draw(self):
+        """A second draw waits until the first screen has finished."""
+        slow = SlowStatus(self.lcd)
+        fast = TextStatus(self.lcd)
+        app = run.LCDApp(self.lcd, [slow, fast])
+        refresh = threading.Thread(target=app.draw, args=(slow.update_lcd, False))
+        refresh.start()
+        self.assertTrue(slow.started.wait(timeout=5))
+        press = threading.Thread(target=app.draw, args=(fast.update_lcd, True))
+        press.start()
+        press.join(timeout=0.1)
+        self.assertTrue(press.is_alive())
+        slow.proceed.set()
+        refresh.join()
+        press.join()
+        self.assertEqual(self.fake_lcd.calls, [
+            ('clear',), ('message', 'Slow'), ('clear',), ('message', 'Hello')])
+
+    def test_slow_work_not_locked(self):
+        """Work done before drawing doesn't hold up other screens."""
+        slow = SlowStatus(self.lcd)
+        slow.wait_before = True
+        fast = TextStatus(self.lcd)
+        app = run.LCDApp(self.lcd, [slow, fast])
+        refresh = threading.Thread(target=app.draw, args=(slow.update_lcd, False))
+        refresh.start()
+        try:
+            self.assertTrue(slow.started.wait(timeout=5))
+            app.draw(fast.update_lcd, True)
+            self.assertEqual(self.fake_lcd.calls, [('clear',), ('message', 'Hello')])
+        finally:
+            slow.proceed.set()
+            refresh.join()
+        self.assertEqual(self.fake_lcd.calls[2:], [('clear',), ('message', 'Slow')])
+        # The lock is released afterwards
+        self.assertTrue(self.lcd._lock.acquire(blocking=False))
+        self.lcd._lock.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
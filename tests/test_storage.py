@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import datetime as dt
+import tempfile
+import unittest
+
+import pytz
+
+from humblepi.engine import StatusEngine
+from humblepi.eventlog import Action, DogEvent, write_synthetic_log
+from humblepi.storage import TextLog, SQLiteLog, open_log, migrate, parse_benchmark
+
+
+chicago = pytz.timezone('America/Chicago')
+t0 = 1564657200
+
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_open_log(self):
+        self.assertIsInstance(open_log(self.path('log.tsv')), TextLog)
+        db = open_log(self.path('log.db'))
+        self.assertIsInstance(db, SQLiteLog)
+        db.close()
+        db = open_log(self.path('log.tsv'), backend='sqlite')
+        self.assertIsInstance(db, SQLiteLog)
+        db.close()
+        with self.assertRaises(ValueError):
+            open_log(self.path('log.tsv'), backend='csv')
+
+    def test_sqlite_log(self):
+        db = SQLiteLog(self.path('log.db'), dog='sheffield')
+        try:
+            mode, = db.connection.execute("PRAGMA journal_mode").fetchone()
+            self.assertEqual(mode, 'wal')
+            db.append([DogEvent(t0 + 60, Action.PEE), DogEvent(t0, Action.POOP),
+                       DogEvent(t0 + 30, Action.PEE)])
+            # Other dogs sharing the database are kept separate
+            other = SQLiteLog(self.path('log.db'), dog='rex')
+            other.append([DogEvent(t0 + 90, Action.PEE)])
+            other.close()
+            self.assertEqual(list(db.iter_events()), [
+                DogEvent(t0, Action.POOP), DogEvent(t0 + 30, Action.PEE),
+                DogEvent(t0 + 60, Action.PEE)])
+            since = dt.datetime.fromtimestamp(t0 + 1, tz=pytz.utc)
+            self.assertEqual(list(db.iter_events(since=since, actions=[Action.PEE])),
+                             [DogEvent(t0 + 30, Action.PEE), DogEvent(t0 + 60, Action.PEE)])
+            self.assertEqual(db.latest(Action.PEE), DogEvent(t0 + 60, Action.PEE))
+            self.assertIsNone(SQLiteLog(self.path('empty.db')).latest(Action.POOP))
+            self.assertEqual(len(db.load()), 3)
+        finally:
+            db.close()
+
+    def test_migrate(self):
+        tsv_path = self.path('log.tsv')
+        write_synthetic_log(tsv_path, 2500, timezone=chicago)
+        count = migrate(tsv_path, self.path('log.db'), timezone=chicago)
+        self.assertEqual(count, 2500)
+        text = TextLog(tsv_path, timezone=chicago).load()
+        db = SQLiteLog(self.path('log.db'))
+        try:
+            self.assertEqual(list(db.load()), list(text))
+        finally:
+            db.close()
+        # Migrating again only copies new events
+        TextLog(tsv_path, timezone=chicago).append([DogEvent(t0 + 17, Action.PEE)])
+        count = migrate(tsv_path, self.path('log.db'), timezone=chicago)
+        self.assertEqual(count, 1)
+        db = SQLiteLog(self.path('log.db'))
+        try:
+            self.assertEqual(len(db.load()), 2501)
+        finally:
+            db.close()
+
+    def test_sqlite_duplicates(self):
+        """Databases from before the unique index lose their duplicates."""
+        fpath = self.path('log.db')
+        connection = sqlite3.connect(fpath)
+        with connection:
+            connection.execute("CREATE TABLE events (dog TEXT NOT NULL,"
+                               " action INTEGER NOT NULL, epoch INTEGER NOT NULL)")
+            connection.executemany("INSERT INTO events VALUES (?, ?, ?)",
+                                   [('sheffield', 1, t0)] * 2 + [('sheffield', 2, t0 + 60)])
+        connection.close()
+        db = SQLiteLog(fpath)
+        try:
+            self.assertEqual(list(db.load()), [DogEvent(t0, Action.PEE),
+                                               DogEvent(t0 + 60, Action.POOP)])
+            self.assertEqual(db.append([DogEvent(t0, Action.PEE)]), 0)
+            self.assertEqual(len(db.load()), 2)
+        finally:
+            db.close()
+
+    def test_parse_benchmark(self):
+        rates = parse_benchmark(count=100, timezone=chicago, repeat=1)
+        self.assertEqual(set(rates), {'iso', 'legacy'})
+        for results in rates.values():
+            self.assertEqual(set(results), {'general', 'specialized'})
+            self.assertGreater(results['specialized'], 0)
+
+    def test_text_log_checksums(self):
+        fpath = self.path('log.tsv')
+        with open(fpath, mode='w') as fp:
+            fp.write('2019-08-04T19:5') # Cut short by a power cut
+        text = TextLog(fpath, timezone=chicago, checksums=True)
+        text.append([DogEvent(t0, Action.PEE)])
+        with open(fpath) as fp:
+            torn, record = fp.readlines()
+        # The new record isn't glued onto the torn one
+        self.assertEqual(torn, '2019-08-04T19:5\n')
+        self.assertEqual(len(record.split('\t')), 3)
+        self.assertEqual(text.recover(), 1)
+        self.assertEqual(list(text.iter_events()), [DogEvent(t0, Action.PEE)])
+
+    def test_engine_backend(self):
+        engine = StatusEngine()
+        engine.timezone = chicago
+        fpath = self.path('log.db')
+        when = chicago.localize(dt.datetime(2019, 9, 21, 13, 38, 35))
+        engine.log_action(fpath=fpath, pooped=True, when=when)
+        engine.open_log(fpath).close()
+        engine._logs = None
+        last_out, last_poop = engine.load_datetimes(fpath=fpath)
+        self.assertIsNone(last_out)
+        self.assertEqual(last_poop, when)
+        engine.open_log(fpath).close()